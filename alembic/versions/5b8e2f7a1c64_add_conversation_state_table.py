@@ -0,0 +1,99 @@
+"""Add conversation_state table
+
+Revision ID: 5b8e2f7a1c64
+Revises: d41c7a9e3b52
+Create Date: 2026-10-18 12:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b8e2f7a1c64'
+down_revision = 'd41c7a9e3b52'
+branch_labels = None
+depends_on = None
+
+
+# One row per (user, DM peer): latest visible message and unread messages received
+BACKFILL_DIRECT = """
+WITH sides AS (
+    SELECT id, created_at, sender_id AS user_id, receiver_id AS peer_id, 0 AS unread
+    FROM messages
+    WHERE receiver_id IS NOT NULL AND deleted_at IS NULL
+    UNION ALL
+    SELECT id, created_at, receiver_id, sender_id, CASE WHEN is_read THEN 0 ELSE 1 END
+    FROM messages
+    WHERE receiver_id IS NOT NULL AND deleted_at IS NULL AND receiver_id <> sender_id
+),
+ranked AS (
+    SELECT user_id, peer_id, id, created_at,
+           ROW_NUMBER() OVER (PARTITION BY user_id, peer_id ORDER BY created_at DESC, id DESC) AS rank,
+           SUM(unread) OVER (PARTITION BY user_id, peer_id) AS unread_count
+    FROM sides
+)
+INSERT INTO conversation_state (user_id, peer_id, last_message_id, last_activity, unread_count)
+SELECT user_id, peer_id, id, created_at, unread_count
+FROM ranked
+WHERE rank = 1
+"""
+
+# One row per group membership; group messages have no read state, so unread starts at 0
+BACKFILL_GROUPS = """
+WITH ranked AS (
+    SELECT group_id, id, created_at,
+           ROW_NUMBER() OVER (PARTITION BY group_id ORDER BY created_at DESC, id DESC) AS rank
+    FROM messages
+    WHERE group_id IS NOT NULL AND deleted_at IS NULL
+)
+INSERT INTO conversation_state (user_id, group_id, last_message_id, last_activity, unread_count)
+SELECT gm.user_id, gm.group_id, MAX(r.id), COALESCE(MAX(r.created_at), MAX(gm.joined_at)), 0
+FROM group_members gm
+LEFT JOIN ranked r ON r.group_id = gm.group_id AND r.rank = 1
+GROUP BY gm.user_id, gm.group_id
+"""
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    # create_all() may already have made the (empty) table
+    if 'conversation_state' not in inspector.get_table_names():
+        op.create_table(
+            'conversation_state',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('user_id', sa.Integer(), nullable=False),
+            sa.Column('peer_id', sa.Integer(), nullable=True),
+            sa.Column('group_id', sa.Integer(), nullable=True),
+            sa.Column('last_message_id', sa.Integer(), nullable=True),
+            sa.Column('last_activity', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+            sa.Column('unread_count', sa.Integer(), server_default='0', nullable=False),
+            sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+            sa.ForeignKeyConstraint(['peer_id'], ['users.id'], ),
+            sa.ForeignKeyConstraint(['group_id'], ['groups.id'], ),
+            sa.ForeignKeyConstraint(['last_message_id'], ['messages.id'], ),
+            sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index(op.f('ix_conversation_state_id'), 'conversation_state', ['id'], unique=False)
+        op.create_index(
+            'uq_conversation_state_user_peer', 'conversation_state', ['user_id', 'peer_id'], unique=True,
+            postgresql_where=sa.text('peer_id IS NOT NULL'), sqlite_where=sa.text('peer_id IS NOT NULL')
+        )
+        op.create_index(
+            'uq_conversation_state_user_group', 'conversation_state', ['user_id', 'group_id'], unique=True,
+            postgresql_where=sa.text('group_id IS NOT NULL'), sqlite_where=sa.text('group_id IS NOT NULL')
+        )
+        op.create_index('ix_conversation_state_user_activity', 'conversation_state', ['user_id', 'last_activity'], unique=False)
+
+    conn = op.get_bind()
+    if not conn.execute(sa.text('SELECT 1 FROM conversation_state LIMIT 1')).first():
+        conn.execute(sa.text(BACKFILL_DIRECT))
+        conn.execute(sa.text(BACKFILL_GROUPS))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_conversation_state_user_activity', table_name='conversation_state')
+    op.drop_index('uq_conversation_state_user_group', table_name='conversation_state')
+    op.drop_index('uq_conversation_state_user_peer', table_name='conversation_state')
+    op.drop_index(op.f('ix_conversation_state_id'), table_name='conversation_state')
+    op.drop_table('conversation_state')
@@ -0,0 +1,32 @@
+"""Add read/delivered receipt watermarks to conversation_state
+
+Revision ID: a7c3e9d21f05
+Revises: 5b8e2f7a1c64
+Create Date: 2026-10-18 15:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c3e9d21f05'
+down_revision = '5b8e2f7a1c64'
+branch_labels = None
+depends_on = None
+
+
+COLUMNS = ('last_read_message_id', 'last_delivered_message_id')
+
+
+def upgrade() -> None:
+    existing = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('conversation_state')}
+    for name in COLUMNS:
+        if name not in existing:
+            op.add_column('conversation_state', sa.Column(name, sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('conversation_state') as batch_op:
+        for name in reversed(COLUMNS):
+            batch_op.drop_column(name)
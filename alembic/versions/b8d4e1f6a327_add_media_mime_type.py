@@ -0,0 +1,28 @@
+"""Add mime_type to media
+
+Revision ID: b8d4e1f6a327
+Revises: f3b7d2e8a914
+Create Date: 2026-10-18 20:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8d4e1f6a327'
+down_revision = 'f3b7d2e8a914'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    existing = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('media')}
+    # Existing rows keep NULL; their type is guessed from the original filename
+    if 'mime_type' not in existing:
+        op.add_column('media', sa.Column('mime_type', sa.String(length=255), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('media') as batch_op:
+        batch_op.drop_column('mime_type')
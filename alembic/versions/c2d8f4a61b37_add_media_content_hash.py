@@ -0,0 +1,28 @@
+"""Add content_hash to media
+
+Revision ID: c2d8f4a61b37
+Revises: a7c3e9d21f05
+Create Date: 2026-10-18 17:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2d8f4a61b37'
+down_revision = 'a7c3e9d21f05'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    existing = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('media')}
+    # Existing files keep a NULL hash; new uploads are hashed while they stream
+    if 'content_hash' not in existing:
+        op.add_column('media', sa.Column('content_hash', sa.String(length=64), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('media') as batch_op:
+        batch_op.drop_column('content_hash')
@@ -0,0 +1,69 @@
+"""Add composite and partial indexes for hot access paths
+
+Revision ID: d41c7a9e3b52
+Revises: cba0dfcc803e
+Create Date: 2026-10-18 09:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41c7a9e3b52'
+down_revision = 'cba0dfcc803e'
+branch_labels = None
+depends_on = None
+
+
+NOT_DELETED = 'deleted_at IS NULL'
+
+# (name, table, columns, partial index predicate)
+INDEXES = [
+    ('ix_messages_group_created', 'messages', ['group_id', 'created_at', 'id'], NOT_DELETED),
+    ('ix_messages_direct_created', 'messages', ['sender_id', 'receiver_id', 'created_at', 'id'], NOT_DELETED),
+    ('ix_messages_receiver_unread', 'messages', ['receiver_id', 'is_read'], NOT_DELETED),
+    ('ix_group_members_group_user', 'group_members', ['group_id', 'user_id'], None),
+    ('ix_group_members_user_group', 'group_members', ['user_id', 'group_id'], None),
+    ('ix_reactions_message_user_emoji', 'reactions', ['message_id', 'user_id', 'emoji'], None),
+    ('ix_call_logs_caller_started', 'call_logs', ['caller_id', 'started_at'], None),
+    ('ix_call_logs_receiver_started', 'call_logs', ['receiver_id', 'started_at'], None),
+    ('ix_call_logs_started', 'call_logs', ['started_at'], None),
+]
+
+
+def _existing_indexes():
+    inspector = sa.inspect(op.get_bind())
+    existing = {}
+    for table in inspector.get_table_names():
+        existing[table] = {index['name'] for index in inspector.get_indexes(table)}
+    return existing
+
+
+def upgrade() -> None:
+    existing = _existing_indexes()
+    concurrently = op.get_bind().dialect.name == 'postgresql'
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction, and without it
+    # building an index on messages would block writes for the whole build
+    with op.get_context().autocommit_block():
+        for name, table, columns, where in INDEXES:
+            # Tables created by the app's create_all() may predate this
+            # migration, and may already carry the index
+            if table not in existing or name in existing[table]:
+                continue
+            predicate = sa.text(where) if where else None
+            op.create_index(
+                name, table, columns, unique=False,
+                postgresql_where=predicate,
+                sqlite_where=predicate,
+                postgresql_concurrently=concurrently
+            )
+
+
+def downgrade() -> None:
+    existing = _existing_indexes()
+    concurrently = op.get_bind().dialect.name == 'postgresql'
+    with op.get_context().autocommit_block():
+        for name, table, columns, where in reversed(INDEXES):
+            if name in existing.get(table, ()):
+                op.drop_index(name, table_name=table, postgresql_concurrently=concurrently)
@@ -0,0 +1,46 @@
+"""Add blobs table counting references to stored files
+
+Revision ID: d6f2a8c4e190
+Revises: b8d4e1f6a327
+Create Date: 2026-10-18 21:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd6f2a8c4e190'
+down_revision = 'b8d4e1f6a327'
+branch_labels = None
+depends_on = None
+
+
+# One row per distinct content, counting the media rows that share it
+BACKFILL = """
+INSERT INTO blobs (content_hash, ref_count)
+SELECT content_hash, COUNT(*)
+FROM media
+WHERE content_hash IS NOT NULL
+GROUP BY content_hash
+"""
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    # create_all() may already have made the (empty) table
+    if 'blobs' not in inspector.get_table_names():
+        op.create_table(
+            'blobs',
+            sa.Column('content_hash', sa.String(length=64), nullable=False),
+            sa.Column('ref_count', sa.Integer(), server_default='0', nullable=False),
+            sa.PrimaryKeyConstraint('content_hash')
+        )
+
+    conn = op.get_bind()
+    if not conn.execute(sa.text('SELECT 1 FROM blobs LIMIT 1')).first():
+        conn.execute(sa.text(BACKFILL))
+
+
+def downgrade() -> None:
+    op.drop_table('blobs')
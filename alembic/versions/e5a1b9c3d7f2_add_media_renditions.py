@@ -0,0 +1,28 @@
+"""Add renditions to media
+
+Revision ID: e5a1b9c3d7f2
+Revises: c2d8f4a61b37
+Create Date: 2026-10-18 19:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a1b9c3d7f2'
+down_revision = 'c2d8f4a61b37'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    existing = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('media')}
+    # Images uploaded before this keep NULL and are served at full size
+    if 'renditions' not in existing:
+        op.add_column('media', sa.Column('renditions', sa.JSON(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('media') as batch_op:
+        batch_op.drop_column('renditions')
@@ -0,0 +1,27 @@
+"""Index media by content_hash
+
+Revision ID: f3b7d2e8a914
+Revises: e5a1b9c3d7f2
+Create Date: 2026-10-18 19:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3b7d2e8a914'
+down_revision = 'e5a1b9c3d7f2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    existing = {index['name'] for index in sa.inspect(op.get_bind()).get_indexes('media')}
+    # Uploads look up an existing blob, and deletes its remaining references, by hash
+    if 'ix_media_content_hash' not in existing:
+        op.create_index('ix_media_content_hash', 'media', ['content_hash'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_media_content_hash', table_name='media')
@@ -1,7 +1,7 @@
 import os
 from fastapi import APIRouter, Depends, HTTPException, status, Request
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, contains_eager, joinedload
 from sqlalchemy import desc, func
 from typing import List, Optional
 from datetime import datetime, timedelta
@@ -10,6 +10,8 @@ import secrets
 from database import get_db
 import models
 import schemas
+from api.membership import membership_index
+from api import conversation_state, unread
 
 router = APIRouter(prefix="/api/admin", tags=["admin"])
 security = HTTPBasic()
@@ -191,11 +193,16 @@ def get_all_groups(
     db: Session = Depends(get_db)
 ):
     """Get all groups with member counts"""
-    groups = db.query(models.Group).offset(skip).limit(limit).all()
+    # Creator and member count come back with the page, not one query per group
+    member_count = db.query(func.count(models.GroupMember.id)).filter(
+        models.GroupMember.group_id == models.Group.id
+    ).correlate(models.Group).scalar_subquery()
+    groups = db.query(models.Group, member_count).options(
+        joinedload(models.Group.creator)
+    ).order_by(models.Group.id).offset(skip).limit(limit).all()
 
-    # Add member count to each group
     result = []
-    for group in groups:
+    for group, count in groups:
         group_dict = {
             "id": group.id,
             "name": group.name,
@@ -204,7 +211,7 @@ def get_all_groups(
             "created_by": group.created_by,
             "created_at": group.created_at,
             "updated_at": group.updated_at,
-            "member_count": db.query(models.GroupMember).filter(models.GroupMember.group_id == group.id).count(),
+            "member_count": count,
             "creator_username": group.creator.username if group.creator else f"User {group.created_by}"
         }
         result.append(group_dict)
@@ -237,7 +244,9 @@ def create_group_admin(
         is_admin=True
     )
     db.add(group_member)
+    conversation_state.execute(db, conversation_state.member_joined(db.get_bind().dialect.name, db_group.id, created_by))
     db.commit()
+    membership_index.invalidate(db_group.id)
 
     # Log the action
     log_moderation_action(db, admin, "create_group", group_id=db_group.id, reason="Admin created group")
@@ -258,8 +267,11 @@ def delete_group_admin(
     # Log the action before deletion
     log_moderation_action(db, admin, "delete_group", group_id=group_id, reason="Admin deleted group")
 
+    counts = conversation_state.execute(db, conversation_state.group_deleted(group_id))
     db.delete(db_group)
     db.commit()
+    unread.push_from_thread(counts)
+    membership_index.invalidate(group_id)
 
     return {"message": "Group deleted successfully"}
 
@@ -274,7 +286,9 @@ def get_group_members(
     if not group:
         raise HTTPException(status_code=404, detail="Group not found")
 
-    members = db.query(models.GroupMember).filter(models.GroupMember.group_id == group_id).all()
+    members = db.query(models.GroupMember).options(
+        joinedload(models.GroupMember.user)
+    ).filter(models.GroupMember.group_id == group_id).all()
 
     result = []
     for member in members:
@@ -303,7 +317,13 @@ def get_messages_for_moderation(
     db: Session = Depends(get_db)
 ):
     """Get messages for moderation"""
-    query = db.query(models.Message).join(models.User, models.Message.sender_id == models.User.id).filter(models.Message.deleted_at.is_(None))
+    query = db.query(models.Message).join(
+        models.User, models.Message.sender_id == models.User.id
+    ).options(
+        contains_eager(models.Message.sender),
+        joinedload(models.Message.group),
+        joinedload(models.Message.receiver)
+    ).filter(models.Message.deleted_at.is_(None))
 
     if user_id:
         query = query.filter(models.Message.sender_id == user_id)
@@ -356,8 +376,13 @@ def delete_message_admin(
         raise HTTPException(status_code=404, detail="Message not found")
 
     # Soft delete
-    db_message.deleted_at = datetime.utcnow()
+    counts = []
+    if db_message.deleted_at is None:
+        db_message.deleted_at = datetime.utcnow()
+        db.flush()
+        counts = conversation_state.execute(db, conversation_state.message_deleted(db_message))
     db.commit()
+    unread.push_from_thread(counts)
 
     # Log the action
     log_moderation_action(db, admin, "delete_message",
@@ -375,7 +400,12 @@ def get_call_logs(
     db: Session = Depends(get_db)
 ):
     """Get call logs with user information"""
-    query = db.query(models.CallLog).join(models.User, models.CallLog.caller_id == models.User.id)
+    query = db.query(models.CallLog).join(
+        models.User, models.CallLog.caller_id == models.User.id
+    ).options(
+        contains_eager(models.CallLog.caller),
+        joinedload(models.CallLog.receiver)
+    )
 
     if user_id:
         query = query.filter(
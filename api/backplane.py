@@ -0,0 +1,389 @@
+"""
+Cross-process pub/sub backplane for WebSocket routing.
+
+Each worker subscribes to a channel per user that has a live socket on it,
+so a publish for a user reaches exactly the workers holding that user's
+sessions. Two implementations are provided:
+
+- InMemoryBackplane: an in-process broker, for single-process deployments
+  and tests.
+- RedisBackplane: speaks the Redis protocol (RESP) over a plain TCP socket,
+  so it works against Redis, KeyDB, Valkey or the LocalBroker below.
+
+Run ``python -m api.backplane`` to start a LocalBroker for local
+multi-worker development without installing Redis.
+"""
+import os
+import abc
+import logging
+import asyncio
+from typing import Callable, Dict, Iterable, List, Optional, Set
+from urllib.parse import urlparse
+
+CHANNEL_PREFIX = os.getenv("WS_BACKPLANE_CHANNEL_PREFIX", "webchat:user:")
+CONNECT_TIMEOUT = float(os.getenv("WS_BACKPLANE_CONNECT_TIMEOUT", 10))
+
+logger = logging.getLogger(__name__)
+
+# Called with (user_id, envelope) for every frame published to a user
+# this worker is subscribed to
+DeliverCallback = Callable[[int, str], None]
+
+class Backplane(abc.ABC):
+    """Interface for routing frames to the worker that holds a user's sockets"""
+
+    def __init__(self, channel_prefix: str = CHANNEL_PREFIX):
+        self.channel_prefix = channel_prefix
+        self.deliver: Optional[DeliverCallback] = None
+
+    def channel_for(self, user_id: int) -> str:
+        """Channel name for a user"""
+        return f"{self.channel_prefix}{user_id}"
+
+    def user_for(self, channel: str) -> Optional[int]:
+        """User ID for a channel name, or None if it isn't one of ours"""
+        if not channel.startswith(self.channel_prefix):
+            return None
+        try:
+            return int(channel[len(self.channel_prefix):])
+        except ValueError:
+            return None
+
+    async def start(self, deliver: DeliverCallback):
+        """Connect to the broker and start delivering incoming frames"""
+        self.deliver = deliver
+
+    async def stop(self):
+        """Disconnect from the broker"""
+        self.deliver = None
+
+    @abc.abstractmethod
+    async def subscribe(self, user_id: int):
+        """Start receiving frames published to a user"""
+
+    @abc.abstractmethod
+    async def unsubscribe(self, user_id: int):
+        """Stop receiving frames published to a user"""
+
+    @abc.abstractmethod
+    async def publish(self, user_ids: Iterable[int], envelope: str) -> Dict[int, int]:
+        """Publish a frame to several users; returns the number of receiving workers per user"""
+
+class InMemoryBroker:
+    """Channel registry shared by every InMemoryBackplane in the process"""
+
+    def __init__(self):
+        self.channels: Dict[str, Set["InMemoryBackplane"]] = {}
+
+    def publish(self, channel: str, envelope: str) -> int:
+        subscribers = list(self.channels.get(channel, ()))
+        for subscriber in subscribers:
+            subscriber._receive(channel, envelope)
+        return len(subscribers)
+
+default_broker = InMemoryBroker()
+
+class InMemoryBackplane(Backplane):
+    """Backplane for a single process; several managers can share one broker"""
+
+    def __init__(self, broker: Optional[InMemoryBroker] = None, channel_prefix: str = CHANNEL_PREFIX):
+        super().__init__(channel_prefix)
+        self.broker = broker or default_broker
+        self.subscribed: Set[str] = set()
+
+    async def stop(self):
+        for channel in self.subscribed:
+            self.broker.channels.get(channel, set()).discard(self)
+        self.subscribed.clear()
+        await super().stop()
+
+    async def subscribe(self, user_id: int):
+        channel = self.channel_for(user_id)
+        self.broker.channels.setdefault(channel, set()).add(self)
+        self.subscribed.add(channel)
+
+    async def unsubscribe(self, user_id: int):
+        channel = self.channel_for(user_id)
+        subscribers = self.broker.channels.get(channel)
+        if subscribers is not None:
+            subscribers.discard(self)
+            if not subscribers:
+                del self.broker.channels[channel]
+        self.subscribed.discard(channel)
+
+    async def publish(self, user_ids: Iterable[int], envelope: str) -> Dict[int, int]:
+        return {
+            user_id: self.broker.publish(self.channel_for(user_id), envelope)
+            for user_id in user_ids
+        }
+
+    def _receive(self, channel: str, envelope: str):
+        user_id = self.user_for(channel)
+        if self.deliver is not None and user_id is not None:
+            self.deliver(user_id, envelope)
+
+# --- Redis protocol -------------------------------------------------------
+
+class RespError(Exception):
+    """Error reply from a RESP server"""
+
+def encode_bulk(value) -> bytes:
+    """Encode a value as a RESP bulk string"""
+    data = value if isinstance(value, bytes) else str(value).encode()
+    return f"${len(data)}\r\n".encode() + data + b"\r\n"
+
+def encode_command(*args) -> bytes:
+    """Encode a command as a RESP array of bulk strings"""
+    return f"*{len(args)}\r\n".encode() + b"".join(encode_bulk(arg) for arg in args)
+
+async def read_reply(reader: asyncio.StreamReader):
+    """Read a single RESP reply; bulk strings are returned as bytes"""
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("Connection closed by broker")
+    prefix, body = line[:1], line[1:-2]
+    if prefix == b"+":
+        return body.decode()
+    if prefix == b"-":
+        raise RespError(body.decode())
+    if prefix == b":":
+        return int(body)
+    if prefix == b"$":
+        length = int(body)
+        if length == -1:
+            return None
+        data = await reader.readexactly(length + 2)
+        return data[:-2]
+    if prefix == b"*":
+        length = int(body)
+        if length == -1:
+            return None
+        return [await read_reply(reader) for _ in range(length)]
+    raise RespError(f"Unexpected reply: {line!r}")
+
+class RedisBackplane(Backplane):
+    """Backplane over the Redis pub/sub protocol.
+
+    Uses one connection for PUBLISH and a second one in subscriber mode,
+    since a subscribed connection can't issue regular commands.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        channel_prefix: str = CHANNEL_PREFIX,
+        reconnect_delay: float = 1.0,
+        connect_timeout: float = CONNECT_TIMEOUT
+    ):
+        super().__init__(channel_prefix)
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.reconnect_delay = reconnect_delay
+        self.connect_timeout = connect_timeout
+        self.subscribed: Set[str] = set()
+        self._publish_lock = asyncio.Lock()
+        self._publisher: Optional[tuple] = None
+        self._subscriber_writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._subscriber_ready = asyncio.Event()
+
+    async def _open(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        if self.password:
+            writer.write(encode_command("AUTH", self.password))
+            await writer.drain()
+            await read_reply(reader)
+        return reader, writer
+
+    async def start(self, deliver: DeliverCallback):
+        await super().start(deliver)
+        try:
+            self._publisher = await asyncio.wait_for(self._open(), timeout=self.connect_timeout)
+            self._reader_task = asyncio.create_task(self._subscriber_loop())
+            # The subscriber loop keeps retrying on its own; don't hang startup on it
+            await asyncio.wait_for(self._subscriber_ready.wait(), timeout=self.connect_timeout)
+        except asyncio.TimeoutError:
+            await self.stop()
+            raise ConnectionError(
+                f"Backplane broker at {self.host}:{self.port} didn't accept connections "
+                f"within {self.connect_timeout:g}s"
+            ) from None
+        except (ConnectionError, OSError):
+            await self.stop()
+            raise
+
+    async def stop(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            self._reader_task = None
+        for writer in (self._publisher[1] if self._publisher else None, self._subscriber_writer):
+            if writer is not None:
+                writer.close()
+        self._publisher = None
+        self._subscriber_writer = None
+        await super().stop()
+
+    async def _subscriber_loop(self):
+        """Read pushed messages, reconnecting and resubscribing if the broker goes away"""
+        while True:
+            try:
+                reader, writer = await self._open()
+                self._subscriber_writer = writer
+                if self.subscribed:
+                    writer.write(encode_command("SUBSCRIBE", *self.subscribed))
+                    await writer.drain()
+                self._subscriber_ready.set()
+
+                while True:
+                    reply = await read_reply(reader)
+                    if isinstance(reply, list) and len(reply) == 3 and reply[0] == b"message":
+                        user_id = self.user_for(reply[1].decode())
+                        if user_id is not None and self.deliver is not None:
+                            self.deliver(user_id, reply[2].decode())
+            except asyncio.CancelledError:
+                raise
+            except (ConnectionError, OSError, asyncio.IncompleteReadError) as e:
+                logger.warning("Backplane subscriber connection lost: %s, reconnecting", e)
+                self._subscriber_writer = None
+                await asyncio.sleep(self.reconnect_delay)
+
+    async def _send_subscriber_command(self, *args):
+        if self._subscriber_writer is not None:
+            self._subscriber_writer.write(encode_command(*args))
+            await self._subscriber_writer.drain()
+
+    async def subscribe(self, user_id: int):
+        channel = self.channel_for(user_id)
+        if channel not in self.subscribed:
+            self.subscribed.add(channel)
+            await self._send_subscriber_command("SUBSCRIBE", channel)
+
+    async def unsubscribe(self, user_id: int):
+        channel = self.channel_for(user_id)
+        if channel in self.subscribed:
+            self.subscribed.discard(channel)
+            await self._send_subscriber_command("UNSUBSCRIBE", channel)
+
+    async def publish(self, user_ids: Iterable[int], envelope: str) -> Dict[int, int]:
+        user_ids = list(user_ids)
+        if not user_ids:
+            return {}
+        # Pipeline every PUBLISH in one write and read the replies back in order
+        commands = b"".join(
+            encode_command("PUBLISH", self.channel_for(user_id), envelope)
+            for user_id in user_ids
+        )
+        async with self._publish_lock:
+            try:
+                if self._publisher is None:
+                    self._publisher = await self._open()
+                reader, writer = self._publisher
+                writer.write(commands)
+                await writer.drain()
+                receivers = [await read_reply(reader) for _ in user_ids]
+            except (ConnectionError, OSError, asyncio.IncompleteReadError) as e:
+                logger.warning("Backplane publish failed: %s", e)
+                self._publisher = None
+                return {user_id: 0 for user_id in user_ids}
+        return dict(zip(user_ids, receivers))
+
+def create_backplane(url: Optional[str]) -> Optional[Backplane]:
+    """Build a backplane from a URL: memory:// or redis://host:port, empty for none"""
+    if not url:
+        return None
+    scheme = urlparse(url).scheme
+    if scheme == "memory":
+        return InMemoryBackplane()
+    if scheme == "redis":
+        return RedisBackplane(url)
+    raise ValueError(f"Unsupported backplane URL: {url}")
+
+# --- Local stand-in broker ------------------------------------------------
+
+class LocalBroker:
+    """Minimal RESP pub/sub server (PUBLISH, SUBSCRIBE, UNSUBSCRIBE, PING).
+
+    A stand-in for Redis when developing or testing multi-worker routing.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 6379):
+        self.host = host
+        self.port = port
+        self.channels: Dict[str, Set[asyncio.StreamWriter]] = {}
+        # Connected client -> the task serving it
+        self.clients: Dict[asyncio.StreamWriter, asyncio.Task] = {}
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        # Pick up the real port when started with port 0
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        # Closing a client's connection ends its handler with EOF rather than
+        # leaving it to be cancelled mid-read at shutdown
+        handlers = list(self.clients.values())
+        for writer in list(self.clients):
+            writer.close()
+        await asyncio.gather(*handlers, return_exceptions=True)
+
+    def _subscriptions_of(self, writer: asyncio.StreamWriter) -> List[str]:
+        return [channel for channel, writers in self.channels.items() if writer in writers]
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.clients[writer] = asyncio.current_task()
+        try:
+            while True:
+                command = await read_reply(reader)
+                if not isinstance(command, list) or not command:
+                    continue
+                name = command[0].decode().upper()
+                args = [arg.decode() for arg in command[1:]]
+
+                if name == "PUBLISH":
+                    channel, payload = args
+                    subscribers = list(self.channels.get(channel, ()))
+                    for subscriber in subscribers:
+                        subscriber.write(encode_command("message", channel, payload))
+                    writer.write(f":{len(subscribers)}\r\n".encode())
+                elif name == "SUBSCRIBE":
+                    for channel in args:
+                        self.channels.setdefault(channel, set()).add(writer)
+                        count = len(self._subscriptions_of(writer))
+                        writer.write(b"*3\r\n" + encode_bulk("subscribe") + encode_bulk(channel) +
+                                     f":{count}\r\n".encode())
+                elif name == "UNSUBSCRIBE":
+                    for channel in args:
+                        self.channels.get(channel, set()).discard(writer)
+                        count = len(self._subscriptions_of(writer))
+                        writer.write(b"*3\r\n" + encode_bulk("unsubscribe") + encode_bulk(channel) +
+                                     f":{count}\r\n".encode())
+                elif name in ("PING", "AUTH"):
+                    writer.write(b"+PONG\r\n" if name == "PING" else b"+OK\r\n")
+                else:
+                    writer.write(f"-ERR unknown command '{name}'\r\n".encode())
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.clients.pop(writer, None)
+            for writers in self.channels.values():
+                writers.discard(writer)
+            writer.close()
+
+if __name__ == "__main__":
+    from logging_config import setup_logging
+    setup_logging()
+
+    async def _serve():
+        broker = LocalBroker(port=int(os.getenv("WS_BACKPLANE_PORT", 6379)))
+        await broker.start()
+        logger.info("Local backplane broker listening on %s:%s", broker.host, broker.port)
+        await asyncio.Event().wait()
+
+    asyncio.run(_serve())
@@ -0,0 +1,101 @@
+"""
+Content-addressed keys for uploaded files.
+
+Files are stored once per distinct content, under blobs/ab/cd/<sha256> in
+the storage backend. Every media row is one reference to its blob
+(`media.content_hash`), so forwarding the same image to many chats costs
+one stored file; the blob and its renditions are removed when the last row
+pointing at it is deleted. Rows from before content addressing keep their
+own file_path and have no content_hash.
+
+References are counted in the `blobs` table. acquire() and release() change
+the count with a single statement that locks the blob's row until the
+transaction ends, so storing a blob and committing its media row, or
+deleting the last row and the blob, happen under that row lock: an upload
+in one worker can't reuse a blob that a delete in another worker is about
+to remove. Within a process, `locked()` queues work on the same content
+in front of the database so it doesn't wait on row locks. Work on
+different content doesn't contend.
+"""
+import os
+import asyncio
+import weakref
+from contextlib import asynccontextmanager
+from typing import Optional, Tuple
+
+from sqlalchemy import delete, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+from api.storage import storage
+
+BLOB_PREFIX = "blobs"
+
+blobs_table = models.Blob.__table__
+
+_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+# One lock per content hash, dropped once nobody holds or waits for it
+_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+def blob_key(content_hash: str) -> str:
+    """Storage key of the blob for a SHA-256 hex digest"""
+    return f"{BLOB_PREFIX}/{content_hash[:2]}/{content_hash[2:4]}/{content_hash}"
+
+@asynccontextmanager
+async def locked(content_hash: str):
+    """Serialize this process's work on one blob"""
+    lock = _locks.get(content_hash)
+    if lock is None:
+        lock = _locks[content_hash] = asyncio.Lock()
+    async with lock:
+        yield
+
+async def acquire(db: AsyncSession, content_hash: str) -> bool:
+    """Count a new reference in the session's transaction.
+
+    Returns True for the blob's first reference. The blob's row stays
+    locked until the transaction ends.
+    """
+    dialect = db.get_bind().dialect.name
+    try:
+        insert = _INSERTS[dialect](blobs_table)
+    except KeyError:
+        raise NotImplementedError(f"blob reference counts are not implemented for {dialect}")
+    stmt = insert.values(content_hash=content_hash, ref_count=1).on_conflict_do_update(
+        index_elements=[blobs_table.c.content_hash],
+        set_={"ref_count": blobs_table.c.ref_count + 1}
+    ).returning(blobs_table.c.ref_count)
+    return (await db.execute(stmt)).scalar_one() == 1
+
+async def release(db: AsyncSession, content_hash: str) -> bool:
+    """Drop a reference in the session's transaction.
+
+    Returns True when it was the last one; the count's row is then deleted
+    and the blob should be removed before the transaction commits.
+    """
+    count = (await db.execute(
+        update(blobs_table)
+        .where(blobs_table.c.content_hash == content_hash)
+        .values(ref_count=blobs_table.c.ref_count - 1)
+        .returning(blobs_table.c.ref_count)
+    )).scalar()
+    if count is None or count > 0:
+        return False
+    await db.execute(delete(blobs_table).where(blobs_table.c.content_hash == content_hash))
+    return True
+
+async def store(staged_path: str, content_hash: str, content_type: Optional[str] = None) -> Tuple[str, bool]:
+    """Move a fully written file into storage.
+
+    Returns (key, created). When the content is already stored the staged
+    copy is dropped and created is False. Call after acquire(), before the
+    transaction commits.
+    """
+    key = blob_key(content_hash)
+    if await storage.exists(key):
+        os.remove(staged_path)
+        return key, False
+    await storage.put_file(key, staged_path, content_type=content_type, content_hash=content_hash)
+    return key, True
@@ -0,0 +1,247 @@
+"""
+Per-user conversation summaries, kept in the `conversation_state` table.
+
+Each user has one row per DM peer and per group holding the last message,
+the time of last activity and the unread count. Every write that changes
+what an inbox shows calls one of the builders below and executes the
+returned statements in its own transaction, so the summary commits or
+rolls back together with the change. Reading an inbox is then a range scan
+of (user_id, last_activity).
+
+The builders return plain statements so sync routers and the async
+WebSocket path can share them. Statements that change unread counts return
+the affected (user_id, peer_id, group_id, unread_count) rows, which feed
+the in-memory counters in api.unread.
+"""
+from collections import Counter
+from typing import Dict, Iterable, List, Mapping, Tuple
+
+from sqlalchemy import and_, case, func, literal, or_, select, update, delete
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+import models
+
+state_table = models.ConversationState.__table__
+messages_table = models.Message.__table__
+members_table = models.GroupMember.__table__
+
+# Returned by every statement that changes an unread count
+COUNT_COLUMNS = (state_table.c.user_id, state_table.c.peer_id, state_table.c.group_id, state_table.c.unread_count)
+
+_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+def _insert(dialect: str):
+    try:
+        return _INSERTS[dialect](state_table)
+    except KeyError:
+        raise NotImplementedError(f"conversation_state upserts are not implemented for {dialect}")
+
+def execute(db: Session, statements: List) -> List:
+    """Run builder output on a sync session (the caller commits).
+
+    Returns the unread-count rows the statements reported.
+    """
+    rows = []
+    for statement in statements:
+        result = db.execute(statement)
+        if result.returns_rows:
+            rows.extend(result.all())
+    return rows
+
+def as_row(message: models.Message) -> Dict:
+    """The fields messages_sent() reads, from a flushed Message"""
+    return {
+        "id": message.id,
+        "sender_id": message.sender_id,
+        "receiver_id": message.receiver_id,
+        "group_id": message.group_id,
+        "created_at": message.created_at,
+    }
+
+def _advance(excluded) -> Dict:
+    """ON CONFLICT assignments: move to the newer message and add unread"""
+    newer = excluded.last_message_id > func.coalesce(state_table.c.last_message_id, 0)
+    return {
+        "last_message_id": case((newer, excluded.last_message_id), else_=state_table.c.last_message_id),
+        "last_activity": case((newer, excluded.last_activity), else_=state_table.c.last_activity),
+        "unread_count": state_table.c.unread_count + excluded.unread_count,
+    }
+
+def _latest(message: Mapping, latest: Mapping) -> Mapping:
+    return message if latest is None or message["id"] > latest["id"] else latest
+
+def messages_sent(dialect: str, messages: Iterable[Mapping]) -> List:
+    """Statements recording newly saved messages.
+
+    `messages` may be a whole write batch; it is folded into one upsert for
+    all direct conversations plus one per group.
+    """
+    direct: Dict[Tuple[int, int], Dict] = {}
+    groups: Dict[int, Dict] = {}
+
+    for message in messages:
+        if message["group_id"]:
+            group = groups.setdefault(message["group_id"], {"latest": None, "count": 0, "senders": Counter()})
+            group["latest"] = _latest(message, group["latest"])
+            group["count"] += 1
+            group["senders"][message["sender_id"]] += 1
+        elif message["receiver_id"]:
+            sender_id, receiver_id = message["sender_id"], message["receiver_id"]
+            sides = [(sender_id, receiver_id, 0)]
+            if receiver_id != sender_id:
+                sides.append((receiver_id, sender_id, 1))
+            for user_id, peer_id, unread in sides:
+                row = direct.setdefault((user_id, peer_id), {"latest": None, "unread": 0})
+                row["latest"] = _latest(message, row["latest"])
+                row["unread"] += unread
+
+    statements = []
+    if direct:
+        stmt = _insert(dialect).values([
+            {
+                "user_id": user_id,
+                "peer_id": peer_id,
+                "last_message_id": row["latest"]["id"],
+                "last_activity": row["latest"]["created_at"],
+                "unread_count": row["unread"],
+            }
+            for (user_id, peer_id), row in direct.items()
+        ])
+        statements.append(stmt.on_conflict_do_update(
+            index_elements=["user_id", "peer_id"],
+            index_where=state_table.c.peer_id.isnot(None),
+            set_=_advance(stmt.excluded)
+        ).returning(*COUNT_COLUMNS))
+
+    for group_id, group in groups.items():
+        latest = group["latest"]
+        # Each member gains the batch's messages minus the ones they sent
+        unread = case(
+            *((members_table.c.user_id == sender_id, group["count"] - sent)
+              for sender_id, sent in group["senders"].items()),
+            else_=group["count"]
+        )
+        stmt = _insert(dialect).from_select(
+            ["user_id", "group_id", "last_message_id", "last_activity", "unread_count"],
+            select(
+                members_table.c.user_id,
+                literal(group_id),
+                literal(latest["id"]),
+                literal(latest["created_at"], state_table.c.last_activity.type),
+                unread
+            ).where(members_table.c.group_id == group_id)
+        )
+        statements.append(stmt.on_conflict_do_update(
+            index_elements=["user_id", "group_id"],
+            index_where=state_table.c.group_id.isnot(None),
+            set_=_advance(stmt.excluded)
+        ).returning(*COUNT_COLUMNS))
+
+    return statements
+
+def unread_changed(message: models.Message, delta: int) -> List:
+    """Statements for a direct message flipping between read and unread"""
+    if not message.receiver_id or message.receiver_id == message.sender_id:
+        return []
+    return [
+        update(state_table)
+        .where(state_table.c.user_id == message.receiver_id, state_table.c.peer_id == message.sender_id)
+        .values(unread_count=case(
+            (state_table.c.unread_count + delta > 0, state_table.c.unread_count + delta),
+            else_=0
+        ))
+        .returning(*COUNT_COLUMNS)
+    ]
+
+def message_deleted(message: models.Message) -> List:
+    """Statements for a message that has just been soft-deleted.
+
+    Run them after the deletion is flushed: conversations that showed the
+    message fall back to the newest one still visible.
+    """
+    m = messages_table
+    s = state_table
+    newest_first = (m.c.created_at.desc(), m.c.id.desc())
+
+    if message.group_id:
+        conversation = s.c.group_id == message.group_id
+        replacement = (
+            select(m.c.id)
+            .where(m.c.group_id == message.group_id, m.c.deleted_at.is_(None))
+            .order_by(*newest_first).limit(1).scalar_subquery()
+        )
+        # Counted by every other member whose read watermark hadn't reached it
+        counted = and_(
+            conversation,
+            s.c.user_id != message.sender_id,
+            func.coalesce(s.c.last_read_message_id, 0) < message.id
+        )
+    elif message.receiver_id:
+        conversation = or_(
+            and_(s.c.user_id == message.sender_id, s.c.peer_id == message.receiver_id),
+            and_(s.c.user_id == message.receiver_id, s.c.peer_id == message.sender_id),
+        )
+        replacement = (
+            select(m.c.id)
+            .where(
+                m.c.deleted_at.is_(None),
+                or_(
+                    and_(m.c.sender_id == s.c.user_id, m.c.receiver_id == s.c.peer_id),
+                    and_(m.c.sender_id == s.c.peer_id, m.c.receiver_id == s.c.user_id),
+                )
+            )
+            .order_by(*newest_first).limit(1).scalar_subquery()
+        )
+        counted = None
+        if not message.is_read and message.receiver_id != message.sender_id:
+            counted = and_(s.c.user_id == message.receiver_id, s.c.peer_id == message.sender_id)
+    else:
+        return []
+
+    statements = [
+        update(s)
+        .where(conversation, s.c.last_message_id == message.id)
+        .values(last_message_id=replacement)
+    ]
+    if counted is not None:
+        statements.append(
+            update(s)
+            .where(counted, s.c.unread_count > 0)
+            .values(unread_count=s.c.unread_count - 1)
+            .returning(*COUNT_COLUMNS)
+        )
+    return statements
+
+def member_joined(dialect: str, group_id: int, user_id: int) -> List:
+    """Statements giving a new group member their inbox row"""
+    m = messages_table
+    latest = (
+        select(m.c.id)
+        .where(m.c.group_id == group_id, m.c.deleted_at.is_(None))
+        .order_by(m.c.created_at.desc(), m.c.id.desc()).limit(1).scalar_subquery()
+    )
+    stmt = _insert(dialect).values(
+        user_id=user_id,
+        group_id=group_id,
+        last_message_id=latest,
+        last_activity=func.now(),
+        unread_count=0
+    )
+    return [stmt.on_conflict_do_nothing(
+        index_elements=["user_id", "group_id"],
+        index_where=state_table.c.group_id.isnot(None)
+    )]
+
+# A deleted row leaves nothing unread
+_CLEARED_COLUMNS = (state_table.c.user_id, state_table.c.peer_id, state_table.c.group_id, literal(0))
+
+def member_left(group_id: int, user_id: int) -> List:
+    return [
+        delete(state_table)
+        .where(state_table.c.group_id == group_id, state_table.c.user_id == user_id)
+        .returning(*_CLEARED_COLUMNS)
+    ]
+
+def group_deleted(group_id: int) -> List:
+    return [delete(state_table).where(state_table.c.group_id == group_id).returning(*_CLEARED_COLUMNS)]
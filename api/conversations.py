@@ -0,0 +1,39 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+from typing import List
+from database import get_db
+import models
+import schemas
+
+router = APIRouter()
+
+@router.get("/{user_id}", response_model=List[schemas.Conversation])
+def get_conversations(user_id: int, db: Session = Depends(get_db)):
+    """Get a user's inbox: every DM peer and group, most recently active first"""
+    # conversation_state is maintained on write, so this is one range scan of
+    # ix_conversation_state_user_activity plus primary-key joins
+    state = models.ConversationState
+    rows = db.query(state, models.Message, models.User, models.Group).outerjoin(
+        models.Message, models.Message.id == state.last_message_id
+    ).outerjoin(
+        models.User, models.User.id == state.peer_id
+    ).outerjoin(
+        models.Group, models.Group.id == state.group_id
+    ).filter(
+        state.user_id == user_id
+    ).order_by(state.last_activity.desc(), state.id.desc()).all()
+
+    # Only an empty inbox needs the extra lookup to tell "no chats" from "no user"
+    if not rows and not db.query(models.User.id).filter(models.User.id == user_id).first():
+        raise HTTPException(status_code=404, detail="User not found")
+
+    return [
+        schemas.Conversation(
+            type="group" if row.group_id else "direct",
+            peer=peer,
+            group=group,
+            last_message=message,
+            unread_count=row.unread_count
+        )
+        for row, message, peer, group in rows
+    ]
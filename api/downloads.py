@@ -0,0 +1,159 @@
+"""
+Conditional and ranged responses for stored files.
+
+Starlette's FileResponse always sends the whole file, with an ETag made up
+from the file's mtime, and ignores If-None-Match, If-Modified-Since and
+Range. file_response() answers a matching revalidation with an empty 304,
+and a single byte range with 206 and just those bytes. A repeat avatar or
+image load costs no body, and video and audio can seek without fetching
+everything before the seek point.
+"""
+import os
+from datetime import timezone
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional, Tuple
+from urllib.parse import quote
+
+import aiofiles
+from fastapi import Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+
+MEDIA_CACHE_MAX_AGE = int(os.getenv("MEDIA_CACHE_MAX_AGE", 86400))
+CHUNK_SIZE = 64 * 1024
+
+# Files whose URL always serves the same bytes
+CACHE_CONTROL = f"private, max-age={MEDIA_CACHE_MAX_AGE}"
+# Files whose URL may serve different bytes later; revalidated on every use
+REVALIDATE = "private, no-cache"
+
+class RangeNotSatisfiable(Exception):
+    """The requested range starts beyond the end of the file"""
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single `bytes=` range into inclusive (start, end) offsets.
+
+    Returns None for a header that should be ignored (another unit, several
+    ranges or bad syntax), which gets the whole file. Raises
+    RangeNotSatisfiable when no byte of the file is in the range.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, dash, last = spec.strip().partition("-")
+    if not dash or not (first or last) or not all(part.isdigit() for part in (first, last) if part):
+        return None
+
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            raise RangeNotSatisfiable()
+        return max(size - length, 0), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    end = min(int(last), size - 1) if last else size - 1
+    return start, end
+
+def content_disposition(filename: str, disposition: str = "attachment") -> str:
+    """A Content-Disposition header value, RFC 5987-encoded when needed"""
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"{disposition}; filename*=utf-8''{quoted}"
+    return f'{disposition}; filename="{filename}"'
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    # If-None-Match uses the weak comparison
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # Takes precedence over If-Modified-Since
+        return _etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if not if_modified_since:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    # Last-Modified has one-second resolution
+    return int(mtime) <= since.timestamp()
+
+def _range_applies(request: Request, etag: str, last_modified: str) -> bool:
+    # If-Range: only send a part of the representation the client already has
+    if_range = request.headers.get("if-range")
+    if if_range is None:
+        return True
+    if_range = if_range.strip()
+    return if_range == etag or if_range == last_modified
+
+async def _read_range(path: str, start: int, length: int):
+    async with aiofiles.open(path, "rb") as file:
+        await file.seek(start)
+        while length > 0:
+            chunk = await file.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+def file_response(
+    request: Request,
+    path: str,
+    media_type: str,
+    etag: Optional[str] = None,
+    filename: Optional[str] = None,
+    cache_control: str = CACHE_CONTROL
+) -> Response:
+    """Serve a file with validators, 304s and single byte ranges.
+
+    `etag` is an opaque tag for the file's exact bytes, such as its content
+    hash; without one, the file's mtime and size are used. `filename` makes
+    it a download. Raises FileNotFoundError if the file is missing.
+    """
+    stat_result = os.stat(path)
+    size = stat_result.st_size
+    tag = f'"{etag}"' if etag else f'"{stat_result.st_mtime_ns:x}-{size:x}"'
+    last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+    headers = {
+        "etag": tag,
+        "last-modified": last_modified,
+        "cache-control": cache_control,
+        "accept-ranges": "bytes",
+        # The Content-Type is the one stored at upload; don't let browsers guess another
+        "x-content-type-options": "nosniff",
+    }
+
+    if _not_modified(request, tag, stat_result.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    if filename is not None:
+        headers["content-disposition"] = content_disposition(filename)
+
+    range_header = request.headers.get("range")
+    if range_header and _range_applies(request, tag, last_modified):
+        try:
+            byte_range = parse_range(range_header, size)
+        except RangeNotSatisfiable:
+            headers["content-range"] = f"bytes */{size}"
+            return Response(status_code=416, headers=headers)
+        if byte_range is not None:
+            start, end = byte_range
+            headers["content-range"] = f"bytes {start}-{end}/{size}"
+            headers["content-length"] = str(end - start + 1)
+            return StreamingResponse(
+                _read_range(path, start, end - start + 1),
+                status_code=206,
+                media_type=media_type,
+                headers=headers
+            )
+
+    return FileResponse(path, media_type=media_type, headers=headers, stat_result=stat_result)
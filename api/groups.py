@@ -4,6 +4,8 @@ from typing import List
 from database import get_db
 import models
 import schemas
+from api.membership import membership_index
+from api import conversation_state, unread
 
 router = APIRouter()
 
@@ -46,7 +48,9 @@ def create_group(group: schemas.GroupCreate, created_by: int, db: Session = Depe
         is_admin=True
     )
     db.add(group_member)
+    conversation_state.execute(db, conversation_state.member_joined(db.get_bind().dialect.name, db_group.id, created_by))
     db.commit()
+    membership_index.invalidate(db_group.id)
 
     return db_group
 
@@ -89,10 +93,13 @@ def delete_group(group_id: int, db: Session = Depends(get_db)):
     
     # Delete all group members first
     db.query(models.GroupMember).filter(models.GroupMember.group_id == group_id).delete()
+    counts = conversation_state.execute(db, conversation_state.group_deleted(group_id))
     
     # Delete the group
     db.delete(db_group)
     db.commit()
+    unread.push_from_thread(counts)
+    membership_index.invalidate(group_id)
     return {"message": "Group deleted successfully"}
 
 @router.post("/{group_id}/members", response_model=schemas.GroupMember)
@@ -126,8 +133,10 @@ def add_group_member(group_id: int, user_id: int, is_admin: bool = False, db: Se
         is_admin=is_admin
     )
     db.add(group_member)
+    conversation_state.execute(db, conversation_state.member_joined(db.get_bind().dialect.name, group_id, user_id))
     db.commit()
     db.refresh(group_member)
+    membership_index.invalidate(group_id)
     
     return group_member
 
@@ -175,28 +184,27 @@ def remove_group_member(group_id: int, user_id: int, db: Session = Depends(get_d
     
     # Remove member
     db.delete(group_member)
+    counts = conversation_state.execute(db, conversation_state.member_left(group_id, user_id))
     db.commit()
+    unread.push_from_thread(counts)
+    membership_index.invalidate(group_id)
     
     return {"message": "Member removed successfully"}
 
 @router.get("/user/{user_id}", response_model=List[schemas.Group])
 def get_user_groups(user_id: int, db: Session = Depends(get_db)):
     """Get all groups that a user is a member of"""
-    # Check if user exists
-    db_user = db.query(models.User).filter(models.User.id == user_id).first()
-    if not db_user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    # Get groups through group memberships
-    group_memberships = db.query(models.GroupMember).filter(
+    # One join over the user's memberships (ix_group_members_user_group)
+    groups = db.query(models.Group).join(
+        models.GroupMember, models.GroupMember.group_id == models.Group.id
+    ).filter(
         models.GroupMember.user_id == user_id
-    ).all()
+    ).order_by(models.GroupMember.id).all()
     
-    groups = []
-    for membership in group_memberships:
-        group = db.query(models.Group).filter(models.Group.id == membership.group_id).first()
-        if group:
-            groups.append(group)
+    # Memberships reference users, so any row proves the user exists; check
+    # users only when the join came back empty
+    if not groups and not db.query(models.User.id).filter(models.User.id == user_id).first():
+        raise HTTPException(status_code=404, detail="User not found")
     
     return groups
 
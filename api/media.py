@@ -1,14 +1,21 @@
 import os
-import uuid
-import aiofiles
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, status, Form
-from fastapi.responses import FileResponse
+import re
+import logging
+import mimetypes
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import RedirectResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List
-from PIL import Image
-from database import get_db
+from typing import List, Optional
+from database import get_db, get_async_db
 import models
 import schemas
+from api import metrics, blobs
+from api.uploads import stream_upload, UploadError, UploadTooLarge
+from api.thumbnails import thumbnail_service, pick_rendition, rendition_path, remove_renditions
+from api.downloads import file_response, CACHE_CONTROL, REVALIDATE
+from api.storage import storage, StorageError
 
 router = APIRouter()
 
@@ -20,8 +27,13 @@ ALLOWED_DOCUMENT_TYPES = {"application/pdf", "text/plain", "application/msword",
                          "application/vnd.openxmlformats-officedocument.wordprocessingml.document"}
 
 MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", 10485760))  # 10MB default
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 65536))  # Bytes written per step
 UPLOAD_DIR = os.getenv("UPLOAD_DIR", "static/uploads")
 
+CONTENT_HASH_PATTERN = re.compile(r"[0-9a-f]{64}")
+
+logger = logging.getLogger(__name__)
+
 def get_file_type(content_type: str) -> str:
     """Determine file type based on content type"""
     if content_type in ALLOWED_IMAGE_TYPES:
@@ -35,116 +47,215 @@ def get_file_type(content_type: str) -> str:
     else:
         return "file"
 
+def media_type_for(db_media: models.Media) -> str:
+    """The MIME type stored at upload, or a guess from the filename for older rows"""
+    return (
+        db_media.mime_type
+        or mimetypes.guess_type(db_media.original_filename)[0]
+        or "application/octet-stream"
+    )
+
 def is_allowed_file_type(content_type: str) -> bool:
     """Check if file type is allowed"""
     allowed_types = (ALLOWED_IMAGE_TYPES | ALLOWED_VIDEO_TYPES | 
                     ALLOWED_AUDIO_TYPES | ALLOWED_DOCUMENT_TYPES)
     return content_type in allowed_types
 
-async def save_uploaded_file(file: UploadFile, user_id: int) -> str:
-    """Save uploaded file and return the file path"""
-    # Generate unique filename
-    file_extension = os.path.splitext(file.filename)[1]
-    unique_filename = f"{uuid.uuid4()}{file_extension}"
-    
-    # Create user-specific directory
-    user_dir = os.path.join(UPLOAD_DIR, str(user_id))
-    os.makedirs(user_dir, exist_ok=True)
-    
-    file_path = os.path.join(user_dir, unique_filename)
-    
-    # Save file
-    async with aiofiles.open(file_path, 'wb') as f:
-        content = await file.read()
-        await f.write(content)
-    
-    return file_path
+# The body is parsed by api.uploads, so the form is described by hand for the docs
+UPLOAD_FORM_SCHEMA = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file", "user_id"],
+                    "properties": {
+                        "file": {"type": "string", "format": "binary"},
+                        "user_id": {"type": "integer"},
+                    },
+                }
+            }
+        },
+    }
+}
 
-def create_thumbnail(image_path: str) -> str:
-    """Create thumbnail for image files"""
+@router.post("/upload", response_model=schemas.Media, openapi_extra=UPLOAD_FORM_SCHEMA)
+async def upload_file(request: Request, db: AsyncSession = Depends(get_async_db)):
+    """Upload a file (multipart form with `file` and `user_id`)"""
+    # Stream into a staging directory: user_id may arrive after the file
     try:
-        with Image.open(image_path) as img:
-            # Create thumbnail
-            img.thumbnail((200, 200), Image.Resampling.LANCZOS)
-            
-            # Save thumbnail
-            thumbnail_path = image_path.replace(".", "_thumb.")
-            img.save(thumbnail_path)
-            return thumbnail_path
-    except Exception as e:
-        print(f"Error creating thumbnail: {e}")
-        return None
+        upload = await stream_upload(
+            request,
+            os.path.join(UPLOAD_DIR, ".incoming"),
+            MAX_FILE_SIZE,
+            accept=is_allowed_file_type,
+            chunk_size=UPLOAD_CHUNK_SIZE
+        )
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    except UploadError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    metrics.UPLOAD_BYTES.inc(amount=upload.size)
+
+    try:
+        user_id = int(upload.fields.get("user_id", ""))
+    except ValueError:
+        upload.discard()
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="user_id must be an integer")
 
-@router.post("/upload", response_model=schemas.Media)
-async def upload_file(
-    file: UploadFile = File(...),
-    user_id: int = Form(...),
-    db: Session = Depends(get_db)
-):
-    """Upload a file"""
     # Check if user exists
-    db_user = db.query(models.User).filter(models.User.id == user_id).first()
+    db_user = await db.get(models.User, user_id)
     if not db_user:
+        upload.discard()
         raise HTTPException(status_code=404, detail="User not found")
 
-    # Read file content to check size
-    file_content = await file.read()
-    file_size = len(file_content)
+    try:
+        async with blobs.locked(upload.content_hash):
+            try:
+                # Identical bytes are stored once; the new row is another reference
+                first = await blobs.acquire(db, upload.content_hash)
+                key, created = await blobs.store(upload.path, upload.content_hash, upload.content_type)
+            except Exception:
+                await db.rollback()
+                upload.discard()
+                raise
+            try:
+                db_media = await add_media(
+                    db, user_id, upload.filename, upload.content_type, upload.size, upload.content_hash, key, first
+                )
+            except Exception:
+                await db.rollback()
+                # Clean up the blob if nothing else references it
+                if created:
+                    await storage.delete(key)
+                raise
+        metrics.UPLOADS.inc()
 
-    # Reset file position
-    await file.seek(0)
+        # Renditions are rendered in the background; media_ready announces them.
+        # A repeat upload shares the blob's renditions (or the render in flight)
+        if upload.content_type in ALLOWED_IMAGE_TYPES and first:
+            thumbnail_service.schedule(db_media.id, key, upload.content_hash)
 
-    # Check file size
-    if file_size > MAX_FILE_SIZE:
-        raise HTTPException(
-            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-            detail=f"File size exceeds maximum allowed size of {MAX_FILE_SIZE} bytes"
-        )
+        return db_media
 
-    # Check file type
-    if not is_allowed_file_type(file.content_type):
+    except Exception as e:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"File type {file.content_type} is not allowed"
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error uploading file: {str(e)}"
         )
 
-    try:
-        # Save file
-        file_path = await save_uploaded_file(file, user_id)
-
-        # Create thumbnail for images
-        thumbnail_path = None
-        if file.content_type in ALLOWED_IMAGE_TYPES:
-            thumbnail_path = create_thumbnail(file_path)
-
-        # Create media record
-        db_media = models.Media(
-            filename=os.path.basename(file_path),
-            original_filename=file.filename,
-            file_path=file_path,
-            file_type=get_file_type(file.content_type),
-            file_size=file_size,
-            uploaded_by=user_id
-        )
+async def add_media(
+    db: AsyncSession,
+    user_id: int,
+    filename: str,
+    content_type: str,
+    size: int,
+    content_hash: str,
+    key: str,
+    first: bool
+) -> models.Media:
+    """Commit a media row referencing a stored blob.
 
-        db.add(db_media)
-        db.commit()
-        db.refresh(db_media)
+    Call after blobs.acquire(), passing whether it was the first reference.
+    The commit releases the blob's row lock.
+    """
+    db_media = models.Media(
+        filename=os.path.basename(key),
+        original_filename=filename,
+        file_path=key,
+        file_type=get_file_type(content_type),
+        mime_type=content_type,
+        file_size=size,
+        content_hash=content_hash,
+        uploaded_by=user_id
+    )
+    if not first:
+        renditions = (await db.execute(
+            select(models.Media.renditions).where(models.Media.content_hash == content_hash).limit(1)
+        )).scalar()
+        if renditions is not None:
+            db_media.renditions = renditions
+    db.add(db_media)
+    await db.commit()
+    await db.refresh(db_media)
+    return db_media
 
-        return db_media
+async def check_presigned_upload(upload: schemas.PresignedUploadCreate, db: AsyncSession):
+    """Validate a direct upload the way the upload endpoint validates a proxied one"""
+    if not is_allowed_file_type(upload.content_type):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"File type {upload.content_type} is not allowed")
+    if not CONTENT_HASH_PATTERN.fullmatch(upload.content_hash):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="content_hash must be a lowercase SHA-256 hex digest")
+    if upload.size < 0:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="size must not be negative")
+    if upload.size > MAX_FILE_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"File size exceeds maximum allowed size of {MAX_FILE_SIZE} bytes"
+        )
+    db_user = await db.get(models.User, upload.user_id)
+    if not db_user:
+        raise HTTPException(status_code=404, detail="User not found")
 
-    except Exception as e:
-        # Clean up file if database operation fails
-        try:
-            if 'file_path' in locals() and os.path.exists(file_path):
-                os.remove(file_path)
-        except:
-            pass
+@router.post("/upload/presign", response_model=schemas.PresignedUpload)
+async def presign_upload(upload: schemas.PresignedUploadCreate, db: AsyncSession = Depends(get_async_db)):
+    """Get a request that uploads a file straight to storage.
 
+    Send it as given, then call /upload/complete with the same body. When
+    the content is already stored no upload is needed.
+    """
+    await check_presigned_upload(upload, db)
+    key = blobs.blob_key(upload.content_hash)
+    try:
+        if await storage.exists(key):
+            return schemas.PresignedUpload(upload_required=False)
+    except StorageError as e:
+        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=str(e))
+
+    presigned = storage.presign_put(key, upload.size, upload.content_type, upload.content_hash)
+    if presigned is None:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Error uploading file: {str(e)}"
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            detail="The storage backend doesn't accept direct uploads; use /api/media/upload"
         )
+    return schemas.PresignedUpload(
+        upload_required=True,
+        method=presigned.method,
+        url=presigned.url,
+        headers=presigned.headers,
+        expires_in=presigned.expires_in
+    )
+
+@router.post("/upload/complete", response_model=schemas.Media)
+async def complete_upload(upload: schemas.PresignedUploadCreate, db: AsyncSession = Depends(get_async_db)):
+    """Record a file uploaded straight to storage"""
+    await check_presigned_upload(upload, db)
+    key = blobs.blob_key(upload.content_hash)
+    try:
+        async with blobs.locked(upload.content_hash):
+            try:
+                first = await blobs.acquire(db, upload.content_hash)
+                # The key is the content's hash and the storage checked the hash
+                # on upload, so only its presence needs confirming here
+                stored_size = await storage.size(key)
+                if stored_size is None:
+                    raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="The file has not been uploaded")
+                if stored_size != upload.size:
+                    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="The stored file's size doesn't match")
+                db_media = await add_media(
+                    db, upload.user_id, upload.filename, upload.content_type, upload.size, upload.content_hash, key, first
+                )
+            except Exception:
+                await db.rollback()
+                raise
+    except StorageError as e:
+        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=str(e))
+    metrics.UPLOADS.inc()
+
+    if upload.content_type in ALLOWED_IMAGE_TYPES and first:
+        thumbnail_service.schedule(db_media.id, key, upload.content_hash)
+    return db_media
 
 @router.get("/", response_model=List[schemas.Media])
 def get_media_files(
@@ -174,70 +285,107 @@ def get_media_file(media_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Media file not found")
     return db_media
 
+def stored_file_response(
+    request: Request,
+    key: str,
+    media_type: str,
+    etag: Optional[str] = None,
+    filename: Optional[str] = None,
+    cache_control: str = CACHE_CONTROL
+):
+    """Redirect to the file in storage, or serve it from the local disk"""
+    url = storage.presign_get(key, filename=filename, content_type=media_type, cache_control=cache_control)
+    if url is not None:
+        # The storage backend handles validators and ranges itself
+        return RedirectResponse(url, status_code=status.HTTP_307_TEMPORARY_REDIRECT, headers={"cache-control": REVALIDATE})
+
+    path = storage.local_path(key)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="File not found on disk")
+    return file_response(request, path, media_type, etag=etag, filename=filename, cache_control=cache_control)
+
 @router.get("/{media_id}/download")
-def download_media_file(media_id: int, db: Session = Depends(get_db)):
+def download_media_file(media_id: int, request: Request, db: Session = Depends(get_db)):
     """Download a media file"""
     db_media = db.query(models.Media).filter(models.Media.id == media_id).first()
     if db_media is None:
         raise HTTPException(status_code=404, detail="Media file not found")
     
-    if not os.path.exists(db_media.file_path):
-        raise HTTPException(status_code=404, detail="File not found on disk")
-    
-    return FileResponse(
-        path=db_media.file_path,
-        filename=db_media.original_filename,
-        media_type='application/octet-stream'
+    return stored_file_response(
+        request,
+        db_media.file_path,
+        media_type_for(db_media),
+        etag=db_media.content_hash,
+        filename=db_media.original_filename
     )
 
 @router.get("/{media_id}/view")
-def view_media_file(media_id: int, db: Session = Depends(get_db)):
+def view_media_file(
+    media_id: int,
+    request: Request,
+    size: Optional[int] = Query(None, ge=1, description="Longest side wanted, for image renditions"),
+    db: Session = Depends(get_db)
+):
     """View a media file (for images, videos, etc.)"""
     db_media = db.query(models.Media).filter(models.Media.id == media_id).first()
     if db_media is None:
         raise HTTPException(status_code=404, detail="Media file not found")
     
-    if not os.path.exists(db_media.file_path):
-        raise HTTPException(status_code=404, detail="File not found on disk")
-    
-    # Determine media type for proper browser handling
-    media_type_mapping = {
-        "image": "image/*",
-        "video": "video/*",
-        "audio": "audio/*",
-        "document": "application/pdf" if db_media.file_path.endswith('.pdf') else "text/plain"
-    }
-    
-    media_type = media_type_mapping.get(db_media.file_type, 'application/octet-stream')
+    # Serve the smallest WebP rendition that covers the requested size; the
+    # original is used until renditions are ready, or if none is big enough
+    rendition = pick_rendition(db_media.renditions, size) if size else None
+    if rendition is not None:
+        key = rendition_path(db_media.file_path, rendition)
+        path = storage.local_path(key)
+        if path is None or os.path.exists(path):
+            etag = f"{db_media.content_hash}-{rendition}" if db_media.content_hash else None
+            return stored_file_response(request, key, "image/webp", etag=etag)
     
-    return FileResponse(
-        path=db_media.file_path,
-        media_type=media_type
+    # A ?size URL switches to a rendition once one is ready, so until then
+    # browsers must revalidate rather than reuse the original
+    pending = size is not None and db_media.file_type == "image" and not db_media.renditions
+    return stored_file_response(
+        request,
+        db_media.file_path,
+        media_type_for(db_media),
+        etag=db_media.content_hash,
+        cache_control=REVALIDATE if pending else CACHE_CONTROL
     )
 
+async def delete_stored_file(key: str, renditions: Optional[List[int]]):
+    """Remove a file and its renditions from storage"""
+    try:
+        await storage.delete(key)
+    except StorageError as e:
+        logger.warning("Error deleting stored file %s: %s", key, e)
+    await remove_renditions(key, renditions)
+
 @router.delete("/{media_id}")
-def delete_media_file(media_id: int, db: Session = Depends(get_db)):
+async def delete_media_file(media_id: int, db: AsyncSession = Depends(get_async_db)):
     """Delete a media file"""
-    db_media = db.query(models.Media).filter(models.Media.id == media_id).first()
+    db_media = await db.get(models.Media, media_id)
     if db_media is None:
         raise HTTPException(status_code=404, detail="Media file not found")
     
-    # Delete file from disk
-    try:
-        if os.path.exists(db_media.file_path):
-            os.remove(db_media.file_path)
-        
-        # Delete thumbnail if it exists
-        thumbnail_path = db_media.file_path.replace(".", "_thumb.")
-        if os.path.exists(thumbnail_path):
-            os.remove(thumbnail_path)
-            
-    except Exception as e:
-        print(f"Error deleting file from disk: {e}")
-    
-    # Delete from database
-    db.delete(db_media)
-    db.commit()
+    key, content_hash, renditions = db_media.file_path, db_media.content_hash, db_media.renditions
+    if content_hash is None:
+        # Files from before content addressing belong to their row alone
+        await db.delete(db_media)
+        await db.commit()
+        await delete_stored_file(key, renditions)
+        return {"message": "Media file deleted successfully"}
+
+    async with blobs.locked(content_hash):
+        try:
+            await db.delete(db_media)
+            # The blob goes with its last reference, removed before the commit
+            # releases its row so no upload can reuse it in the meantime
+            if await blobs.release(db, content_hash):
+                await delete_stored_file(key, renditions)
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
     
     return {"message": "Media file deleted successfully"}
 
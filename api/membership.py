@@ -0,0 +1,67 @@
+"""
+In-memory index of group membership used to route WebSocket broadcasts.
+
+Group messages, typing indicators and reactions all need the member list of
+a group. The index keeps group_id -> set of user IDs so those lookups skip
+the database; the HTTP endpoints that change membership invalidate the
+affected group. Invalidation only reaches the worker that made the change,
+so entries also expire after GROUP_MEMBERSHIP_TTL seconds: that is how long
+other workers can keep routing to a removed member or miss a new one. The
+default keeps that window to a few seconds, while a burst of messages and
+typing indicators in a busy group still shares one lookup.
+"""
+import os
+import time
+import threading
+from typing import Dict, FrozenSet, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+
+MEMBERSHIP_TTL = float(os.getenv("GROUP_MEMBERSHIP_TTL", 5))
+
+class MembershipIndex:
+    """Caches the member IDs of each group"""
+
+    def __init__(self, ttl: float = MEMBERSHIP_TTL):
+        self.ttl = ttl
+        self._members: Dict[int, Tuple[float, FrozenSet[int]]] = {}
+        # Bumped on every invalidation so a load that raced with a change
+        # isn't cached
+        self._generation = 0
+        # Invalidations come from the sync routers' worker threads
+        self._lock = threading.Lock()
+
+    async def get_members(self, db: AsyncSession, group_id: int) -> FrozenSet[int]:
+        """Get the user IDs of a group's members, loading them on a miss"""
+        entry = self._members.get(group_id)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+
+        generation = self._generation
+        result = await db.execute(
+            select(models.GroupMember.user_id).where(models.GroupMember.group_id == group_id)
+        )
+        members = frozenset(result.scalars().all())
+
+        with self._lock:
+            if self._generation == generation:
+                self._members[group_id] = (time.monotonic() + self.ttl, members)
+        return members
+
+    def invalidate(self, group_id: int):
+        """Drop a group's cached members after its membership changed"""
+        with self._lock:
+            self._members.pop(group_id, None)
+            self._generation += 1
+
+    def clear(self):
+        """Drop every cached group"""
+        with self._lock:
+            self._members.clear()
+            self._generation += 1
+
+# Shared by the WebSocket handlers and the group endpoints
+membership_index = MembershipIndex()
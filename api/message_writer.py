@@ -0,0 +1,241 @@
+"""
+Batched persistence for chat messages sent over the WebSocket.
+
+MESSAGE_WRITE_MODE picks the durability/throughput trade-off:
+
+- sync:          one INSERT + COMMIT per message before it is broadcast
+                 (the original behaviour).
+- group_commit:  messages are queued and written with one multi-row INSERT
+                 every MESSAGE_FLUSH_INTERVAL_MS or MESSAGE_BATCH_SIZE
+                 messages; each sender waits for its batch to commit, so a
+                 broadcast message is always durable.
+- write_behind:  IDs are assigned up front from blocks reserved on the
+                 messages sequence and the message is broadcast immediately;
+                 the batch is persisted afterwards. A crash can lose up to
+                 one flush interval of messages. Needs a database with
+                 sequences (PostgreSQL); other databases fall back to
+                 group_commit.
+"""
+import os
+import logging
+import asyncio
+from collections import deque
+from datetime import datetime, timezone
+from typing import Deque, Dict, List, Optional
+
+from sqlalchemy import insert, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+import models
+from api import conversation_state, unread
+
+WRITE_MODES = {"sync", "group_commit", "write_behind"}
+
+WRITE_MODE = os.getenv("MESSAGE_WRITE_MODE", "sync")
+BATCH_SIZE = int(os.getenv("MESSAGE_BATCH_SIZE", 500))
+FLUSH_INTERVAL_MS = int(os.getenv("MESSAGE_FLUSH_INTERVAL_MS", 10))
+ID_BLOCK_SIZE = int(os.getenv("MESSAGE_ID_BLOCK_SIZE", 1000))
+
+logger = logging.getLogger(__name__)
+
+messages_table = models.Message.__table__
+
+# Columns returned to callers, in the shape of a saved message
+MESSAGE_COLUMNS = (
+    "id", "sender_id", "receiver_id", "group_id", "content", "message_type",
+    "media_id", "reply_to_id", "is_read", "is_delivered", "created_at"
+)
+
+class MessageIdAllocator:
+    """Hands out message IDs from blocks reserved on the database sequence.
+
+    One round trip reserves a whole block, so assigning an ID is usually a
+    local operation. IDs stay unique across workers because every block
+    comes from the same sequence.
+    """
+
+    def __init__(self, session_factory: async_sessionmaker, block_size: int = ID_BLOCK_SIZE):
+        self.session_factory = session_factory
+        self.block_size = block_size
+        self._ids: Deque[int] = deque()
+        self._lock: Optional[asyncio.Lock] = None
+
+    def reset(self):
+        """Bind to the running event loop"""
+        self._lock = asyncio.Lock()
+
+    async def next_id(self) -> int:
+        if not self._ids:
+            async with self._lock:
+                if not self._ids:
+                    self._ids.extend(await self._reserve_block())
+        return self._ids.popleft()
+
+    async def _reserve_block(self) -> List[int]:
+        async with self.session_factory() as db:
+            result = await db.execute(
+                text("SELECT nextval(pg_get_serial_sequence('messages', 'id')) FROM generate_series(1, :n)"),
+                {"n": self.block_size}
+            )
+            return [row[0] for row in result]
+
+class PendingMessage:
+    """A message waiting in the current batch"""
+
+    __slots__ = ("values", "future")
+
+    def __init__(self, values: dict, future: Optional[asyncio.Future]):
+        self.values = values
+        self.future = future
+
+class MessageWriter:
+    """Collects chat messages and persists them in batches"""
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker,
+        mode: str = WRITE_MODE,
+        batch_size: int = BATCH_SIZE,
+        flush_interval_ms: int = FLUSH_INTERVAL_MS,
+        id_block_size: int = ID_BLOCK_SIZE
+    ):
+        if mode not in WRITE_MODES:
+            raise ValueError(f"Unknown message write mode: {mode}")
+        self.session_factory = session_factory
+        self.mode = mode
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.allocator = MessageIdAllocator(session_factory, id_block_size)
+        self._pending: List[PendingMessage] = []
+        self._has_pending: Optional[asyncio.Event] = None
+        self._batch_full: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    async def start(self):
+        """Start the background flusher (no-op in sync mode)"""
+        if self.mode == "write_behind":
+            async with self.session_factory() as db:
+                dialect = db.get_bind().dialect.name
+            if dialect != "postgresql":
+                logger.warning("write_behind needs database sequences, %s falls back to group_commit", dialect)
+                self.mode = "group_commit"
+        if self.mode != "sync" and self._flusher is None:
+            # Created here so they belong to the running event loop
+            self._has_pending = asyncio.Event()
+            self._batch_full = asyncio.Event()
+            self.allocator.reset()
+            self._stopping = False
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Stop the flusher and persist anything still queued"""
+        if self._flusher is not None:
+            # Let the flusher finish its current batch and exit rather than
+            # cancelling it mid-write, which would drop a batch already taken
+            # off the queue
+            self._stopping = True
+            self._has_pending.set()
+            self._batch_full.set()
+            await self._flusher
+            self._flusher = None
+        await self.flush()
+
+    async def submit(self, values: dict, db: AsyncSession) -> Dict:
+        """Persist a message according to the write mode.
+
+        Returns the saved message as a dict including its id and created_at.
+        In sync mode the caller's session is used; the batched modes use
+        their own sessions so the caller's connection isn't held.
+        """
+        values = {"is_read": False, "is_delivered": False, **values}
+
+        if self.mode == "sync":
+            result = await db.execute(insert(messages_table).returning(*messages_table.c), [values])
+            row = result.mappings().one()
+            counts = await self._record(db, [row])
+            await db.commit()
+            await self._push_unread(counts)
+            return {column: row[column] for column in MESSAGE_COLUMNS}
+
+        if self.mode == "write_behind":
+            values["id"] = await self.allocator.next_id()
+            values["created_at"] = datetime.now(timezone.utc)
+            self._enqueue(PendingMessage(values, None))
+            return {column: values.get(column) for column in MESSAGE_COLUMNS}
+
+        future = asyncio.get_running_loop().create_future()
+        self._enqueue(PendingMessage(values, future))
+        return await future
+
+    def _enqueue(self, pending: PendingMessage):
+        self._pending.append(pending)
+        if self._has_pending is not None:
+            self._has_pending.set()
+            if len(self._pending) >= self.batch_size:
+                self._batch_full.set()
+
+    async def _flush_loop(self):
+        while not self._stopping:
+            # Sleep until the first message of a batch arrives, then give the
+            # batch up to one flush interval to fill
+            await self._has_pending.wait()
+            if not self._stopping:
+                try:
+                    await asyncio.wait_for(self._batch_full.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._has_pending.clear()
+            self._batch_full.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Write everything queued so far with multi-row INSERTs"""
+        while self._pending:
+            batch, self._pending = self._pending[:self.batch_size], self._pending[self.batch_size:]
+            await self._write_batch(batch)
+
+    async def _record(self, db: AsyncSession, saved) -> List:
+        """Update the senders' and recipients' inbox rows in the same transaction.
+
+        Returns the resulting unread-count rows.
+        """
+        counts = []
+        for statement in conversation_state.messages_sent(db.get_bind().dialect.name, saved):
+            counts.extend((await db.execute(statement)).all())
+        return counts
+
+    async def _push_unread(self, counts: List):
+        """Push the recipients' new unread counts once the messages are committed"""
+        try:
+            # Senders' rows come back too; a zero count there is unchanged
+            await unread.push(row for row in counts if row.unread_count > 0)
+        except Exception:
+            logger.exception("Error pushing unread counts")
+
+    async def _write_batch(self, batch: List[PendingMessage]):
+        rows = [pending.values for pending in batch]
+        try:
+            async with self.session_factory() as db:
+                if self.mode == "write_behind":
+                    await db.execute(insert(messages_table), rows)
+                    saved = rows
+                else:
+                    result = await db.execute(
+                        insert(messages_table).returning(*messages_table.c, sort_by_parameter_order=True),
+                        rows
+                    )
+                    saved = result.mappings().all()
+                counts = await self._record(db, saved)
+                await db.commit()
+        except Exception as e:
+            logger.exception("Error persisting batch of %d messages", len(batch))
+            for pending in batch:
+                if pending.future is not None and not pending.future.done():
+                    pending.future.set_exception(e)
+            return
+
+        for pending, row in zip(batch, saved):
+            if pending.future is not None and not pending.future.done():
+                pending.future.set_result({column: row[column] for column in MESSAGE_COLUMNS})
+        await self._push_unread(counts)
@@ -1,11 +1,14 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_, desc
-from typing import List, Optional
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import and_, or_
+from typing import Optional
 from datetime import datetime
-from database import get_db
+from database import get_db, get_async_db
 import models
 import schemas
+from api.pagination import paginate_messages, MAX_PAGE_SIZE
+from api import conversation_state, unread
 
 router = APIRouter()
 
@@ -49,19 +52,27 @@ def create_message(message: schemas.MessageCreate, db: Session = Depends(get_db)
     # Create message
     db_message = models.Message(**message.dict())
     db.add(db_message)
+    db.flush()
+    db.refresh(db_message)
+    counts = conversation_state.execute(
+        db, conversation_state.messages_sent(db.get_bind().dialect.name, [conversation_state.as_row(db_message)])
+    )
     db.commit()
+    # Senders' rows come back too; a zero count there is unchanged
+    unread.push_from_thread(row for row in counts if row.unread_count > 0)
     db.refresh(db_message)
     return db_message
 
-@router.get("/", response_model=List[schemas.Message])
+@router.get("/", response_model=schemas.MessagePage)
 def read_messages(
-    skip: int = 0,
-    limit: int = 100,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    before: Optional[str] = Query(None, description="Cursor: return messages older than this"),
+    after: Optional[str] = Query(None, description="Cursor: return messages newer than this"),
     user_id: Optional[int] = Query(None, description="Filter messages for specific user"),
     group_id: Optional[int] = Query(None, description="Filter messages for specific group"),
     db: Session = Depends(get_db)
 ):
-    """Get messages with optional filtering"""
+    """Get messages with optional filtering, newest first"""
     query = db.query(models.Message).filter(models.Message.deleted_at.is_(None))
     
     if group_id:
@@ -75,8 +86,7 @@ def read_messages(
             )
         )
     
-    messages = query.order_by(desc(models.Message.created_at)).offset(skip).limit(limit).all()
-    return messages
+    return paginate_messages(db, query, limit, before, after, newest_first=True)
 
 @router.get("/{message_id}", response_model=schemas.Message)
 def read_message(message_id: int, db: Session = Depends(get_db)):
@@ -105,10 +115,15 @@ def update_message(message_id: int, message_update: schemas.MessageUpdate, db: S
     
     # Update message fields
     update_data = message_update.dict(exclude_unset=True)
+    was_read = db_message.is_read
     for field, value in update_data.items():
         setattr(db_message, field, value)
     
+    counts = []
+    if db_message.is_read != was_read:
+        counts = conversation_state.execute(db, conversation_state.unread_changed(db_message, -1 if db_message.is_read else 1))
     db.commit()
+    unread.push_from_thread(counts)
     db.refresh(db_message)
     return db_message
 
@@ -127,53 +142,54 @@ def delete_message(message_id: int, db: Session = Depends(get_db)):
     # Soft delete by setting deleted_at timestamp
     from sqlalchemy.sql import func
     db_message.deleted_at = func.now()
+    db.flush()
+    counts = conversation_state.execute(db, conversation_state.message_deleted(db_message))
     db.commit()
+    unread.push_from_thread(counts)
     
     return {"message": "Message deleted successfully"}
 
-@router.get("/conversation/{user1_id}/{user2_id}", response_model=List[schemas.Message])
+@router.get("/conversation/{user1_id}/{user2_id}", response_model=schemas.MessagePage)
 def get_conversation(
     user1_id: int,
     user2_id: int,
-    skip: int = 0,
-    limit: int = 100,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    before: Optional[str] = Query(None, description="Cursor: return messages older than this"),
+    after: Optional[str] = Query(None, description="Cursor: return messages newer than this"),
     db: Session = Depends(get_db)
 ):
-    """Get conversation between two users"""
-    messages = db.query(models.Message).filter(
-        and_(
-            models.Message.deleted_at.is_(None),
-            or_(
-                and_(
-                    models.Message.sender_id == user1_id,
-                    models.Message.receiver_id == user2_id
-                ),
-                and_(
-                    models.Message.sender_id == user2_id,
-                    models.Message.receiver_id == user1_id
-                )
+    """Get a page of the conversation between two users, oldest first"""
+    # One branch per direction, so each is a range scan of ix_messages_direct_created
+    sent, received = (
+        db.query(models.Message).filter(
+            and_(
+                models.Message.sender_id == sender_id,
+                models.Message.receiver_id == receiver_id,
+                models.Message.deleted_at.is_(None)
             )
         )
-    ).order_by(models.Message.created_at).offset(skip).limit(limit).all()
+        for sender_id, receiver_id in ((user1_id, user2_id), (user2_id, user1_id))
+    )
     
-    return messages
+    return paginate_messages(db, [sent, received], limit, before, after)
 
-@router.get("/group/{group_id}", response_model=List[schemas.Message])
+@router.get("/group/{group_id}", response_model=schemas.MessagePage)
 def get_group_messages(
     group_id: int,
-    skip: int = 0,
-    limit: int = 100,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    before: Optional[str] = Query(None, description="Cursor: return messages older than this"),
+    after: Optional[str] = Query(None, description="Cursor: return messages newer than this"),
     db: Session = Depends(get_db)
 ):
-    """Get messages for a specific group"""
-    messages = db.query(models.Message).filter(
+    """Get a page of a group's messages, oldest first"""
+    query = db.query(models.Message).filter(
         and_(
             models.Message.group_id == group_id,
             models.Message.deleted_at.is_(None)
         )
-    ).order_by(models.Message.created_at).offset(skip).limit(limit).all()
+    )
     
-    return messages
+    return paginate_messages(db, query, limit, before, after)
 
 @router.put("/{message_id}/read")
 def mark_message_as_read(message_id: int, db: Session = Depends(get_db)):
@@ -187,8 +203,12 @@ def mark_message_as_read(message_id: int, db: Session = Depends(get_db)):
     if db_message is None:
         raise HTTPException(status_code=404, detail="Message not found")
     
-    db_message.is_read = True
+    counts = []
+    if not db_message.is_read:
+        db_message.is_read = True
+        counts = conversation_state.execute(db, conversation_state.unread_changed(db_message, -1))
     db.commit()
+    unread.push_from_thread(counts)
     
     return {"message": "Message marked as read"}
 
@@ -209,15 +229,21 @@ def mark_message_as_delivered(message_id: int, db: Session = Depends(get_db)):
     
     return {"message": "Message marked as delivered"}
 
-@router.get("/unread/{user_id}")
-def get_unread_count(user_id: int, db: Session = Depends(get_db)):
-    """Get count of unread messages for a user"""
-    unread_count = db.query(models.Message).filter(
-        and_(
-            models.Message.receiver_id == user_id,
-            models.Message.is_read == False,
-            models.Message.deleted_at.is_(None)
+@router.get("/unread/{user_id}", response_model=schemas.UnreadSummary)
+async def get_unread_count(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    """Get a user's unread counts per DM peer and group, and their total"""
+    # Served from the in-memory counters; a miss reads the user's conversation_state rows
+    counts = await unread.unread_counters.get(db, user_id)
+    conversations = [
+        schemas.ConversationUnread(
+            peer_id=conversation_id if kind == "direct" else None,
+            group_id=conversation_id if kind == "group" else None,
+            unread_count=count
         )
-    ).count()
-    
-    return {"user_id": user_id, "unread_count": unread_count}
+        for (kind, conversation_id), count in counts.items()
+    ]
+    return schemas.UnreadSummary(
+        user_id=user_id,
+        unread_count=sum(counts.values()),
+        conversations=conversations
+    )
@@ -0,0 +1,207 @@
+"""
+In-process metrics exposed in the Prometheus text format at /metrics.
+
+Counters and histograms keep one shard per thread: the event loop and each
+threadpool worker only ever write to their own shard, so recording a value
+takes no lock. Shards are summed when /metrics is scraped. Registering a
+thread's shard is the only locked step and happens once per thread.
+"""
+import time
+import threading
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from sqlalchemy import event
+
+LabelValues = Tuple[str, ...]
+
+# Latency buckets in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+class Metric:
+    """Base class for sharded metrics"""
+
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards: List[dict] = []
+        self._shards_lock = threading.Lock()
+
+    def _shard(self) -> dict:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+            return shard
+
+    def _snapshots(self) -> List[dict]:
+        with self._shards_lock:
+            shards = list(self._shards)
+        # dict.copy() runs without releasing the GIL, so a writer can't
+        # resize the dict underneath it
+        return [shard.copy() for shard in shards]
+
+    def _format_labels(self, values: LabelValues, extra: Dict[str, str] = None) -> str:
+        pairs = list(zip(self.labelnames, values)) + list((extra or {}).items())
+        if not pairs:
+            return ""
+        escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+        return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+
+class Counter(Metric):
+    """A monotonically increasing value"""
+
+    type = "counter"
+
+    def inc(self, *labels: str, amount: float = 1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def values(self) -> Dict[LabelValues, float]:
+        totals: Dict[LabelValues, float] = {}
+        for shard in self._snapshots():
+            for labels, value in shard.items():
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for labels, value in sorted(self.values().items()):
+            lines.append(f"{self.name}{self._format_labels(labels)} {value}")
+        return lines
+
+class Histogram(Metric):
+    """Observations counted into fixed buckets"""
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels: str):
+        shard = self._shard()
+        state = shard.get(labels)
+        if state is None:
+            # Per-bucket counts (last one is +Inf), then sum
+            state = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        state[bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        totals: Dict[LabelValues, List[float]] = {}
+        for shard in self._snapshots():
+            for labels, state in shard.items():
+                merged = totals.setdefault(labels, [0] * len(state))
+                for index, value in enumerate(list(state)):
+                    merged[index] += value
+
+        for labels, state in sorted(totals.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{self._format_labels(labels, {'le': le})} {cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(labels)} {state[-1]}")
+            lines.append(f"{self.name}_count{self._format_labels(labels)} {cumulative}")
+        return lines
+
+class Gauge(Metric):
+    """A value read from a callback at scrape time"""
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, read: Callable[[], float] = lambda: 0):
+        super().__init__(name, documentation)
+        self.read = read
+
+    def render(self) -> List[str]:
+        return super().render() + [f"{self.name} {self.read()}"]
+
+REGISTRY: List[Metric] = []
+
+def register(metric: Metric) -> Metric:
+    REGISTRY.append(metric)
+    return metric
+
+def render_latest() -> str:
+    """Render every registered metric in the Prometheus text format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# Response adds the charset
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+# WebSocket
+WS_CONNECTS = register(Counter("webchat_ws_connects_total", "WebSocket sessions accepted"))
+WS_REJECTED = register(Counter("webchat_ws_rejected_total", "WebSocket connections rejected at the session limit"))
+WS_DISCONNECTS = register(Counter("webchat_ws_disconnects_total", "WebSocket sessions closed"))
+WS_ACTIVE_SESSIONS = register(Gauge("webchat_ws_active_sessions", "WebSocket sessions open on this worker"))
+WS_FRAMES = register(Counter("webchat_ws_frames_total", "WebSocket frames received, by type", ["type"]))
+WS_SEND_FAILURES = register(Counter("webchat_ws_send_failures_total", "Sessions dropped because sending failed", ["reason"]))
+WS_DROPPED_FRAMES = register(Counter("webchat_ws_dropped_frames_total", "Outbound frames dropped by the queue overflow policy"))
+
+# Chat messages
+CHAT_FANOUT_RECIPIENTS = register(Histogram(
+    "webchat_chat_fanout_recipients", "Recipients per chat message",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+))
+CHAT_FANOUT_SECONDS = register(Histogram("webchat_chat_fanout_seconds", "Time to queue a chat message for its recipients"))
+
+# Database
+DB_QUERY_SECONDS = register(Histogram("webchat_db_query_seconds", "Database statement latency, by router", ["router"]))
+
+# Media
+UPLOAD_BYTES = register(Counter("webchat_upload_bytes_total", "Bytes received by file uploads"))
+UPLOADS = register(Counter("webchat_uploads_total", "File uploads stored"))
+
+# Router the current request belongs to, used to label DB queries
+current_router: ContextVar[str] = ContextVar("current_router", default="background")
+
+def router_label(path: str) -> str:
+    """Derive a bounded router label from a request path"""
+    if path.startswith("/api/"):
+        return path.split("/", 3)[2] or "api"
+    if path.startswith("/ws/"):
+        return "websocket"
+    return "app"
+
+class RouterLabelMiddleware:
+    """Tags each request's context with its router name"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] in ("http", "websocket"):
+            token = current_router.set(router_label(scope["path"]))
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                current_router.reset(token)
+        else:
+            await self.app(scope, receive, send)
+
+def instrument_engine(engine):
+    """Time every statement run on a (sync) SQLAlchemy engine"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _start_timer(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _record_latency(conn, cursor, statement, parameters, context, executemany):
+        DB_QUERY_SECONDS.observe(time.perf_counter() - context._metrics_start, current_router.get())
@@ -0,0 +1,108 @@
+"""
+Keyset pagination for message history.
+
+Pages are keyed on (created_at, id), so loading an old page costs the same
+as loading the newest one: the database seeks straight to the cursor
+instead of scanning and discarding `offset` rows. Cursors are opaque to
+clients: base64 of the boundary row's key.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Optional, Sequence, Tuple, Union
+
+from fastapi import HTTPException, status
+from sqlalchemy import literal, tuple_
+from sqlalchemy.orm import Query, Session
+
+import models
+import schemas
+
+MAX_PAGE_SIZE = 500
+
+def encode_cursor(message: models.Message) -> str:
+    """Encode a message's position as an opaque cursor"""
+    raw = json.dumps([message.created_at.isoformat(), message.id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Decode a cursor back into (created_at, id)"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, message_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created_at), int(message_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+def _bind_created_at(db: Session, created_at: datetime):
+    """Bind a cursor timestamp so it compares correctly with stored values.
+
+    SQLite keeps timestamps as text, and rows written by its CURRENT_TIMESTAMP
+    default have no fractional part while SQLAlchemy binds always add one.
+    Matching the stored format keeps rows from the same second in order.
+    """
+    if db.get_bind().dialect.name != "sqlite":
+        return created_at
+    fmt = "%Y-%m-%d %H:%M:%S.%f" if created_at.microsecond else "%Y-%m-%d %H:%M:%S"
+    return literal(created_at.strftime(fmt))
+
+def paginate_messages(
+    db: Session,
+    query: Union[Query, Sequence[Query]],
+    limit: int,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    newest_first: bool = False
+) -> schemas.MessagePage:
+    """Return one page of `query` around a cursor.
+
+    Without a cursor the newest messages are returned. `before` walks back
+    into history and `after` forward towards the present. `next_cursor`
+    continues in the same direction and is None once there is nothing left;
+    `prev_cursor` goes back the other way.
+
+    `query` may also be a list of disjoint branch queries, e.g. the two
+    directions of a conversation. Each branch is paged on its own index
+    range and the results merged, where a single OR query could not use
+    the index for ordering.
+    """
+    if before and after:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Use either before or after, not both"
+        )
+
+    branches = list(query) if isinstance(query, (list, tuple)) else [query]
+    cursor = decode_cursor(after or before) if (after or before) else None
+
+    key = tuple_(models.Message.created_at, models.Message.id)
+    rows = []
+    for branch in branches:
+        if cursor is not None:
+            bound = tuple_(_bind_created_at(db, cursor[0]), cursor[1])
+            branch = branch.filter(key > bound if after else key < bound)
+        if after:
+            branch = branch.order_by(models.Message.created_at, models.Message.id)
+        else:
+            branch = branch.order_by(models.Message.created_at.desc(), models.Message.id.desc())
+        # One extra row tells us whether another page exists
+        rows.extend(branch.limit(limit + 1).all())
+
+    if len(branches) > 1:
+        rows.sort(key=lambda message: (message.created_at, message.id), reverse=not after)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    next_cursor = encode_cursor(rows[-1]) if has_more else None
+    prev_cursor = encode_cursor(rows[0]) if rows else None
+
+    # Rows come back in walking order: oldest first for `after`, newest first otherwise
+    if newest_first == bool(after):
+        rows.reverse()
+
+    return schemas.MessagePage(
+        items=rows,
+        next_cursor=next_cursor,
+        prev_cursor=prev_cursor,
+        has_more=has_more
+    )
@@ -0,0 +1,136 @@
+"""
+Read and delivered receipts with high-watermark semantics.
+
+A receipt says "user X has read (or received) everything up to message N in
+this conversation". Applying it is one UPDATE over every message in range
+plus one on the reader's conversation_state row, and the senders get a
+single `receipt` event instead of one per message; the reader gets an
+`unread` event with their new count. Receipts at or below the stored
+watermark are no-ops, so clients can resend freely.
+
+Watermarks compare message IDs, so they assume IDs follow send order within
+a conversation. That holds in the sync and group_commit write modes; in
+write_behind mode with several workers each worker assigns IDs from its own
+block, so a receipt can cover a message another worker sent after it.
+
+Receipts arrive over the WebSocket (`{"type": "receipt", ...}`) or via
+POST /api/receipts/. Both go through submit_receipt().
+"""
+from typing import Awaitable, Callable, List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy import and_, case, func, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import get_async_db
+import models
+import schemas
+from api import unread
+
+RECEIPT_KINDS = {"read", "delivered"}
+
+router = APIRouter()
+
+# Delivers a receipt event to the given users; main.py wires it to the
+# connection manager
+publish: Optional[Callable[[dict, List[int]], Awaitable[None]]] = None
+
+def _validate(receipt: schemas.ReceiptCreate):
+    if receipt.kind not in RECEIPT_KINDS:
+        raise ValueError(f"Unknown receipt kind: {receipt.kind}")
+    if (receipt.peer_id is None) == (receipt.group_id is None):
+        raise ValueError("A receipt needs exactly one of peer_id or group_id")
+
+async def apply_receipt(db: AsyncSession, user_id: int, receipt: schemas.ReceiptCreate):
+    """Move the user's watermark forward and update the covered messages.
+
+    Returns (receipt, recipients). The receipt carries the effective
+    watermark; recipients is empty when nothing moved.
+    """
+    _validate(receipt)
+    m = models.Message
+    state = models.ConversationState
+    read = receipt.kind == "read"
+    watermark = state.last_read_message_id if read else state.last_delivered_message_id
+
+    if receipt.group_id is not None:
+        conversation = state.group_id == receipt.group_id
+    else:
+        conversation = state.peer_id == receipt.peer_id
+    row = (await db.execute(
+        select(state.id, watermark, state.unread_count).where(state.user_id == user_id, conversation)
+    )).first()
+
+    result = schemas.Receipt(**receipt.model_dump(), user_id=user_id)
+    if row is None:
+        # Not a member of the group, or no messages with this peer yet
+        return result, []
+    previous = row[1] or 0
+
+    # The watermark can't pass the conversation's latest message, or a bogus
+    # up_to would also cover every message still to come
+    if receipt.group_id is not None:
+        in_conversation = and_(m.group_id == receipt.group_id, m.deleted_at.is_(None))
+    else:
+        in_conversation = and_(m.deleted_at.is_(None), or_(
+            and_(m.sender_id == receipt.peer_id, m.receiver_id == user_id),
+            and_(m.sender_id == user_id, m.receiver_id == receipt.peer_id)
+        ))
+    latest = (await db.execute(select(func.max(m.id)).where(in_conversation))).scalar() or 0
+    up_to = min(receipt.up_to, latest)
+    if up_to <= previous:
+        result.up_to = previous
+        result.unread_count = row.unread_count
+        return result, []
+    result.up_to = up_to
+
+    if receipt.group_id is not None:
+        in_group = and_(m.group_id == receipt.group_id, m.sender_id != user_id, m.deleted_at.is_(None))
+        # Group messages have no per-member flags; the watermark is the state
+        recipients = list((await db.execute(
+            select(m.sender_id).distinct().where(in_group, m.id > previous, m.id <= up_to)
+        )).scalars())
+        unread = select(func.count()).select_from(m).where(in_group, m.id > up_to)
+    else:
+        from_peer = and_(m.sender_id == receipt.peer_id, m.receiver_id == user_id, m.deleted_at.is_(None))
+        flag = m.is_read if read else m.is_delivered
+        # Reading a message implies it was delivered
+        values = {"is_read": True, "is_delivered": True} if read else {"is_delivered": True}
+        await db.execute(
+            update(m).where(from_peer, m.id <= up_to, flag == False).values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        recipients = [receipt.peer_id]
+        unread = select(func.count()).select_from(m).where(from_peer, m.is_read == False)
+
+    values = {watermark.key: up_to}
+    if read:
+        values["unread_count"] = unread.scalar_subquery()
+        values["last_delivered_message_id"] = case(
+            (func.coalesce(state.last_delivered_message_id, 0) < up_to, up_to),
+            else_=state.last_delivered_message_id
+        )
+    await db.execute(update(state).where(state.id == row.id).values(**values))
+    result.unread_count = (await db.execute(
+        select(state.unread_count).where(state.id == row.id)
+    )).scalar_one()
+    await db.commit()
+    return result, recipients
+
+async def submit_receipt(db: AsyncSession, user_id: int, receipt: schemas.ReceiptCreate) -> schemas.Receipt:
+    """Apply a receipt, notify the senders it covers and push the reader's new count"""
+    result, recipients = await apply_receipt(db, user_id, receipt)
+    if recipients and publish is not None:
+        await publish({"type": "receipt", **result.model_dump()}, recipients)
+    if recipients and result.kind == "read":
+        # The reader's other sessions clear their badge too
+        await unread.push([(user_id, result.peer_id, result.group_id, result.unread_count)])
+    return result
+
+@router.post("/", response_model=schemas.Receipt)
+async def create_receipt(receipt: schemas.ReceiptCreate, user_id: int, db: AsyncSession = Depends(get_async_db)):
+    """Mark everything up to `up_to` in a conversation as read or delivered"""
+    try:
+        return await submit_receipt(db, user_id, receipt)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
@@ -0,0 +1,182 @@
+"""
+Image renditions rendered off the event loop.
+
+Uploading an image used to resize it with Pillow inside the request
+handler, blocking every other request and WebSocket on the worker while it
+ran. Uploads now return as soon as the original is stored. The image is
+then rendered in a process pool into WebP renditions at THUMBNAIL_SIZES
+(longest side, capped at the original's), with EXIF and other metadata dropped
+after the orientation is applied. When they are written, the media row
+lists the sizes and a `media_ready` event goes to the uploader. With a
+remote storage backend the original is rendered from a temporary copy and
+the renditions are uploaded next to it.
+
+Until then /api/media/{id}/view?size=N serves the original.
+"""
+import os
+import asyncio
+import logging
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Awaitable, Callable, List, Optional, Set
+
+from PIL import Image, ImageOps
+from sqlalchemy import update
+
+from database import AsyncSessionLocal
+from api.storage import storage, StorageError
+import models
+
+THUMBNAIL_SIZES = sorted({int(size) for size in os.getenv("THUMBNAIL_SIZES", "160,480,1080").split(",") if size.strip()})
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", 2))
+WEBP_QUALITY = int(os.getenv("THUMBNAIL_WEBP_QUALITY", 80))
+
+logger = logging.getLogger(__name__)
+
+# Delivers a media_ready event to the given users; main.py wires it to the
+# connection manager
+publish: Optional[Callable[[dict, List[int]], Awaitable[None]]] = None
+
+def rendition_path(file_path: str, size: int) -> str:
+    """Where the `size` rendition of a file lives (a local path or a storage key)"""
+    return f"{os.path.splitext(file_path)[0]}_{size}.webp"
+
+def pick_rendition(renditions: Optional[List[int]], size: int) -> Optional[int]:
+    """The smallest rendition at least `size` pixels, or None to use the original"""
+    for available in sorted(renditions or []):
+        if available >= size:
+            return available
+    return None
+
+def render_renditions(file_path: str, sizes: List[int], quality: int = WEBP_QUALITY) -> List[int]:
+    """Write WebP renditions of an image and return the sizes written.
+
+    Runs in a worker process. Sizes above the image's longest side are
+    capped to it, so small images get one full-resolution rendition rather
+    than upscaled copies. Animated images are left alone so they keep
+    playing.
+    """
+    written = []
+    with Image.open(file_path) as img:
+        if getattr(img, "n_frames", 1) > 1:
+            return written
+        # Bake the EXIF orientation into the pixels before the EXIF goes
+        img = ImageOps.exif_transpose(img)
+        img = img.convert("RGBA" if img.mode in ("RGBA", "LA", "P") else "RGB")
+        longest = max(img.size)
+
+        targets = {min(size, longest) for size in sizes}
+        # Shrink step by step from the largest size; each pass starts from a
+        # smaller image than the original
+        current = img
+        for size in sorted(targets, reverse=True):
+            current = current.copy()
+            current.thumbnail((size, size), Image.Resampling.LANCZOS)
+            # Saved without exif=, so no EXIF block is written
+            current.save(rendition_path(file_path, size), "WEBP", quality=quality, method=4)
+            written.append(size)
+    return sorted(written)
+
+class ThumbnailService:
+    """Renders uploaded images in a process pool and records the result"""
+
+    def __init__(self, session_factory, workers: int = THUMBNAIL_WORKERS, sizes: List[int] = THUMBNAIL_SIZES):
+        self.session_factory = session_factory
+        self.workers = workers
+        self.sizes = sizes
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    def start(self):
+        if self._executor is None and self.workers > 0:
+            # spawn: forking a process that runs an event loop and threads
+            # can copy held locks into the child
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    async def stop(self):
+        """Cancel queued renders and shut the pool down"""
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def schedule(self, media_id: int, key: str, content_hash: Optional[str] = None):
+        """Render a stored image in the background.
+
+        With a content hash, every media row sharing the blob gets the
+        renditions. Without a pool (THUMBNAIL_WORKERS=0 or not started) the
+        default thread executor is used, which still keeps the event loop free.
+        """
+        task = asyncio.get_running_loop().create_task(self._render(media_id, key, content_hash))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _render_local(self, path: str) -> List[int]:
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, render_renditions, path, self.sizes
+        )
+
+    async def _render_remote(self, key: str) -> List[int]:
+        """Render a copy fetched from storage and upload the renditions next to it"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, os.path.basename(key))
+            await storage.download(key, path)
+            sizes = await self._render_local(path)
+            for size in sizes:
+                await storage.put_file(rendition_path(key, size), rendition_path(path, size), content_type="image/webp")
+        return sizes
+
+    async def _render(self, media_id: int, key: str, content_hash: Optional[str]):
+        path = storage.local_path(key)
+        try:
+            sizes = await (self._render_local(path) if path is not None else self._render_remote(key))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Error rendering media %s: %s", media_id, e)
+            return
+        if not sizes:
+            return
+
+        # Duplicates uploaded while rendering share the blob, so they share the renditions
+        if content_hash is not None:
+            match = models.Media.content_hash == content_hash
+        else:
+            match = models.Media.id == media_id
+        async with self.session_factory() as db:
+            result = await db.execute(
+                update(models.Media).where(match).values(renditions=sizes)
+                .returning(models.Media.id, models.Media.uploaded_by)
+            )
+            rows = result.all()
+            await db.commit()
+        if not rows:
+            # Deleted while rendering
+            await remove_renditions(key, sizes)
+            return
+
+        if publish is not None:
+            for row_id, uploaded_by in rows:
+                await publish({
+                    "type": "media_ready",
+                    "media_id": row_id,
+                    "renditions": [
+                        {"size": size, "url": f"/api/media/{row_id}/view?size={size}"}
+                        for size in sizes
+                    ],
+                }, [uploaded_by])
+
+# Started and stopped with the app; the upload endpoint schedules into it
+thumbnail_service = ThumbnailService(AsyncSessionLocal)
+
+async def remove_renditions(key: str, renditions: Optional[List[int]]):
+    """Delete a stored file's renditions"""
+    for size in renditions or []:
+        try:
+            await storage.delete(rendition_path(key, size))
+        except StorageError as e:
+            logger.warning("Error deleting rendition %s: %s", rendition_path(key, size), e)
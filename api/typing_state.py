@@ -0,0 +1,130 @@
+"""
+Server-side typing indicator state.
+
+Clients send a typing frame on every keystroke. Instead of forwarding each
+one, TypingTracker keeps who is typing in which conversation and emits the
+state of a conversation only when it changed, at most once per
+TYPING_FLUSH_INTERVAL_MS. A typist that stops refreshing is dropped after
+TYPING_TTL seconds, so a lost "stopped typing" frame can't leave an
+indicator stuck on.
+
+The state is kept per worker and isn't shared over the backplane; only the
+emitted frames cross it. A direct conversation has one typist, whose socket
+is on one worker, so nothing is lost there. A group's `user_ids` only lists
+the typists connected to the worker that sent the frame: with several
+workers, members see the typists of each worker in turn rather than all of
+them at once.
+"""
+import os
+import logging
+import time
+import asyncio
+from typing import Awaitable, Callable, Dict, FrozenSet, Optional, Set, Tuple
+
+TYPING_TTL = float(os.getenv("TYPING_TTL", 6))
+TYPING_FLUSH_INTERVAL_MS = int(os.getenv("TYPING_FLUSH_INTERVAL_MS", 250))
+
+logger = logging.getLogger(__name__)
+
+# ("group", group_id) or ("direct", sender_id, receiver_id)
+ConversationKey = Tuple
+Emitter = Callable[[ConversationKey, FrozenSet[int]], Awaitable[None]]
+
+def conversation_key(user_id: int, group_id: Optional[int] = None, receiver_id: Optional[int] = None) -> Optional[ConversationKey]:
+    """Key a typing frame by the conversation it belongs to"""
+    if group_id:
+        return ("group", group_id)
+    if receiver_id:
+        return ("direct", user_id, receiver_id)
+    return None
+
+class TypingTracker:
+    """Tracks typists per conversation and emits coalesced changes on a tick"""
+
+    def __init__(self, emit: Emitter, ttl: float = TYPING_TTL, flush_interval_ms: int = TYPING_FLUSH_INTERVAL_MS):
+        self.emit = emit
+        self.ttl = ttl
+        self.flush_interval = flush_interval_ms / 1000
+        # conversation -> {user_id: expires_at}
+        self._typists: Dict[ConversationKey, Dict[int, float]] = {}
+        # What the members of each conversation were last told
+        self._emitted: Dict[ConversationKey, FrozenSet[int]] = {}
+        self._dirty: Set[ConversationKey] = set()
+        self._active: Optional[asyncio.Event] = None
+        self._ticker: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Start the flush tick"""
+        if self._ticker is None:
+            # Created here so it belongs to the running event loop
+            self._active = asyncio.Event()
+            self._ticker = asyncio.create_task(self._tick_loop())
+
+    def stop(self):
+        """Stop the flush tick and forget all state"""
+        if self._ticker is not None:
+            self._ticker.cancel()
+            self._ticker = None
+        self._typists.clear()
+        self._emitted.clear()
+        self._dirty.clear()
+
+    def update(self, key: ConversationKey, user_id: int, is_typing: bool):
+        """Record a typing frame; nothing is sent until the next tick"""
+        typists = self._typists.get(key)
+        if is_typing:
+            if typists is None:
+                typists = self._typists[key] = {}
+            if user_id not in typists:
+                self._dirty.add(key)
+            typists[user_id] = time.monotonic() + self.ttl
+        elif typists and typists.pop(user_id, None) is not None:
+            self._dirty.add(key)
+            if not typists:
+                del self._typists[key]
+        else:
+            return
+        if self._active is not None:
+            self._active.set()
+
+    def drop_user(self, user_id: int):
+        """Stop a user typing everywhere, e.g. when they go offline"""
+        for key in [key for key, typists in self._typists.items() if user_id in typists]:
+            self.update(key, user_id, False)
+
+    def _expire(self, now: float):
+        for key, typists in list(self._typists.items()):
+            expired = [user_id for user_id, expires_at in typists.items() if expires_at <= now]
+            for user_id in expired:
+                del typists[user_id]
+            if expired:
+                self._dirty.add(key)
+            if not typists:
+                del self._typists[key]
+
+    async def flush(self):
+        """Expire stale typists and emit every conversation whose state changed"""
+        self._expire(time.monotonic())
+        dirty, self._dirty = self._dirty, set()
+        for key in dirty:
+            current = frozenset(self._typists.get(key, ()))
+            # A start and stop within one tick cancel out
+            if current == self._emitted.get(key, frozenset()):
+                continue
+            if current:
+                self._emitted[key] = current
+            else:
+                self._emitted.pop(key, None)
+            try:
+                await self.emit(key, current)
+            except Exception:
+                logger.exception("Error emitting typing state for %s", key)
+
+    async def _tick_loop(self):
+        while True:
+            await self._active.wait()
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+            # Keep ticking while anyone is typing so TTLs are enforced
+            if not self._typists and not self._dirty:
+                self._active.clear()
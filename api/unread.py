@@ -0,0 +1,161 @@
+"""
+Per-user, per-conversation unread counters.
+
+conversation_state is the durable copy: every write that changes an unread
+count updates it in the same transaction. This module keeps the counters of
+recently asked-about users in memory, so GET /api/messages/unread/{user_id}
+is a dict lookup rather than a COUNT(*) over messages, and pushes an
+`unread` event to a user whenever a write reports a new count.
+
+Counts are absolute values read back from conversation_state (the upserts
+use RETURNING), so a dropped or coalesced event is corrected by the next
+one. Cached users expire after UNREAD_CACHE_TTL seconds, which bounds
+staleness when another worker handled the write.
+
+The async paths call push(); the sync routers run in worker threads and
+call push_from_thread(), which hands the frames to the event loop.
+"""
+import os
+import time
+import logging
+import threading
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+import anyio.from_thread
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+
+UNREAD_CACHE_TTL = float(os.getenv("UNREAD_CACHE_TTL", 60))
+
+logger = logging.getLogger(__name__)
+
+# ("direct", peer_id) or ("group", group_id)
+ConversationKey = Tuple[str, int]
+
+# Delivers an unread event to the given users; main.py wires it to the
+# connection manager
+publish: Optional[Callable[[dict, List[int]], Awaitable[None]]] = None
+
+def conversation_key(peer_id: Optional[int], group_id: Optional[int]) -> ConversationKey:
+    return ("group", group_id) if group_id is not None else ("direct", peer_id)
+
+def event(key: ConversationKey, count: int) -> dict:
+    kind, conversation_id = key
+    return {
+        "type": "unread",
+        "peer_id": conversation_id if kind == "direct" else None,
+        "group_id": conversation_id if kind == "group" else None,
+        "unread_count": count,
+    }
+
+class UnreadCounters:
+    """Caches each user's non-zero unread counts by conversation"""
+
+    def __init__(self, ttl: float = UNREAD_CACHE_TTL):
+        self.ttl = ttl
+        self._counts: Dict[int, Tuple[float, Dict[ConversationKey, int]]] = {}
+        # Users being loaded -> whether a write landed meanwhile, in which
+        # case the loaded snapshot may predate it and isn't cached
+        self._loading: Dict[int, bool] = {}
+        # Invalidations come from the sync routers' worker threads
+        self._lock = threading.Lock()
+
+    async def get(self, db: AsyncSession, user_id: int) -> Dict[ConversationKey, int]:
+        """Get a user's unread counts, loading them from conversation_state on a miss"""
+        entry = self._counts.get(user_id)
+        if entry is not None and entry[0] > time.monotonic():
+            return dict(entry[1])
+
+        with self._lock:
+            self._loading.setdefault(user_id, False)
+        try:
+            state = models.ConversationState
+            result = await db.execute(
+                select(state.peer_id, state.group_id, state.unread_count)
+                .where(state.user_id == user_id, state.unread_count > 0)
+            )
+            counts = {conversation_key(peer_id, group_id): count for peer_id, group_id, count in result}
+        finally:
+            with self._lock:
+                stale = self._loading.pop(user_id, True)
+        if not stale:
+            with self._lock:
+                self._counts[user_id] = (time.monotonic() + self.ttl, counts)
+        return dict(counts)
+
+    def _changed(self, user_id: int):
+        if user_id in self._loading:
+            self._loading[user_id] = True
+
+    def set(self, user_id: int, key: ConversationKey, count: int):
+        """Record a count read back from conversation_state"""
+        with self._lock:
+            self._changed(user_id)
+            entry = self._counts.get(user_id)
+            if entry is None:
+                return
+            if count > 0:
+                entry[1][key] = count
+            else:
+                entry[1].pop(key, None)
+
+    def invalidate(self, *user_ids: int):
+        """Drop cached users after a write that didn't report its counts"""
+        with self._lock:
+            for user_id in user_ids:
+                self._changed(user_id)
+                self._counts.pop(user_id, None)
+
+    def clear(self):
+        """Drop every cached user"""
+        with self._lock:
+            for user_id in self._loading:
+                self._loading[user_id] = True
+            self._counts.clear()
+
+# Shared by the message writer, receipts and the unread endpoint
+unread_counters = UnreadCounters()
+
+def record(rows: Iterable) -> List[Tuple[int, ConversationKey, int]]:
+    """Cache committed (user_id, peer_id, group_id, unread_count) rows.
+
+    Call it after the commit; returns the rows as (user_id, conversation, count).
+    """
+    counts = []
+    for user_id, peer_id, group_id, count in rows:
+        key = conversation_key(peer_id, group_id)
+        unread_counters.set(user_id, key, count)
+        counts.append((user_id, key, count))
+    return counts
+
+async def _publish(counts: List[Tuple[int, ConversationKey, int]]):
+    # Users whose conversation landed on the same count share one frame, so
+    # a group message costs one encode per distinct count, not one per member
+    audiences: Dict[Tuple[ConversationKey, int], List[int]] = defaultdict(list)
+    for user_id, key, count in counts:
+        audiences[(key, count)].append(user_id)
+
+    if publish is None:
+        return
+    for (key, count), user_ids in audiences.items():
+        await publish(event(key, count), user_ids)
+
+async def push(rows: Iterable):
+    """Cache committed count rows and push them to their users"""
+    await _publish(record(rows))
+
+def push_from_thread(rows: Iterable):
+    """push() for the sync routers, which run in AnyIO worker threads.
+
+    The counts are cached even if the frames can't be sent.
+    """
+    counts = record(rows)
+    if publish is None or not counts:
+        return
+    try:
+        anyio.from_thread.run(_publish, counts)
+    except Exception:
+        logger.exception("Error pushing unread counts")
@@ -0,0 +1,195 @@
+"""
+Streaming multipart parser for file uploads.
+
+FastAPI's UploadFile only reaches the endpoint after Starlette has parsed
+the whole request body into a temporary file, so an oversized upload can't
+be refused until it has been received in full. stream_upload() reads the
+request body chunk by chunk, writes the file part to disk as it arrives,
+hashes it on the way and stops as soon as the size limit is crossed.
+Memory use per upload is a few chunks, whatever the file size.
+"""
+import os
+import uuid
+import hashlib
+import logging
+from typing import Callable, Dict, Optional
+
+import aiofiles
+from fastapi import Request
+from multipart.multipart import MultipartParser, parse_options_header
+from multipart.exceptions import MultipartParseError
+
+logger = logging.getLogger(__name__)
+
+# Room for the multipart boundaries, part headers and form fields that
+# share the request body with the file
+MULTIPART_OVERHEAD = int(os.getenv("UPLOAD_MULTIPART_OVERHEAD", 65536))
+# Form fields are small; refuse to buffer anything bigger
+MAX_FIELD_SIZE = 4096
+
+class UploadError(Exception):
+    """The request body is not an acceptable upload"""
+
+class UploadTooLarge(UploadError):
+    """The file (or the declared request body) exceeds the size limit"""
+
+class StreamedUpload:
+    """A file part written to disk, plus the form's other fields"""
+
+    def __init__(self):
+        self.path: Optional[str] = None
+        self.filename: Optional[str] = None
+        self.content_type: Optional[str] = None
+        self.size = 0
+        self.content_hash: Optional[str] = None
+        self.fields: Dict[str, str] = {}
+
+    def discard(self):
+        """Remove the written file, if any"""
+        if self.path and os.path.exists(self.path):
+            try:
+                os.remove(self.path)
+            except OSError as e:
+                logger.warning("Error removing upload %s: %s", self.path, e)
+
+class _Part:
+    def __init__(self):
+        self.headers: Dict[bytes, bytes] = {}
+        self.name: Optional[str] = None
+        self.is_file = False
+        self.data = bytearray()
+
+async def stream_upload(
+    request: Request,
+    directory: str,
+    max_size: int,
+    file_field: str = "file",
+    accept: Optional[Callable[[str], bool]] = None,
+    chunk_size: int = 65536
+) -> StreamedUpload:
+    """Stream a multipart/form-data body's file part into `directory`.
+
+    The file gets a random name keeping the original extension. `accept`
+    is called with the part's content type before any of it is written.
+    Raises UploadTooLarge once more than `max_size` file bytes arrive, and
+    UploadError for malformed bodies; the partial file is removed either way.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise UploadError("Expected a multipart/form-data body")
+
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > max_size + MULTIPART_OVERHEAD:
+        # Refuse before reading a byte of the body
+        raise UploadTooLarge(f"File size exceeds maximum allowed size of {max_size} bytes")
+
+    upload = StreamedUpload()
+    digest = hashlib.sha256()
+    part = _Part()
+    header_field = bytearray()
+    header_value = bytearray()
+    # The parser's callbacks are synchronous; file data is queued here and
+    # written (awaited) after each chunk is fed
+    pending = []
+    finished = []
+
+    def on_part_begin():
+        nonlocal part
+        part = _Part()
+
+    def on_header_field(data, start, end):
+        header_field.extend(data[start:end])
+
+    def on_header_value(data, start, end):
+        header_value.extend(data[start:end])
+
+    def on_header_end():
+        part.headers[bytes(header_field).lower()] = bytes(header_value)
+        header_field.clear()
+        header_value.clear()
+
+    def on_headers_finished():
+        _, options = parse_options_header(part.headers.get(b"content-disposition", b""))
+        if b"name" not in options:
+            raise UploadError('The Content-Disposition header field "name" must be provided')
+        part.name = options[b"name"].decode("utf-8", "replace")
+        if b"filename" not in options:
+            return
+        if part.name != file_field or upload.path is not None:
+            raise UploadError(f"Only one file, in the '{file_field}' field, is accepted")
+
+        part.is_file = True
+        upload.filename = options[b"filename"].decode("utf-8", "replace")
+        upload.content_type = part.headers.get(b"content-type", b"application/octet-stream").decode("latin-1")
+        if accept is not None and not accept(upload.content_type):
+            raise UploadError(f"File type {upload.content_type} is not allowed")
+        extension = os.path.splitext(upload.filename)[1]
+        upload.path = os.path.join(directory, f"{uuid.uuid4()}{extension}")
+
+    def on_part_data(data, start, end):
+        if part.is_file:
+            pending.append(data[start:end])
+        else:
+            part.data.extend(data[start:end])
+            if len(part.data) > MAX_FIELD_SIZE:
+                raise UploadError(f"Form field '{part.name}' is too large")
+
+    def on_part_end():
+        if part.is_file:
+            finished.append(part)
+        else:
+            upload.fields[part.name] = part.data.decode("utf-8", "replace")
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+
+    os.makedirs(directory, exist_ok=True)
+    out = None
+    try:
+        async for chunk in request.stream():
+            # Feed at most chunk_size bytes at a time so a large network read
+            # can't queue more than that before the size check
+            for offset in range(0, len(chunk), chunk_size):
+                parser.write(chunk[offset:offset + chunk_size])
+                if pending:
+                    if out is None:
+                        out = await aiofiles.open(upload.path, "wb")
+                    for data in pending:
+                        upload.size += len(data)
+                        if upload.size > max_size:
+                            raise UploadTooLarge(f"File size exceeds maximum allowed size of {max_size} bytes")
+                        digest.update(data)
+                        await out.write(data)
+                    pending.clear()
+        parser.finalize()
+        if upload.path is None:
+            raise UploadError(f"No file was sent in the '{file_field}' field")
+        if not finished:
+            raise UploadError("The request body ended before the file did")
+        if out is None:
+            # Empty file
+            out = await aiofiles.open(upload.path, "wb")
+    except MultipartParseError as e:
+        await _close(out)
+        upload.discard()
+        raise UploadError(f"Malformed multipart body: {e}")
+    except BaseException:
+        # Includes the client disconnecting mid-upload
+        await _close(out)
+        upload.discard()
+        raise
+    await _close(out)
+
+    upload.content_hash = digest.hexdigest()
+    return upload
+
+async def _close(out):
+    if out is not None:
+        await out.close()
@@ -1,64 +1,410 @@
+import os
+import asyncio
+import uuid
+from collections import deque
 from fastapi import WebSocket
-from typing import Dict, List
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Tuple
 import json
+import logging
 
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[int, WebSocket] = {}
-        
-    async def connect(self, websocket: WebSocket, user_id: int):
-        """Accept a WebSocket connection and store it"""
-        await websocket.accept()
-        self.active_connections[user_id] = websocket
-        
-    def disconnect(self, user_id: int):
-        """Remove a WebSocket connection"""
-        if user_id in self.active_connections:
-            del self.active_connections[user_id]
-            
-    async def send_personal_message(self, message: str, user_id: int):
-        """Send a message to a specific user"""
-        print(f"Attempting to send message to user {user_id}")
-        print(f"Active connections: {list(self.active_connections.keys())}")
+from api import metrics
+from api.backplane import Backplane
+from logging_config import log_payload
 
-        if user_id in self.active_connections:
-            try:
-                print(f"Sending message to user {user_id}: {message}")
-                await self.active_connections[user_id].send_text(message)
-                print(f"Message sent successfully to user {user_id}")
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# Maximum time a single send may take before the consumer is considered slow
+SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", 5))
+
+# Maximum number of concurrent sessions (tabs/devices) per user
+MAX_SESSIONS_PER_USER = int(os.getenv("WS_MAX_SESSIONS_PER_USER", 5))
+
+# Maximum number of frames buffered per connection
+QUEUE_SIZE = int(os.getenv("WS_QUEUE_SIZE", 256))
+
+# Strategies tried in order when a connection's queue is full:
+#   coalesce    - replace a queued frame that has the same coalesce key
+#   drop_typing - evict the oldest queued typing event (or skip an incoming one)
+#   disconnect  - close the client, it can't keep up
+# If none of them makes room the incoming frame is dropped.
+QUEUE_POLICY = os.getenv("WS_QUEUE_POLICY", "coalesce,drop_typing,disconnect")
+
+OVERFLOW_STRATEGIES = {"coalesce", "drop_typing", "disconnect"}
+
+# JSON encoder used for outbound payloads: "orjson" (falls back to json if
+# the package isn't installed) or "json"
+JSON_ENCODER = os.getenv("WS_JSON_ENCODER", "orjson")
+
+def parse_queue_policy(policy: str) -> List[str]:
+    """Parse a comma separated overflow policy into a list of strategies"""
+    strategies = [part.strip() for part in policy.split(",") if part.strip()]
+    unknown = set(strategies) - OVERFLOW_STRATEGIES
+    if unknown:
+        raise ValueError(f"Unknown WebSocket queue policy: {', '.join(sorted(unknown))}")
+    return strategies
+
+def get_json_encoder(name: str) -> Callable[[Any], str]:
+    """Return a function that serializes a payload to a WebSocket text frame"""
+    if name == "orjson":
+        if orjson is not None:
+            return lambda payload: orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS).decode()
+        logger.warning("orjson is not installed, falling back to the json module")
+        return json.dumps
+    if name == "json":
+        return json.dumps
+    raise ValueError(f"Unknown JSON encoder: {name}")
+
+# (message, kind, coalesce_key)
+QueuedFrame = Tuple[str, Optional[str], Optional[str]]
+
+class Connection:
+    """A live WebSocket with a bounded outbound queue drained by its own writer task"""
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        user_id: int,
+        max_queue: int,
+        policy: List[str],
+        send_timeout: float,
+        on_failure: Callable[["Connection", str, bool], None],
+        session_id: Optional[str] = None
+    ):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.session_id = session_id
+        self.max_queue = max_queue
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self.on_failure = on_failure
+        self.queue: Deque[QueuedFrame] = deque()
+        self.closed = False
+        self.dropped_frames = 0
+        self._wakeup = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Start the writer task for this connection"""
+        self._writer = asyncio.create_task(self._write_loop())
+
+    def enqueue(self, message: str, kind: Optional[str] = None, coalesce_key: Optional[str] = None) -> bool:
+        """Queue a frame for sending, applying the overflow policy if the queue is full"""
+        if self.closed:
+            return False
+
+        if len(self.queue) >= self.max_queue:
+            outcome = self._apply_overflow_policy(message, kind, coalesce_key)
+            if outcome == "coalesced":
                 return True
-            except Exception as e:
-                print(f"Error sending message to user {user_id}: {e}")
-                # Remove disconnected connection
-                self.disconnect(user_id)
+            if outcome != "room":
+                self.dropped_frames += 1
+                metrics.WS_DROPPED_FRAMES.inc()
                 return False
+
+        self.queue.append((message, kind, coalesce_key))
+        self._wakeup.set()
+        return True
+
+    def _apply_overflow_policy(self, message: str, kind: Optional[str], coalesce_key: Optional[str]) -> Optional[str]:
+        """Try the overflow strategies in order.
+
+        Returns "room" if space was freed, "coalesced" if the frame replaced a
+        queued one, or None if the frame has to be dropped.
+        """
+        for strategy in self.policy:
+            if strategy == "coalesce" and coalesce_key is not None:
+                for index, (_, _, queued_key) in enumerate(self.queue):
+                    if queued_key == coalesce_key:
+                        # Newer state supersedes the queued one in place
+                        self.queue[index] = (message, kind, coalesce_key)
+                        self.dropped_frames += 1
+                        return "coalesced"
+            elif strategy == "drop_typing":
+                if kind == "typing":
+                    return None
+                for index, (_, queued_kind, _) in enumerate(self.queue):
+                    if queued_kind == "typing":
+                        del self.queue[index]
+                        self.dropped_frames += 1
+                        return "room"
+            elif strategy == "disconnect":
+                metrics.WS_SEND_FAILURES.inc("queue_full")
+                self.on_failure(self, "outbound queue full", True)
+                return None
+        return None
+
+    async def _write_loop(self):
+        """Drain the queue onto the socket until the connection closes"""
+        while not self.closed:
+            if not self.queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            message, _, _ = self.queue.popleft()
+            try:
+                await asyncio.wait_for(self.websocket.send_text(message), timeout=self.send_timeout)
+            except asyncio.TimeoutError:
+                # A cancelled send may have left a partial frame on the wire,
+                # so the socket can't be reused - drop it
+                metrics.WS_SEND_FAILURES.inc("timeout")
+                self.on_failure(self, f"send timed out after {self.send_timeout}s", True)
+                return
+            except Exception as e:
+                metrics.WS_SEND_FAILURES.inc("error")
+                # Usually a client that went away rather than a slow one
+                self.on_failure(self, f"send failed: {e}", False)
+                return
+
+    def close(self):
+        """Stop the writer task and discard anything still queued"""
+        self.closed = True
+        self.queue.clear()
+        self._wakeup.set()
+        if self._writer is not None and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+
+class ConnectionManager:
+    def __init__(
+        self,
+        send_timeout: float = SEND_TIMEOUT,
+        max_queue: int = QUEUE_SIZE,
+        queue_policy: str = QUEUE_POLICY,
+        json_encoder: str = JSON_ENCODER,
+        max_sessions_per_user: int = MAX_SESSIONS_PER_USER
+    ):
+        # user_id -> {session_id: Connection}, one entry per tab or device
+        self.active_connections: Dict[int, Dict[str, Connection]] = {}
+        self.max_sessions_per_user = max_sessions_per_user
+        # Serialize a payload once and reuse the frame for every recipient
+        self.encode = get_json_encoder(json_encoder)
+        self.send_timeout = send_timeout
+        self.max_queue = max_queue
+        self.queue_policy = parse_queue_policy(queue_policy)
+        # Number of times each user was dropped for being too slow
+        self.slow_consumers: Dict[int, int] = {}
+        # Cross-process routing; None means every socket lives in this process
+        self.backplane: Optional[Backplane] = None
+        self.worker_id = uuid.uuid4().hex
+
+    async def start_backplane(self, backplane: Optional[Backplane]):
+        """Attach a backplane so frames reach users connected to other workers"""
+        if backplane is None:
+            return
+        await backplane.start(self._deliver_remote)
+        self.backplane = backplane
+        for user_id in list(self.active_connections):
+            await backplane.subscribe(user_id)
+
+    async def stop_backplane(self):
+        """Detach from the backplane"""
+        if self.backplane is not None:
+            backplane, self.backplane = self.backplane, None
+            await backplane.stop()
+
+    def _sync_subscription(self, user_id: int):
+        """Subscribe to or unsubscribe from a user's channel to match local sessions"""
+        if self.backplane is not None:
+            asyncio.create_task(self._apply_subscription(user_id))
+
+    async def _apply_subscription(self, user_id: int):
+        # Decide when the task runs, not when it was scheduled, so a quick
+        # disconnect/reconnect can't leave the user unsubscribed
+        backplane = self.backplane
+        if backplane is None:
+            return
+        try:
+            if user_id in self.active_connections:
+                await backplane.subscribe(user_id)
+            else:
+                await backplane.unsubscribe(user_id)
+        except Exception as e:
+            logger.warning("Error updating backplane subscription for user %s: %s", user_id, e)
+
+    async def _publish(self, user_ids: List[int], message: str, kind: Optional[str], coalesce_key: Optional[str]) -> Dict[int, int]:
+        """Publish a frame for users whose sessions may live on other workers"""
+        if self.backplane is None or not user_ids:
+            return {}
+        envelope = self.encode({"origin": self.worker_id, "message": message, "kind": kind, "coalesce_key": coalesce_key})
+        try:
+            return await self.backplane.publish(user_ids, envelope)
+        except Exception as e:
+            logger.warning("Error publishing to backplane: %s", e)
+            return {}
+
+    def _deliver_remote(self, user_id: int, envelope: str):
+        """Queue a frame published by another worker on this worker's sessions"""
+        try:
+            frame = json.loads(envelope)
+        except ValueError:
+            logger.warning("Discarding malformed backplane frame for user %s", user_id)
+            return
+        # Our own publishes were already delivered locally
+        if frame.get("origin") == self.worker_id:
+            return
+        self._enqueue(user_id, frame["message"], frame.get("kind"), frame.get("coalesce_key"))
+
+    async def connect(self, websocket: WebSocket, user_id: int) -> Optional[str]:
+        """Accept a WebSocket connection and register it as a new session.
+
+        Returns the session ID, or None if the user already has the maximum
+        number of live sessions (the socket is closed in that case).
+        """
+        # Sessions live in an insertion-ordered dict, so the limit check is O(1)
+        session_count = len(self.active_connections.get(user_id, ()))
+        if session_count >= self.max_sessions_per_user:
+            logger.info("User %s already has %d sessions, rejecting new connection", user_id, session_count)
+            metrics.WS_REJECTED.inc()
+            await websocket.close(code=1008)
+            return None
+
+        await websocket.accept()
+        session_id = uuid.uuid4().hex
+        connection = Connection(
+            websocket,
+            user_id,
+            max_queue=self.max_queue,
+            policy=self.queue_policy,
+            send_timeout=self.send_timeout,
+            on_failure=self._on_connection_failure,
+            session_id=session_id
+        )
+        first_session = user_id not in self.active_connections
+        self.active_connections.setdefault(user_id, {})[session_id] = connection
+        connection.start()
+        metrics.WS_CONNECTS.inc()
+        if first_session:
+            self._sync_subscription(user_id)
+        return session_id
+
+    def disconnect(self, user_id: int, session_id: Optional[str] = None):
+        """Remove one session of a user, or all of them if no session is given"""
+        sessions = self.active_connections.get(user_id)
+        if not sessions:
+            return
+
+        if session_id is None:
+            removed = list(sessions.values())
+            sessions.clear()
         else:
-            print(f"User {user_id} not connected")
+            connection = sessions.pop(session_id, None)
+            removed = [connection] if connection is not None else []
+
+        for connection in removed:
+            connection.close()
+            metrics.WS_DISCONNECTS.inc()
+        if not sessions:
+            del self.active_connections[user_id]
+            self._sync_subscription(user_id)
+
+    def _on_connection_failure(self, connection: Connection, reason: str, slow: bool):
+        """Drop a connection whose writer failed or fell too far behind"""
+        logger.warning("Dropping slow or failed session", extra={"user_id": connection.user_id, "session_id": connection.session_id, "reason": reason})
+        if slow:
+            self.slow_consumers[connection.user_id] = self.slow_consumers.get(connection.user_id, 0) + 1
+        # Also closes the connection
+        self.disconnect(connection.user_id, connection.session_id)
+        asyncio.create_task(self._close_socket(connection.websocket))
+
+    async def _close_socket(self, websocket: WebSocket):
+        """Close a dropped socket without blocking the caller"""
+        try:
+            await asyncio.wait_for(websocket.close(code=1013), timeout=1)
+        except Exception:
+            pass
+
+    def _enqueue(self, user_id: int, message: str, kind: Optional[str], coalesce_key: Optional[str]) -> bool:
+        """Queue a frame on every live session of a user"""
+        sessions = self.active_connections.get(user_id)
+        if not sessions:
             return False
-                
+        delivered = False
+        # Copy: the overflow policy may disconnect a session while we iterate
+        for connection in list(sessions.values()):
+            delivered = connection.enqueue(message, kind, coalesce_key) or delivered
+        return delivered
+
+    async def send_personal_message(
+        self,
+        message: str,
+        user_id: int,
+        kind: Optional[str] = None,
+        coalesce_key: Optional[str] = None
+    ):
+        """Queue a message for all of a user's sessions"""
+        delivered = False
+        if user_id in self.active_connections:
+            log_payload(logger, "Queueing message", message, user_id=user_id)
+            delivered = self._enqueue(user_id, message, kind, coalesce_key)
+        elif self.backplane is None:
+            logger.debug("User %s not connected", user_id)
+
+        # The user may also have sessions on other workers
+        receivers = await self._publish([user_id], message, kind, coalesce_key)
+        return delivered or receivers.get(user_id, 0) > 0
+
+    async def send_to_session(self, message: str, user_id: int, session_id: str) -> bool:
+        """Queue a message for a single session, e.g. a reply to the frame it sent"""
+        connection = self.active_connections.get(user_id, {}).get(session_id)
+        return connection is not None and connection.enqueue(message)
+
+    async def send_to_many(
+        self,
+        message: str,
+        user_ids: Iterable[int],
+        exclude: Optional[int] = None,
+        kind: Optional[str] = None,
+        coalesce_key: Optional[str] = None
+    ) -> Dict[int, bool]:
+        """Queue a message for many users at once.
+
+        Each connection drains its own queue, so one slow socket can't stall
+        delivery to the rest. With a backplane attached the frame is also
+        published once per recipient for sessions on other workers.
+
+        Returns a mapping of user_id to whether the frame was accepted by at
+        least one of the user's sessions (or published to another worker);
+        users that are not connected anywhere are reported as False.
+        """
+        results: Dict[int, bool] = {}
+        for user_id in dict.fromkeys(user_ids):
+            if user_id == exclude:
+                continue
+            results[user_id] = self._enqueue(user_id, message, kind, coalesce_key)
+
+        receivers = await self._publish(list(results), message, kind, coalesce_key)
+        for user_id, count in receivers.items():
+            results[user_id] = results[user_id] or count > 0
+        return results
+
     async def broadcast(self, message: str):
-        """Broadcast a message to all connected users"""
-        disconnected_users = []
-        for user_id, connection in self.active_connections.items():
-            try:
-                await connection.send_text(message)
-            except Exception as e:
-                print(f"Error broadcasting to user {user_id}: {e}")
-                disconnected_users.append(user_id)
-                
-        # Clean up disconnected connections
-        for user_id in disconnected_users:
-            self.disconnect(user_id)
-            
-    async def send_to_group(self, message: str, user_ids: List[int]):
+        """Broadcast a message to all users connected to this worker"""
+        await self.send_to_many(message, list(self.active_connections.keys()))
+
+    async def send_to_group(
+        self,
+        message: str,
+        user_ids: List[int],
+        exclude: Optional[int] = None,
+        kind: Optional[str] = None,
+        coalesce_key: Optional[str] = None
+    ):
         """Send a message to a list of users"""
-        for user_id in user_ids:
-            await self.send_personal_message(message, user_id)
-            
+        return await self.send_to_many(message, user_ids, exclude=exclude, kind=kind, coalesce_key=coalesce_key)
+
     def get_connected_users(self) -> List[int]:
         """Get list of currently connected user IDs"""
         return list(self.active_connections.keys())
-        
+
+    def get_session_count(self) -> int:
+        """Get the number of open sessions on this worker"""
+        return sum(len(sessions) for sessions in self.active_connections.values())
+
     def is_user_connected(self, user_id: int) -> bool:
         """Check if a user is currently connected"""
         return user_id in self.active_connections
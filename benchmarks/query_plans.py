@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Query-plan benchmark for the message, membership, reaction and call-log
+indexes.
+
+Seeds a scratch database, then runs the application's hot queries twice:
+once with only the original single-column indexes and once with the
+composite/partial indexes declared in models.py. For each query it prints
+the plan (EXPLAIN QUERY PLAN on SQLite, EXPLAIN ANALYZE on PostgreSQL) and
+the median latency, and saves everything as JSON.
+
+Example:
+    python benchmarks/query_plans.py --messages 500000
+    python benchmarks/query_plans.py --database-url postgresql://.../webchat_bench --reset
+
+Only point --database-url at a disposable database: the composite indexes
+are dropped and recreated, and --reset drops every table.
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, func, insert, select, text, tuple_, or_, union_all
+
+import models
+from database import Base
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+# Indexes under test, as declared in the models' __table_args__
+BENCHMARKED_INDEXES = {
+    "ix_messages_group_created",
+    "ix_messages_direct_created",
+    "ix_messages_receiver_unread",
+    "ix_group_members_group_user",
+    "ix_group_members_user_group",
+    "ix_reactions_message_user_emoji",
+    "ix_call_logs_caller_started",
+    "ix_call_logs_receiver_started",
+    "ix_call_logs_started",
+}
+
+def benchmarked_indexes():
+    return [
+        index
+        for table in Base.metadata.sorted_tables
+        for index in table.indexes
+        if index.name in BENCHMARKED_INDEXES
+    ]
+
+def seed(engine, args):
+    """Fill the database with users, groups, messages, reactions and calls"""
+    rng = random.Random(args.seed)
+    now = datetime.now(timezone.utc)
+    start = now - timedelta(days=365)
+    span = (now - start).total_seconds()
+    batch = 10000
+
+    with engine.begin() as conn:
+        conn.execute(insert(models.User.__table__), [
+            {"username": f"qp_user_{i}", "is_active": True} for i in range(args.users)
+        ])
+        user_ids = list(conn.execute(select(models.User.id)).scalars())
+        conn.execute(insert(models.Group.__table__), [
+            {"name": f"qp_group_{i}", "created_by": rng.choice(user_ids)} for i in range(args.groups)
+        ])
+        group_ids = list(conn.execute(select(models.Group.id)).scalars())
+        members = []
+        for group_id in group_ids:
+            for user_id in rng.sample(user_ids, min(args.group_size, len(user_ids))):
+                members.append({"group_id": group_id, "user_id": user_id, "is_admin": False})
+        conn.execute(insert(models.GroupMember.__table__), members)
+
+    print(f"Seeding {args.messages} messages...")
+    rows = []
+    # A few busy conversations and groups, like real traffic
+    hot_pairs = [tuple(rng.sample(user_ids, 2)) for _ in range(20)]
+    for n in range(args.messages):
+        created_at = start + timedelta(seconds=span * n / args.messages)
+        row = {
+            "content": f"message {n}",
+            "message_type": models.MessageType.TEXT,
+            "is_read": rng.random() < 0.9,
+            "is_delivered": True,
+            "created_at": created_at,
+            "deleted_at": created_at if rng.random() < 0.02 else None,
+            "receiver_id": None,
+            "group_id": None,
+        }
+        if rng.random() < 0.5:
+            row["group_id"] = rng.choice(group_ids)
+            row["sender_id"] = rng.choice(user_ids)
+        else:
+            sender, receiver = rng.choice(hot_pairs) if rng.random() < 0.3 else rng.sample(user_ids, 2)
+            if rng.random() < 0.5:
+                sender, receiver = receiver, sender
+            row["sender_id"], row["receiver_id"] = sender, receiver
+        rows.append(row)
+        if len(rows) == batch:
+            with engine.begin() as conn:
+                conn.execute(insert(models.Message.__table__), rows)
+            rows = []
+    if rows:
+        with engine.begin() as conn:
+            conn.execute(insert(models.Message.__table__), rows)
+
+    with engine.begin() as conn:
+        max_message_id = conn.execute(select(func.max(models.Message.id))).scalar()
+        reactions = [
+            {"message_id": rng.randint(1, max_message_id), "user_id": rng.choice(user_ids), "emoji": rng.choice("👍❤😂")}
+            for _ in range(args.messages // 10)
+        ]
+        for offset in range(0, len(reactions), batch):
+            conn.execute(insert(models.Reaction.__table__), reactions[offset:offset + batch])
+        calls = [
+            {
+                "caller_id": rng.choice(user_ids),
+                "receiver_id": rng.choice(user_ids),
+                "call_status": models.CallStatus.END,
+                "started_at": start + timedelta(seconds=rng.random() * span),
+            }
+            for _ in range(args.messages // 20)
+        ]
+        for offset in range(0, len(calls), batch):
+            conn.execute(insert(models.CallLog.__table__), calls[offset:offset + batch])
+
+def pick_parameters(engine) -> Dict:
+    """Choose the busiest group and conversation as query arguments"""
+    message = models.Message
+    with engine.connect() as conn:
+        group_id = conn.execute(
+            select(message.group_id).where(message.group_id.isnot(None))
+            .group_by(message.group_id).order_by(func.count().desc()).limit(1)
+        ).scalar()
+        user1, user2 = conn.execute(
+            select(message.sender_id, message.receiver_id).where(message.receiver_id.isnot(None))
+            .group_by(message.sender_id, message.receiver_id).order_by(func.count().desc()).limit(1)
+        ).one()
+        # A cursor a long way back in the group's history
+        deep = conn.execute(
+            select(message.created_at, message.id)
+            .where(message.group_id == group_id, message.deleted_at.is_(None))
+            .order_by(message.created_at, message.id).limit(1).offset(50)
+        ).one()
+        reaction = conn.execute(select(models.Reaction).limit(1)).mappings().one()
+    return {
+        "group_id": group_id,
+        "user1": user1,
+        "user2": user2,
+        "deep_cursor": tuple(deep),
+        "reaction": reaction,
+    }
+
+def build_queries(p: Dict) -> Dict:
+    """The application's hot queries, shaped like the endpoints issue them"""
+    m = models.Message
+    newest_first = (m.created_at.desc(), m.id.desc())
+    # get_conversation pages each direction separately and merges the rows
+    directions = union_all(*(
+        select(
+            select(m).where(m.sender_id == sender, m.receiver_id == receiver, m.deleted_at.is_(None))
+            .order_by(*newest_first).limit(101).subquery()
+        )
+        for sender, receiver in ((p["user1"], p["user2"]), (p["user2"], p["user1"]))
+    ))
+    return {
+        "group_history_latest": select(m).where(m.group_id == p["group_id"], m.deleted_at.is_(None))
+            .order_by(*newest_first).limit(101),
+        "group_history_deep": select(m).where(
+            m.group_id == p["group_id"], m.deleted_at.is_(None),
+            tuple_(m.created_at, m.id) < tuple_(*p["deep_cursor"])
+        ).order_by(*newest_first).limit(101),
+        "conversation_latest": directions,
+        "unread_count": select(func.count()).select_from(m).where(
+            m.receiver_id == p["user1"], m.is_read == False, m.deleted_at.is_(None)
+        ),
+        "group_member_ids": select(models.GroupMember.user_id).where(models.GroupMember.group_id == p["group_id"]),
+        "groups_of_user": select(models.GroupMember.group_id).where(models.GroupMember.user_id == p["user1"]),
+        "reaction_toggle_lookup": select(models.Reaction).where(
+            models.Reaction.message_id == p["reaction"]["message_id"],
+            models.Reaction.user_id == p["reaction"]["user_id"],
+            models.Reaction.emoji == p["reaction"]["emoji"],
+        ),
+        "call_history": select(models.CallLog).where(
+            or_(models.CallLog.caller_id == p["user1"], models.CallLog.receiver_id == p["user1"])
+        ).order_by(models.CallLog.started_at.desc()).limit(50),
+    }
+
+def explain(conn, statement) -> List[str]:
+    compiled = statement.compile(dialect=conn.dialect)
+    params = compiled.params
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+    prefix = {
+        "sqlite": "EXPLAIN QUERY PLAN ",
+        "postgresql": "EXPLAIN (ANALYZE, BUFFERS) ",
+    }.get(conn.dialect.name, "EXPLAIN ")
+    rows = conn.exec_driver_sql(prefix + str(compiled), params)
+    if conn.dialect.name == "sqlite":
+        # (id, parent, notused, detail)
+        return [row[-1] for row in rows]
+    return [" ".join(str(value) for value in row) for row in rows]
+
+def time_query(conn, statement, repeat: int) -> float:
+    """Median wall time in milliseconds"""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        conn.execute(statement).fetchall()
+        samples.append((time.perf_counter() - started) * 1000)
+    return round(statistics.median(samples), 3)
+
+def analyze(engine):
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE"))
+
+def run_phase(engine, queries: Dict, repeat: int) -> Dict:
+    results = {}
+    with engine.connect() as conn:
+        for name, statement in queries.items():
+            results[name] = {"plan": explain(conn, statement), "median_ms": time_query(conn, statement, repeat)}
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare query plans with and without the composite indexes")
+    parser.add_argument("--database-url", default=f"sqlite:///{os.path.join(RESULTS_DIR, 'query_plans.db')}",
+                        help="Scratch database (default: SQLite file under benchmarks/results)")
+    parser.add_argument("--reset", action="store_true", help="Drop all tables and reseed")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--groups", type=int, default=200)
+    parser.add_argument("--group-size", type=int, default=30)
+    parser.add_argument("--messages", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=20, help="Timed runs per query")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="JSON results path")
+    args = parser.parse_args()
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    engine = create_engine(args.database_url)
+
+    if args.reset:
+        Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+
+    with engine.connect() as conn:
+        seeded = conn.execute(select(func.count()).select_from(models.Message)).scalar()
+    if seeded:
+        print(f"Reusing {seeded} seeded messages (pass --reset to reseed)")
+    else:
+        seed(engine, args)
+
+    queries = build_queries(pick_parameters(engine))
+    indexes = benchmarked_indexes()
+
+    print("Dropping composite indexes...")
+    for index in indexes:
+        index.drop(engine, checkfirst=True)
+    analyze(engine)
+    without = run_phase(engine, queries, args.repeat)
+
+    print("Creating composite indexes...")
+    for index in indexes:
+        index.create(engine, checkfirst=True)
+    analyze(engine)
+    with_indexes = run_phase(engine, queries, args.repeat)
+
+    report = {
+        "benchmark": "query_plans",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "dialect": engine.dialect.name,
+        "config": {key: getattr(args, key) for key in ("users", "groups", "group_size", "messages", "repeat")},
+        "queries": {},
+    }
+    for name in queries:
+        before, after = without[name], with_indexes[name]
+        speedup = round(before["median_ms"] / after["median_ms"], 1) if after["median_ms"] else None
+        report["queries"][name] = {"without_indexes": before, "with_indexes": after, "speedup": speedup}
+
+        print(f"\n== {name}: {before['median_ms']}ms -> {after['median_ms']}ms ({speedup}x)")
+        print("   without:")
+        for line in before["plan"]:
+            print(f"     {line}")
+        print("   with:")
+        for line in after["plan"]:
+            print(f"     {line}")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"query_plans-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2, default=str)
+    print(f"\nResults saved to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,459 @@
+#!/usr/bin/env python3
+"""
+WebSocket load generator for WebChat.
+
+Creates (or reuses) N simulated users, connects each one to /ws/{user_id}
+and drives a weighted mix of direct messages, group messages, typing
+indicators, reactions and WebRTC call signals at a fixed rate. Every
+delivered frame that can be matched to the send that caused it yields an
+end-to-end latency sample. Results are printed and saved as JSON; pass
+--baseline to compare against an earlier run and fail on regressions.
+
+Example:
+    python benchmarks/ws_load.py --users 2000 --groups 100 --group-size 25 \\
+        --rate 1000 --duration 60 --mix dm=50,group=30,typing=10,reaction=5,call=5
+
+Thousands of sockets need a high open-file limit on both ends; the script
+raises its own soft limit as far as the hard limit allows.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import defaultdict, deque
+from datetime import datetime, timezone
+from typing import Deque, Dict, List, Optional, Tuple
+
+import httpx
+import websockets
+
+EVENT_KINDS = ("dm", "group", "typing", "reaction", "call")
+LATENCY_KINDS = ("dm", "group", "reaction", "call")
+DEFAULT_MIX = "dm=50,group=30,typing=10,reaction=5,call=5"
+MARKER = "bench:"
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    """Parse "dm=50,group=30,..." into normalised weights"""
+    weights = {}
+    for item in spec.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in EVENT_KINDS:
+            raise ValueError(f"Unknown event kind in mix: {name}")
+        weights[name] = float(weight)
+    total = sum(weights.values())
+    if total <= 0:
+        raise ValueError("Event mix weights must add up to more than zero")
+    return {name: weight / total for name, weight in weights.items() if weight > 0}
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """Latency summary in milliseconds"""
+    values = sorted(samples)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean_ms": round(sum(values) / len(values) * 1000, 3),
+        "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+        "p90_ms": round(percentile(values, 0.90) * 1000, 3),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3),
+    }
+
+def raise_open_file_limit():
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+class LoadTest:
+    """One benchmark run against a live server"""
+
+    def __init__(self, args):
+        self.args = args
+        self.base_url = args.url.rstrip("/")
+        self.ws_url = self.base_url.replace("http://", "ws://", 1).replace("https://", "wss://", 1)
+        self.mix = parse_mix(args.mix)
+        self.user_ids: List[int] = []
+        self.groups: Dict[int, List[int]] = {}
+        self.sockets: Dict[int, websockets.WebSocketClientProtocol] = {}
+        self.readers: List[asyncio.Task] = []
+
+        # Send times of in-flight events, keyed by what the delivered frame carries
+        self.pending: Dict[Tuple, float] = {}
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.sent: Dict[str, int] = defaultdict(int)
+        self.expected: Dict[str, int] = defaultdict(int)
+        self.received: Dict[str, int] = defaultdict(int)
+        self.errors: Dict[str, int] = defaultdict(int)
+        # Recently delivered messages that reactions can target
+        self.recent_messages: Deque[Tuple[int, List[int]]] = deque(maxlen=1000)
+        self.recording = False
+        self.next_id = 0
+
+    # Setup
+
+    async def create_users(self, client: httpx.AsyncClient):
+        semaphore = asyncio.Semaphore(self.args.setup_concurrency)
+
+        async def ensure_user(index: int) -> int:
+            username = f"{self.args.user_prefix}{index}"
+            async with semaphore:
+                response = await client.post("/api/users/", json={"username": username})
+                if response.status_code == 200:
+                    return response.json()["id"]
+                response = await client.get(f"/api/users/username/{username}")
+                response.raise_for_status()
+                return response.json()["id"]
+
+        self.user_ids = await asyncio.gather(*(ensure_user(i) for i in range(self.args.users)))
+
+    async def create_groups(self, client: httpx.AsyncClient):
+        semaphore = asyncio.Semaphore(self.args.setup_concurrency)
+        size = min(self.args.group_size, len(self.user_ids))
+
+        async def create_group(index: int):
+            members = random.sample(self.user_ids, size)
+            async with semaphore:
+                response = await client.post(
+                    "/api/groups/",
+                    params={"created_by": members[0]},
+                    json={"name": f"{self.args.user_prefix}group-{index}"}
+                )
+                response.raise_for_status()
+                group_id = response.json()["id"]
+                for user_id in members[1:]:
+                    await client.post(f"/api/groups/{group_id}/members", params={"user_id": user_id})
+            self.groups[group_id] = members
+
+        await asyncio.gather(*(create_group(i) for i in range(self.args.groups)))
+
+    async def connect_all(self):
+        semaphore = asyncio.Semaphore(self.args.connect_concurrency)
+
+        async def connect(user_id: int):
+            async with semaphore:
+                try:
+                    ws = await websockets.connect(f"{self.ws_url}/ws/{user_id}", max_queue=None, open_timeout=30)
+                except Exception as e:
+                    self.errors["connect"] += 1
+                    if self.errors["connect"] <= 3:
+                        print(f"Connect failed for user {user_id}: {e}")
+                    return
+            self.sockets[user_id] = ws
+            self.readers.append(asyncio.create_task(self.read_loop(user_id, ws)))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(connect(user_id) for user_id in self.user_ids))
+        return time.perf_counter() - started
+
+    # Receiving
+
+    async def read_loop(self, user_id: int, ws):
+        try:
+            async for raw in ws:
+                self.on_frame(user_id, json.loads(raw), time.perf_counter())
+        except websockets.ConnectionClosed:
+            if self.recording:
+                self.errors["disconnected"] += 1
+
+    def on_frame(self, user_id: int, frame: dict, now: float):
+        frame_type = frame.get("type")
+        if frame_type == "message":
+            message = frame["message"]
+            content = message.get("content") or ""
+            if not content.startswith(MARKER) or message["sender_id"] == user_id:
+                return
+            kind = "group" if message.get("group_id") else "dm"
+            self.record(kind, self.pending.get((kind, content)), now)
+            if message.get("group_id"):
+                self.recent_messages.append((message["id"], self.groups.get(message["group_id"], [])))
+            else:
+                self.recent_messages.append((message["id"], [message["sender_id"], message["receiver_id"]]))
+        elif frame_type == "reaction_update":
+            if frame.get("user_id") == user_id:
+                return
+            self.record("reaction", self.pending.get(("reaction", frame["message_id"], frame["user_id"], frame["emoji"])), now)
+        elif frame_type == "webrtc-signal":
+            signal = frame.get("signal") or {}
+            self.record("call", self.pending.get(("call", signal.get("bench"))), now)
+        elif frame_type == "typing":
+            if self.recording:
+                self.received["typing"] += 1
+        elif frame_type == "error":
+            self.errors["server"] += 1
+
+    def record(self, kind: str, sent_at: Optional[float], now: float):
+        if sent_at is None or not self.recording:
+            return
+        self.received[kind] += 1
+        self.latencies[kind].append(now - sent_at)
+
+    # Sending
+
+    def connected(self, user_ids: List[int]) -> List[int]:
+        return [user_id for user_id in user_ids if user_id in self.sockets]
+
+    async def send_event(self, kind: str):
+        now = time.perf_counter()
+        self.next_id += 1
+        token = f"{MARKER}{self.next_id}"
+
+        if kind in ("dm", "call", "typing") or not self.groups:
+            sender, receiver = random.sample(list(self.sockets), 2)
+        if kind == "dm" or (kind == "group" and not self.groups):
+            kind = "dm"
+            frame = {"type": "message", "receiver_id": receiver, "content": token}
+            self.pending[("dm", token)] = now
+            self.expected["dm"] += 1
+        elif kind == "group":
+            group_id, members = random.choice(list(self.groups.items()))
+            senders = self.connected(members)
+            if not senders:
+                return
+            sender = random.choice(senders)
+            frame = {"type": "message", "group_id": group_id, "content": token}
+            self.pending[("group", token)] = now
+            self.expected["group"] += len(senders) - 1
+        elif kind == "typing":
+            if self.groups and random.random() < 0.5:
+                group_id, members = random.choice(list(self.groups.items()))
+                senders = self.connected(members)
+                if not senders:
+                    return
+                sender = random.choice(senders)
+                frame = {"type": "typing", "group_id": group_id, "is_typing": random.random() < 0.8}
+            else:
+                frame = {"type": "typing", "receiver_id": receiver, "is_typing": random.random() < 0.8}
+        elif kind == "reaction":
+            if not self.recent_messages:
+                return
+            message_id, participants = random.choice(self.recent_messages)
+            senders = self.connected(participants)
+            if not senders:
+                return
+            sender = random.choice(senders)
+            emoji = random.choice(self.args.emojis)
+            frame = {"type": "reaction", "target_message_id": message_id, "emoji": emoji}
+            self.pending[("reaction", message_id, sender, emoji)] = now
+            self.expected["reaction"] += len(senders) - 1
+        else:
+            frame = {
+                "type": "webrtc-signal",
+                "call_id": f"{MARKER}call",
+                "receiver_id": receiver,
+                "signal": {"type": "candidate", "bench": self.next_id}
+            }
+            self.pending[("call", self.next_id)] = now
+            self.expected["call"] += 1
+
+        try:
+            await self.sockets[sender].send(json.dumps(frame))
+            if self.recording:
+                self.sent[kind] += 1
+        except (websockets.ConnectionClosed, KeyError):
+            self.errors["send"] += 1
+
+    async def drive(self, duration: float, record: bool):
+        """Send events at the target rate for `duration` seconds"""
+        self.recording = record
+        kinds, weights = zip(*self.mix.items())
+        tick = 0.01
+        started = time.perf_counter()
+        budget = 0.0
+        while True:
+            elapsed = time.perf_counter() - started
+            if elapsed >= duration:
+                break
+            budget += self.args.rate * tick
+            batch = int(budget)
+            budget -= batch
+            for kind in random.choices(kinds, weights, k=batch):
+                await self.send_event(kind)
+            # Sleep until the next tick, accounting for time spent sending
+            await asyncio.sleep(max(0, tick - (time.perf_counter() - started - elapsed)))
+        return time.perf_counter() - started
+
+    # Run
+
+    async def run(self) -> dict:
+        raise_open_file_limit()
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=30) as client:
+            print(f"Preparing {self.args.users} users and {self.args.groups} groups...")
+            await self.create_users(client)
+            await self.create_groups(client)
+
+        print(f"Connecting {len(self.user_ids)} sockets...")
+        connect_seconds = await self.connect_all()
+        if len(self.sockets) < 2:
+            raise SystemExit("Fewer than two sockets connected, nothing to measure")
+        print(f"Connected {len(self.sockets)} sockets in {connect_seconds:.1f}s")
+
+        if self.args.warmup > 0:
+            print(f"Warming up for {self.args.warmup}s...")
+            await self.drive(self.args.warmup, record=False)
+            await asyncio.sleep(self.args.drain)
+            self.pending.clear()
+            self.expected.clear()
+
+        print(f"Running for {self.args.duration}s at {self.args.rate} events/s...")
+        send_seconds = await self.drive(self.args.duration, record=True)
+        # Let in-flight deliveries arrive before stopping the clock
+        await asyncio.sleep(self.args.drain)
+        self.recording = False
+
+        for ws in self.sockets.values():
+            await ws.close()
+        for reader in self.readers:
+            reader.cancel()
+
+        return self.report(connect_seconds, send_seconds)
+
+    def report(self, connect_seconds: float, send_seconds: float) -> dict:
+        results = {}
+        for kind in EVENT_KINDS:
+            if not self.sent[kind] and not self.received[kind]:
+                continue
+            entry = {
+                "sent": self.sent[kind],
+                "received": self.received[kind],
+                "sent_per_second": round(self.sent[kind] / send_seconds, 1),
+                "received_per_second": round(self.received[kind] / send_seconds, 1),
+            }
+            if kind in LATENCY_KINDS:
+                entry["expected"] = self.expected[kind]
+                entry["delivery_ratio"] = round(self.received[kind] / self.expected[kind], 4) if self.expected[kind] else None
+                entry["latency"] = summarize(self.latencies[kind])
+            results[kind] = entry
+
+        all_samples = [sample for kind in LATENCY_KINDS for sample in self.latencies[kind]]
+        return {
+            "benchmark": "ws_load",
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_revision": git_revision(),
+            "config": {
+                "url": self.base_url,
+                "users": self.args.users,
+                "groups": self.args.groups,
+                "group_size": self.args.group_size,
+                "rate": self.args.rate,
+                "duration": self.args.duration,
+                "mix": self.mix,
+            },
+            "connected": len(self.sockets),
+            "connect_seconds": round(connect_seconds, 3),
+            "sent_per_second": round(sum(self.sent.values()) / send_seconds, 1),
+            "delivered_per_second": round(sum(self.received.values()) / send_seconds, 1),
+            "latency": summarize(all_samples),
+            "events": results,
+            "errors": dict(self.errors),
+        }
+
+def print_report(report: dict):
+    print()
+    print(f"Connected sockets:  {report['connected']} ({report['connect_seconds']}s)")
+    print(f"Sent:               {report['sent_per_second']} events/s")
+    print(f"Delivered:          {report['delivered_per_second']} frames/s")
+    overall = report["latency"]
+    if overall.get("count"):
+        print(f"Latency (all):      p50 {overall['p50_ms']}ms  p99 {overall['p99_ms']}ms  max {overall['max_ms']}ms")
+    for kind, entry in report["events"].items():
+        line = f"  {kind:<9} sent {entry['sent']:>8}  received {entry['received']:>9}"
+        latency = entry.get("latency", {})
+        if latency.get("count"):
+            line += f"  p50 {latency['p50_ms']:>8}ms  p99 {latency['p99_ms']:>8}ms  delivered {entry['delivery_ratio']:.2%}"
+        print(line)
+    if report["errors"]:
+        print(f"Errors:             {report['errors']}")
+
+def compare(report: dict, baseline: dict, tolerance: float) -> List[str]:
+    """List metrics that regressed by more than `tolerance` against a baseline"""
+    regressions = []
+
+    def check(label: str, current: Optional[float], previous: Optional[float], higher_is_worse: bool):
+        if not current or not previous:
+            return
+        change = (current - previous) / previous
+        if (change > tolerance) if higher_is_worse else (-change > tolerance):
+            regressions.append(f"{label}: {previous} -> {current} ({change:+.1%})")
+
+    check("latency p50_ms", report["latency"].get("p50_ms"), baseline["latency"].get("p50_ms"), True)
+    check("latency p99_ms", report["latency"].get("p99_ms"), baseline["latency"].get("p99_ms"), True)
+    check("delivered_per_second", report["delivered_per_second"], baseline.get("delivered_per_second"), False)
+    for kind, entry in report["events"].items():
+        previous = baseline.get("events", {}).get(kind, {})
+        check(f"{kind} p99_ms", entry.get("latency", {}).get("p99_ms"), previous.get("latency", {}).get("p99_ms"), True)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="WebChat WebSocket load generator")
+    parser.add_argument("--url", default=os.getenv("WEBCHAT_URL", "http://localhost:8000"), help="Server base URL")
+    parser.add_argument("--users", type=int, default=1000, help="Simulated users (one socket each)")
+    parser.add_argument("--groups", type=int, default=50, help="Groups to create")
+    parser.add_argument("--group-size", type=int, default=20, help="Members per group")
+    parser.add_argument("--rate", type=float, default=500, help="Events sent per second across all users")
+    parser.add_argument("--duration", type=float, default=30, help="Measured run length in seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="Unmeasured warmup in seconds")
+    parser.add_argument("--drain", type=float, default=2, help="Seconds to wait for in-flight deliveries")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Event weights (default {DEFAULT_MIX})")
+    parser.add_argument("--emojis", default="👍❤😂", help="Emojis to react with")
+    parser.add_argument("--user-prefix", default="bench_", help="Username prefix for simulated users")
+    parser.add_argument("--connect-concurrency", type=int, default=200, help="Sockets opened in parallel")
+    parser.add_argument("--setup-concurrency", type=int, default=50, help="Parallel setup HTTP requests")
+    parser.add_argument("--seed", type=int, help="Random seed for a repeatable event sequence")
+    parser.add_argument("--output", help="JSON results path (default benchmarks/results/ws_load-<time>.json)")
+    parser.add_argument("--baseline", help="Earlier results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed regression against the baseline (0.2 = 20%%)")
+    args = parser.parse_args()
+    args.emojis = list(args.emojis)
+
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    report = asyncio.run(LoadTest(args).run())
+    print_report(report)
+
+    output = args.output or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "results",
+        f"ws_load-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults saved to {output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print("\nRegressions against baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("\nNo regressions against baseline")
+
+if __name__ == "__main__":
+    main()
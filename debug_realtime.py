@@ -151,7 +151,7 @@ def test_api_messaging():
                 # Get conversation to verify
                 conv_response = requests.get(f"{base_url}/api/messages/conversation/{user1['id']}/{user2['id']}")
                 if conv_response.status_code == 200:
-                    messages = conv_response.json()
+                    messages = conv_response.json()["items"]
                     if messages and any(msg['content'] == message_data['content'] for msg in messages):
                         print("✅ API messaging is working!")
                         return True
@@ -4,17 +4,30 @@ from fastapi import FastAPI, Request, Depends, HTTPException, WebSocket, WebSock
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, Response
 from sqlalchemy.orm import Session
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from dotenv import load_dotenv
 import json
+import time
+import logging
 from typing import List, Dict
 
-from database import get_db, create_tables
-from api import users, messages, groups, media, websocket_manager, reactions, preferences, admin
+from database import get_db, create_tables, engine, async_engine, AsyncSessionLocal
+from logging_config import setup_logging, log_payload
+from api import users, messages, conversations, groups, media, websocket_manager, backplane, reactions, receipts, unread, thumbnails, preferences, admin, typing_state, metrics
+from api.message_writer import MessageWriter
+from api.membership import membership_index
+from api.thumbnails import thumbnail_service
+from api.storage import storage
 import models
+import schemas
 
 load_dotenv()
+setup_logging()
+
+logger = logging.getLogger(__name__)
 
 # Create FastAPI app
 app = FastAPI(title="WebChat API", version="1.0.0")
@@ -28,6 +41,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Label DB query metrics with the router serving the request
+app.add_middleware(metrics.RouterLabelMiddleware)
+metrics.instrument_engine(engine)
+metrics.instrument_engine(async_engine.sync_engine)
+
 # Static files and templates
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
@@ -39,19 +57,40 @@ os.makedirs(upload_dir, exist_ok=True)
 # Include API routers
 app.include_router(users.router, prefix="/api/users", tags=["users"])
 app.include_router(messages.router, prefix="/api/messages", tags=["messages"])
+app.include_router(conversations.router, prefix="/api/conversations", tags=["conversations"])
 app.include_router(groups.router, prefix="/api/groups", tags=["groups"])
 app.include_router(media.router, prefix="/api/media", tags=["media"])
 app.include_router(reactions.router, prefix="/api/reactions", tags=["reactions"])
+app.include_router(receipts.router, prefix="/api/receipts", tags=["receipts"])
 app.include_router(preferences.router)
 app.include_router(admin.router)
 
 # WebSocket manager
 ws_manager = websocket_manager.ConnectionManager()
+metrics.WS_ACTIVE_SESSIONS.read = ws_manager.get_session_count
+
+# Persists chat messages received over the WebSocket
+message_writer = MessageWriter(AsyncSessionLocal)
 
 @app.on_event("startup")
 async def startup_event():
     """Create database tables on startup"""
     create_tables()
+    # Route WebSocket frames across workers when a backplane is configured
+    await ws_manager.start_backplane(backplane.create_backplane(os.getenv("WS_BACKPLANE_URL")))
+    await message_writer.start()
+    typing_tracker.start()
+    await storage.start()
+    thumbnail_service.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Flush queued messages and disconnect from the WebSocket backplane"""
+    typing_tracker.stop()
+    await thumbnail_service.stop()
+    await storage.stop()
+    await message_writer.stop()
+    await ws_manager.stop_backplane()
 
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request, user_id: int = None, username: str = None, db: Session = Depends(get_db)):
@@ -163,145 +202,171 @@ async def admin_panel(request: Request):
         "request": request
     })
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    """Expose service metrics in the Prometheus text format"""
+    return Response(content=metrics.render_latest(), media_type=metrics.CONTENT_TYPE)
+
 @app.websocket("/ws/{user_id}")
-async def websocket_endpoint(websocket: WebSocket, user_id: int, db: Session = Depends(get_db)):
+async def websocket_endpoint(websocket: WebSocket, user_id: int):
     """WebSocket endpoint for real-time communication"""
-    print(f"WebSocket connection attempt for user {user_id}")
-
-    await ws_manager.connect(websocket, user_id)
-    print(f"WebSocket connected for user {user_id}")
+    session_id = await ws_manager.connect(websocket, user_id)
+    if session_id is None:
+        return
+    logger.info("WebSocket session connected", extra={"user_id": user_id, "session_id": session_id})
 
     # Update user online status
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if user:
-        user.is_online = True
-        db.commit()
-        print(f"User {user.username} is now online")
+    await set_online_status(user_id, True)
 
     try:
         while True:
             data = await websocket.receive_text()
-            print(f"Received WebSocket data from user {user_id}: {data}")
+            log_payload(logger, "Received WebSocket frame", data, user_id=user_id)
 
             try:
                 message_data = json.loads(data)
-
-                # Handle different message types
-                if message_data.get("type") == "message":
-                    print(f"Handling chat message from user {user_id}")
-                    await handle_chat_message(message_data, user_id, db)
-                elif message_data.get("type") == "typing":
-                    await handle_typing_indicator(message_data, user_id, db)
-                elif message_data.get("type") == "call":
-                    await handle_call_message(message_data, user_id, db)
-                elif message_data.get("type") == "webrtc-signal":
-                    await handle_webrtc_signal(message_data, user_id, db)
-                elif message_data.get("type") == "reaction":
-                    await handle_reaction(message_data, user_id, db)
-                else:
-                    print(f"Unknown message type: {message_data.get('type')}")
-
             except json.JSONDecodeError as e:
-                print(f"JSON decode error: {e}")
-                await websocket.send_text(json.dumps({
+                logger.warning("Invalid JSON from user %s: %s", user_id, e)
+                metrics.WS_FRAMES.inc("invalid")
+                # Go through the manager so the reply is ordered with the
+                # connection's other outbound frames
+                await ws_manager.send_to_session(ws_manager.encode({
                     "type": "error",
                     "message": "Invalid JSON format"
-                }))
+                }), user_id, session_id)
+                continue
+
+            event_type = message_data.get("type")
+            # Client-supplied, so only known types get their own label
+            metrics.WS_FRAMES.inc(event_type if event_type in EVENT_TYPES else "unknown")
+            await dispatch_event(message_data, user_id)
 
     except WebSocketDisconnect:
-        print(f"WebSocket disconnected for user {user_id}")
-        ws_manager.disconnect(user_id)
-        # Update user offline status
-        if user:
-            user.is_online = False
-            db.commit()
-            print(f"User {user.username} is now offline")
+        logger.info("WebSocket session disconnected", extra={"user_id": user_id, "session_id": session_id})
     except Exception as e:
-        print(f"WebSocket error for user {user_id}: {e}")
-        ws_manager.disconnect(user_id)
-        if user:
-            user.is_online = False
-            db.commit()
+        logger.exception("WebSocket error for user %s", user_id)
+    finally:
+        ws_manager.disconnect(user_id, session_id)
+        # Update user offline status once their last session is gone
+        if not ws_manager.is_user_connected(user_id):
+            typing_tracker.drop_user(user_id)
+            await set_online_status(user_id, False)
+
+EVENT_TYPES = {"message", "typing", "call", "webrtc-signal", "reaction", "receipt"}
+
+async def dispatch_event(message_data: dict, user_id: int):
+    """Route one WebSocket frame to its handler.
+
+    Each event gets its own short-lived session, so a pooled connection is
+    only held while the event is being processed rather than for as long
+    as the socket stays open.
+    """
+    async with AsyncSessionLocal() as db:
+        # Handle different message types
+        if message_data.get("type") == "message":
+            await handle_chat_message(message_data, user_id, db)
+        elif message_data.get("type") == "typing":
+            await handle_typing_indicator(message_data, user_id, db)
+        elif message_data.get("type") == "call":
+            await handle_call_message(message_data, user_id, db)
+        elif message_data.get("type") == "webrtc-signal":
+            await handle_webrtc_signal(message_data, user_id, db)
+        elif message_data.get("type") == "reaction":
+            await handle_reaction(message_data, user_id, db)
+        elif message_data.get("type") == "receipt":
+            await handle_receipt(message_data, user_id, db)
+        else:
+            logger.warning("Unknown message type %r from user %s", message_data.get("type"), user_id)
 
-async def handle_chat_message(message_data: dict, sender_id: int, db: Session):
+async def set_online_status(user_id: int, is_online: bool):
+    """Update a user's online flag in its own short transaction"""
+    try:
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(models.User).where(models.User.id == user_id).values(is_online=is_online)
+            )
+            await db.commit()
+        logger.debug("User %s is now %s", user_id, "online" if is_online else "offline")
+    except Exception as e:
+        logger.exception("Error updating online status for user %s", user_id)
+
+async def get_group_member_ids(db: AsyncSession, group_id: int) -> List[int]:
+    """Get the user IDs of all members of a group (served from the membership index)"""
+    return list(await membership_index.get_members(db, group_id))
+
+async def handle_chat_message(message_data: dict, sender_id: int, db: AsyncSession):
     """Handle incoming chat messages"""
     try:
-        print(f"Processing chat message from user {sender_id}: {message_data}")
-
-        # Create message in database
-        message = models.Message(
-            sender_id=sender_id,
-            receiver_id=message_data.get("receiver_id"),
-            group_id=message_data.get("group_id"),
-            content=message_data.get("content"),
-            message_type=models.MessageType(message_data.get("message_type", "text")),
-            media_id=message_data.get("media_id")
-        )
-        db.add(message)
-        db.commit()
-        db.refresh(message)
+        log_payload(logger, "Processing chat message", message_data, user_id=sender_id)
+
+        # Persist the message (immediately or batched, see MESSAGE_WRITE_MODE)
+        message = await message_writer.submit({
+            "sender_id": sender_id,
+            "receiver_id": message_data.get("receiver_id"),
+            "group_id": message_data.get("group_id"),
+            "content": message_data.get("content"),
+            "message_type": models.MessageType(message_data.get("message_type", "text")),
+            "media_id": message_data.get("media_id")
+        }, db)
 
-        print(f"Message saved to database with ID: {message.id}")
+        logger.debug("Message %s saved", message["id"])
+
+        # Sending a message ends the sender's typing indicator
+        typing_key = typing_state.conversation_key(sender_id, message["group_id"], message["receiver_id"])
+        if typing_key is not None:
+            typing_tracker.update(typing_key, sender_id, False)
 
         # Prepare message data for broadcasting
         message_payload = {
             "type": "message",
             "message": {
-                "id": message.id,
-                "sender_id": message.sender_id,
-                "receiver_id": message.receiver_id,
-                "group_id": message.group_id,
-                "content": message.content,
-                "message_type": message.message_type.value,
-                "media_id": message.media_id,
-                "created_at": message.created_at.isoformat(),
-                "is_read": message.is_read,
-                "is_delivered": message.is_delivered
+                "id": message["id"],
+                "sender_id": message["sender_id"],
+                "receiver_id": message["receiver_id"],
+                "group_id": message["group_id"],
+                "content": message["content"],
+                "message_type": message["message_type"].value,
+                "media_id": message["media_id"],
+                "created_at": message["created_at"].isoformat(),
+                "is_read": message["is_read"],
+                "is_delivered": message["is_delivered"]
             }
         }
 
-        print(f"Broadcasting message payload: {message_payload}")
+        encoded_payload = ws_manager.encode(message_payload)
 
         # Broadcast message to relevant users
-        if message.group_id:
-            print(f"Broadcasting to group {message.group_id}")
+        fanout_start = time.perf_counter()
+        if message["group_id"]:
             # Group message - send to all group members
-            group_members = db.query(models.GroupMember).filter(
-                models.GroupMember.group_id == message.group_id
-            ).all()
-
-            print(f"Found {len(group_members)} group members")
-
-            # Send to all members
-            for member in group_members:
-                print(f"Sending to group member: {member.user_id}")
-                await ws_manager.send_personal_message(
-                    json.dumps(message_payload),
-                    member.user_id
-                )
+            member_ids = await get_group_member_ids(db, message["group_id"])
+
+            logger.debug("Broadcasting message %s to %d members of group %s", message["id"], len(member_ids), message["group_id"])
+
+            # Send to all members concurrently
+            await ws_manager.send_to_group(encoded_payload, member_ids)
+            metrics.CHAT_FANOUT_RECIPIENTS.observe(len(member_ids))
         else:
-            print(f"Broadcasting direct message from {sender_id} to {message.receiver_id}")
             # Direct message - send to receiver
-            if message.receiver_id:
-                print(f"Sending to receiver: {message.receiver_id}")
+            if message["receiver_id"]:
                 success = await ws_manager.send_personal_message(
-                    json.dumps(message_payload),
-                    message.receiver_id
+                    encoded_payload,
+                    message["receiver_id"]
                 )
-                print(f"Message sent to receiver: {success}")
+                logger.debug("Message %s delivered to receiver %s: %s", message["id"], message["receiver_id"], success)
 
                 # Send confirmation to sender
-                print(f"Sending confirmation to sender: {sender_id}")
                 success = await ws_manager.send_personal_message(
-                    json.dumps(message_payload),
+                    encoded_payload,
                     sender_id
                 )
-                print(f"Confirmation sent to sender: {success}")
+                logger.debug("Confirmation for message %s sent to sender %s: %s", message["id"], sender_id, success)
+                metrics.CHAT_FANOUT_RECIPIENTS.observe(2)
+        metrics.CHAT_FANOUT_SECONDS.observe(time.perf_counter() - fanout_start)
 
     except Exception as e:
-        print(f"Error handling chat message: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error handling chat message from user %s", sender_id)
+        await db.rollback()
 
         # Send error message back to sender
         error_payload = {
@@ -310,43 +375,49 @@ async def handle_chat_message(message_data: dict, sender_id: int, db: Session):
             "error": str(e)
         }
         await ws_manager.send_personal_message(
-            json.dumps(error_payload),
+            ws_manager.encode(error_payload),
             sender_id
         )
 
-async def handle_typing_indicator(message_data: dict, user_id: int, db: Session):
-    """Handle typing indicators"""
-    try:
-        # Broadcast typing indicator
-        if message_data.get("group_id"):
-            # Group typing
-            group_members = db.query(models.GroupMember).filter(
-                models.GroupMember.group_id == message_data["group_id"]
-            ).all()
-            for member in group_members:
-                if member.user_id != user_id:
-                    await ws_manager.send_personal_message(json.dumps({
-                        "type": "typing",
-                        "user_id": user_id,
-                        "group_id": message_data["group_id"],
-                        "is_typing": message_data.get("is_typing", True)
-                    }), member.user_id)
-        elif message_data.get("receiver_id"):
-            # Direct message typing
-            await ws_manager.send_personal_message(json.dumps({
-                "type": "typing",
-                "user_id": user_id,
-                "receiver_id": message_data["receiver_id"],
-                "is_typing": message_data.get("is_typing", True)
-            }), message_data["receiver_id"])
-            
-    except Exception as e:
-        print(f"Error handling typing indicator: {e}")
-
-async def handle_call_message(message_data: dict, caller_id: int, db: Session):
+async def handle_typing_indicator(message_data: dict, user_id: int, db: AsyncSession):
+    """Handle typing indicators (broadcast on the typing tracker's tick)"""
+    key = typing_state.conversation_key(
+        user_id,
+        group_id=message_data.get("group_id"),
+        receiver_id=message_data.get("receiver_id")
+    )
+    if key is not None:
+        typing_tracker.update(key, user_id, bool(message_data.get("is_typing", True)))
+
+async def emit_typing_state(key: tuple, typists: frozenset):
+    """Send the current typists of a conversation to its participants"""
+    if key[0] == "group":
+        group_id = key[1]
+        async with AsyncSessionLocal() as db:
+            member_ids = await get_group_member_ids(db, group_id)
+        # One payload per group; clients leave themselves out of the list
+        await ws_manager.send_to_group(ws_manager.encode({
+            "type": "typing",
+            "group_id": group_id,
+            "user_ids": sorted(typists),
+            "count": len(typists),
+            "is_typing": bool(typists)
+        }), member_ids, kind="typing", coalesce_key=f"typing:group:{group_id}")
+    else:
+        _, sender_id, receiver_id = key
+        await ws_manager.send_personal_message(ws_manager.encode({
+            "type": "typing",
+            "user_id": sender_id,
+            "receiver_id": receiver_id,
+            "is_typing": bool(typists)
+        }), receiver_id, kind="typing", coalesce_key=f"typing:direct:{sender_id}")
+
+typing_tracker = typing_state.TypingTracker(emit_typing_state)
+
+async def handle_call_message(message_data: dict, caller_id: int, db: AsyncSession):
     """Handle call-related messages"""
     try:
-        print(f"Handling call message: {message_data}")
+        log_payload(logger, "Handling call message", message_data, user_id=caller_id)
 
         call_status = message_data.get("call_status")
         call_type = message_data.get("call_type", "audio")
@@ -362,8 +433,8 @@ async def handle_call_message(message_data: dict, caller_id: int, db: Session):
                 call_status=models.CallStatus(call_status)
             )
             db.add(call_log)
-            db.commit()
-            db.refresh(call_log)
+            await db.commit()
+            await db.refresh(call_log)
 
             # Broadcast call request with all necessary data
             call_payload = {
@@ -382,10 +453,10 @@ async def handle_call_message(message_data: dict, caller_id: int, db: Session):
                 }
             }
 
-            print(f"Sending call request payload: {call_payload}")
+            logger.debug("Sending call request %s to user %s", call_id, receiver_id)
 
             if receiver_id:
-                await ws_manager.send_personal_message(json.dumps(call_payload), receiver_id)
+                await ws_manager.send_personal_message(ws_manager.encode(call_payload), receiver_id)
 
         else:
             # Handle call responses (accept, decline, end, etc.)
@@ -398,34 +469,33 @@ async def handle_call_message(message_data: dict, caller_id: int, db: Session):
                 "receiver_id": receiver_id
             }
 
-            print(f"Sending call response payload: {call_payload}")
+            logger.debug("Sending call %s update %s", call_id, call_status)
 
             # Send to the other party
             if call_status in ["accept", "decline"]:
                 # This is a response, so send back to the original caller
                 if receiver_id:
-                    await ws_manager.send_personal_message(json.dumps(call_payload), receiver_id)
+                    await ws_manager.send_personal_message(ws_manager.encode(call_payload), receiver_id)
             elif call_status == "end":
                 # Send end message to receiver
                 if receiver_id:
-                    await ws_manager.send_personal_message(json.dumps(call_payload), receiver_id)
+                    await ws_manager.send_personal_message(ws_manager.encode(call_payload), receiver_id)
 
     except Exception as e:
-        print(f"Error handling call message: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error handling call message from user %s", caller_id)
+        await db.rollback()
 
-async def handle_webrtc_signal(message_data: dict, sender_id: int, db: Session):
+async def handle_webrtc_signal(message_data: dict, sender_id: int, db: AsyncSession):
     """Handle WebRTC signaling messages (ICE candidates, SDP offers/answers)"""
     try:
-        print(f"Handling WebRTC signal from user {sender_id}: {message_data}")
+        log_payload(logger, "Handling WebRTC signal", message_data, user_id=sender_id)
 
         call_id = message_data.get("call_id")
         signal = message_data.get("signal")
         receiver_id = message_data.get("receiver_id")
 
         if not call_id or not signal:
-            print("Missing call_id or signal in WebRTC message")
+            logger.warning("Missing call_id or signal in WebRTC message from user %s", sender_id)
             return
 
         # Forward the signaling message to the other peer
@@ -436,50 +506,50 @@ async def handle_webrtc_signal(message_data: dict, sender_id: int, db: Session):
             "sender_id": sender_id
         }
 
-        print(f"Forwarding WebRTC signal to receiver {receiver_id}: {signal_payload}")
+        logger.debug("Forwarding WebRTC signal from user %s to user %s", sender_id, receiver_id)
 
         if receiver_id:
             await ws_manager.send_personal_message(
-                json.dumps(signal_payload),
+                ws_manager.encode(signal_payload),
                 receiver_id
             )
         else:
-            print("No receiver_id specified for WebRTC signal")
+            logger.warning("No receiver_id specified for WebRTC signal from user %s", sender_id)
 
     except Exception as e:
-        print(f"Error handling WebRTC signal: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error handling WebRTC signal from user %s", sender_id)
 
-async def handle_reaction(message_data: dict, user_id: int, db: Session):
+async def handle_reaction(message_data: dict, user_id: int, db: AsyncSession):
     """Handle reaction messages"""
     try:
-        print(f"Handling reaction from user {user_id}: {message_data}")
+        log_payload(logger, "Handling reaction", message_data, user_id=user_id)
 
         emoji = message_data.get("emoji")
         target_message_id = message_data.get("target_message_id")
 
         if not emoji or not target_message_id:
-            print("Missing emoji or target_message_id in reaction")
+            logger.warning("Missing emoji or target_message_id in reaction from user %s", user_id)
             return
 
         # Check if message exists
-        target_message = db.query(models.Message).filter(models.Message.id == target_message_id).first()
+        target_message = await db.get(models.Message, target_message_id)
         if not target_message:
-            print(f"Target message {target_message_id} not found")
+            logger.warning("Reaction target message %s not found", target_message_id)
             return
 
         # Check if user already reacted with this emoji
-        existing_reaction = db.query(models.Reaction).filter(
-            models.Reaction.message_id == target_message_id,
-            models.Reaction.user_id == user_id,
-            models.Reaction.emoji == emoji
-        ).first()
+        existing_reaction = (await db.execute(
+            select(models.Reaction).where(
+                models.Reaction.message_id == target_message_id,
+                models.Reaction.user_id == user_id,
+                models.Reaction.emoji == emoji
+            )
+        )).scalars().first()
 
         if existing_reaction:
             # Remove existing reaction (toggle off)
-            db.delete(existing_reaction)
-            db.commit()
+            await db.delete(existing_reaction)
+            await db.commit()
             action = "removed"
         else:
             # Create new reaction
@@ -489,14 +559,14 @@ async def handle_reaction(message_data: dict, user_id: int, db: Session):
                 emoji=emoji
             )
             db.add(new_reaction)
-            db.commit()
-            db.refresh(new_reaction)
+            await db.commit()
+            await db.refresh(new_reaction)
             action = "added"
 
         # Get all reactions for this message
-        reactions = db.query(models.Reaction).filter(
-            models.Reaction.message_id == target_message_id
-        ).all()
+        reactions = (await db.execute(
+            select(models.Reaction).where(models.Reaction.message_id == target_message_id)
+        )).scalars().all()
 
         # Group reactions by emoji
         reaction_summary = {}
@@ -518,36 +588,87 @@ async def handle_reaction(message_data: dict, user_id: int, db: Session):
             "emoji": emoji
         }
 
-        print(f"Broadcasting reaction update: {reaction_payload}")
+        logger.debug("Broadcasting reaction update for message %s", target_message_id)
+
+        # A newer summary for the same message supersedes a queued one
+        reaction_key = f"reaction:{target_message_id}"
+        encoded_payload = ws_manager.encode(reaction_payload)
 
         # Send to message participants
         if target_message.group_id:
             # Group message - send to all group members
-            group_members = db.query(models.GroupMember).filter(
-                models.GroupMember.group_id == target_message.group_id
-            ).all()
-
-            for member in group_members:
-                await ws_manager.send_personal_message(
-                    json.dumps(reaction_payload),
-                    member.user_id
-                )
+            member_ids = await get_group_member_ids(db, target_message.group_id)
+
+            await ws_manager.send_to_group(
+                encoded_payload,
+                member_ids,
+                kind="reaction_update",
+                coalesce_key=reaction_key
+            )
         else:
             # Direct message - send to both sender and receiver
-            await ws_manager.send_personal_message(
-                json.dumps(reaction_payload),
-                target_message.sender_id
-            )
+            participants = [target_message.sender_id]
             if target_message.receiver_id:
-                await ws_manager.send_personal_message(
-                    json.dumps(reaction_payload),
-                    target_message.receiver_id
-                )
+                participants.append(target_message.receiver_id)
+            await ws_manager.send_to_group(
+                encoded_payload,
+                participants,
+                kind="reaction_update",
+                coalesce_key=reaction_key
+            )
 
     except Exception as e:
-        print(f"Error handling reaction: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error handling reaction from user %s", user_id)
+        await db.rollback()
+
+async def handle_receipt(message_data: dict, user_id: int, db: AsyncSession):
+    """Handle read/delivered watermarks ("everything up to message N")"""
+    try:
+        receipt = schemas.ReceiptCreate(**message_data)
+        await receipts.submit_receipt(db, user_id, receipt)
+    except ValueError as e:
+        logger.warning("Invalid receipt from user %s: %s", user_id, e)
+    except Exception as e:
+        logger.exception("Error handling receipt from user %s", user_id)
+        await db.rollback()
+
+async def publish_receipt(event: dict, recipients: List[int]):
+    """Send a receipt event to the senders it covers"""
+    if event["group_id"] is not None:
+        conversation = f"group:{event['group_id']}"
+    else:
+        conversation = f"direct:{event['peer_id']}"
+    # A newer watermark from the same reader supersedes a queued one
+    await ws_manager.send_to_many(
+        ws_manager.encode(event),
+        recipients,
+        kind="receipt",
+        coalesce_key=f"receipt:{event['kind']}:{event['user_id']}:{conversation}"
+    )
+
+receipts.publish = publish_receipt
+
+async def publish_unread(event: dict, user_ids: List[int]):
+    """Send a conversation's new unread count to the users it belongs to"""
+    if event["group_id"] is not None:
+        conversation = f"group:{event['group_id']}"
+    else:
+        conversation = f"direct:{event['peer_id']}"
+    # Counts are absolute, so only the newest queued one matters
+    await ws_manager.send_to_many(
+        ws_manager.encode(event),
+        user_ids,
+        kind="unread",
+        coalesce_key=f"unread:{conversation}"
+    )
+
+unread.publish = publish_unread
+
+async def publish_media_ready(event: dict, user_ids: List[int]):
+    """Tell the uploader an image's renditions can be fetched"""
+    await ws_manager.send_to_many(ws_manager.encode(event), user_ids, kind="media_ready")
+
+thumbnails.publish = publish_media_ready
 
 if __name__ == "__main__":
     uvicorn.run(
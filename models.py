@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey, Enum, BigInteger
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey, Enum, BigInteger, Index, JSON, text
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
@@ -103,6 +103,13 @@ class GroupMember(Base):
     group = relationship("Group", back_populates="members")
     user = relationship("User", back_populates="group_memberships")
 
+    __table_args__ = (
+        # Member lists and membership checks
+        Index("ix_group_members_group_user", "group_id", "user_id"),
+        # Groups of a user
+        Index("ix_group_members_user_group", "user_id", "group_id"),
+    )
+
 class Message(Base):
     __tablename__ = "messages"
     
@@ -128,6 +135,55 @@ class Message(Base):
     reply_to = relationship("Message", remote_side=[id])
     reactions = relationship("Reaction", back_populates="message", cascade="all, delete-orphan")
 
+    # History pages are keyed on (created_at, id) and never include deleted rows
+    __table_args__ = (
+        Index(
+            "ix_messages_group_created", "group_id", "created_at", "id",
+            postgresql_where=text("deleted_at IS NULL"), sqlite_where=text("deleted_at IS NULL")
+        ),
+        Index(
+            "ix_messages_direct_created", "sender_id", "receiver_id", "created_at", "id",
+            postgresql_where=text("deleted_at IS NULL"), sqlite_where=text("deleted_at IS NULL")
+        ),
+        Index(
+            "ix_messages_receiver_unread", "receiver_id", "is_read",
+            postgresql_where=text("deleted_at IS NULL"), sqlite_where=text("deleted_at IS NULL")
+        ),
+    )
+
+class ConversationState(Base):
+    __tablename__ = "conversation_state"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    peer_id = Column(Integer, ForeignKey("users.id"), nullable=True)    # For direct conversations
+    group_id = Column(Integer, ForeignKey("groups.id"), nullable=True)  # For group conversations
+    last_message_id = Column(Integer, ForeignKey("messages.id"), nullable=True)
+    last_activity = Column(DateTime(timezone=True), server_default=func.now())
+    unread_count = Column(Integer, nullable=False, default=0, server_default="0")
+    # Receipt watermarks: everything up to these message IDs has been read/delivered
+    last_read_message_id = Column(Integer, nullable=True)
+    last_delivered_message_id = Column(Integer, nullable=True)
+
+    # Relationships
+    user = relationship("User", foreign_keys=[user_id])
+    peer = relationship("User", foreign_keys=[peer_id])
+    group = relationship("Group")
+    last_message = relationship("Message")
+
+    # One row per (user, peer) or (user, group); inboxes are read newest first
+    __table_args__ = (
+        Index(
+            "uq_conversation_state_user_peer", "user_id", "peer_id", unique=True,
+            postgresql_where=text("peer_id IS NOT NULL"), sqlite_where=text("peer_id IS NOT NULL")
+        ),
+        Index(
+            "uq_conversation_state_user_group", "user_id", "group_id", unique=True,
+            postgresql_where=text("group_id IS NOT NULL"), sqlite_where=text("group_id IS NOT NULL")
+        ),
+        Index("ix_conversation_state_user_activity", "user_id", "last_activity"),
+    )
+
 class Media(Base):
     __tablename__ = "media"
     
@@ -137,6 +193,9 @@ class Media(Base):
     file_path = Column(String(500), nullable=False)
     file_type = Column(String(50), nullable=False)
     file_size = Column(BigInteger, nullable=False)
+    mime_type = Column(String(255), nullable=True)  # Content-Type sent with the upload
+    content_hash = Column(String(64), nullable=True)  # SHA-256 hex digest, computed while uploading
+    renditions = Column(JSON, nullable=True)  # Sizes of the WebP renditions rendered so far
     uploaded_by = Column(Integer, ForeignKey("users.id"), nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
@@ -144,6 +203,17 @@ class Media(Base):
     uploader = relationship("User")
     message = relationship("Message", back_populates="media")
 
+    # Each row is one reference to a stored blob; rows sharing a hash share the file
+    __table_args__ = (
+        Index("ix_media_content_hash", "content_hash"),
+    )
+
+class Blob(Base):
+    __tablename__ = "blobs"
+
+    content_hash = Column(String(64), primary_key=True)  # SHA-256 hex digest of the stored file
+    ref_count = Column(Integer, nullable=False, default=0, server_default="0")  # Media rows pointing at it
+
 class TypingIndicator(Base):
     __tablename__ = "typing_indicators"
     
@@ -175,6 +245,13 @@ class CallLog(Base):
     caller = relationship("User", foreign_keys=[caller_id])
     receiver = relationship("User", foreign_keys=[receiver_id])
 
+    # Call history of a user and the admin's most-recent-first listing
+    __table_args__ = (
+        Index("ix_call_logs_caller_started", "caller_id", "started_at"),
+        Index("ix_call_logs_receiver_started", "receiver_id", "started_at"),
+        Index("ix_call_logs_started", "started_at"),
+    )
+
 class Reaction(Base):
     __tablename__ = "reactions"
 
@@ -188,6 +265,11 @@ class Reaction(Base):
     message = relationship("Message", back_populates="reactions")
     user = relationship("User")
 
+    # Toggle lookups; the message_id prefix also serves per-message summaries
+    __table_args__ = (
+        Index("ix_reactions_message_user_emoji", "message_id", "user_id", "emoji"),
+    )
+
     @property
     def group(self):
         """Get the group this reaction belongs to (if the message is in a group)"""
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr
-from typing import Optional, List
+from typing import Dict, Optional, List
 from datetime import datetime
 from models import MessageType, CallStatus, ThemeMode, ColorTheme, UserRole
 
@@ -86,6 +86,20 @@ class Message(MessageBase):
     class Config:
         from_attributes = True
 
+class MessagePage(BaseModel):
+    items: List[Message]
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+    has_more: bool = False
+
+# Conversation Schemas
+class Conversation(BaseModel):
+    type: str  # "direct" or "group"
+    peer: Optional[User] = None
+    group: Optional[Group] = None
+    last_message: Optional[Message] = None
+    unread_count: int = 0
+
 # Media Schemas
 class MediaBase(BaseModel):
     filename: str
@@ -100,12 +114,29 @@ class MediaCreate(MediaBase):
 class Media(MediaBase):
     id: int
     file_path: str
+    mime_type: Optional[str] = None
+    content_hash: Optional[str] = None
+    renditions: Optional[List[int]] = None  # Filled in once the renditions are rendered
     uploaded_by: int
     created_at: datetime
     
     class Config:
         from_attributes = True
 
+class PresignedUploadCreate(BaseModel):
+    user_id: int
+    filename: str
+    content_type: str
+    size: int
+    content_hash: str  # SHA-256 hex digest of the file
+
+class PresignedUpload(BaseModel):
+    upload_required: bool  # False when the content is already stored
+    method: Optional[str] = None
+    url: Optional[str] = None
+    headers: Dict[str, str] = {}  # To be sent with the upload as given
+    expires_in: Optional[int] = None
+
 # Group Member Schemas
 class GroupMemberBase(BaseModel):
     group_id: int
@@ -163,6 +194,31 @@ class CallLog(CallLogBase):
     class Config:
         from_attributes = True
 
+# Receipt Schemas
+class ReceiptBase(BaseModel):
+    kind: str = "read"  # "read" or "delivered"
+    up_to: int  # Highest message ID covered by the receipt
+    peer_id: Optional[int] = None   # For direct conversations
+    group_id: Optional[int] = None  # For group conversations
+
+class ReceiptCreate(ReceiptBase):
+    pass
+
+class Receipt(ReceiptBase):
+    user_id: int
+    unread_count: int = 0
+
+# Unread Schemas
+class ConversationUnread(BaseModel):
+    peer_id: Optional[int] = None   # For direct conversations
+    group_id: Optional[int] = None  # For group conversations
+    unread_count: int
+
+class UnreadSummary(BaseModel):
+    user_id: int
+    unread_count: int  # Total across conversations
+    conversations: List[ConversationUnread] = []
+
 # WebSocket Message Schemas
 class WSMessage(BaseModel):
     type: str  # message, typing, call, etc.
@@ -9,6 +9,10 @@ class WebChatApp {
         this.isConnected = false;
         this.typingTimeout = null;
         this.callManager = null;
+        this.olderMessagesCursor = null;
+        this.loadingOlderMessages = false;
+        this.pendingReceipts = new Map();
+        this.receiptTimer = null;
 
         this.init();
     }
@@ -71,6 +75,13 @@ class WebChatApp {
             this.showNewChatModal();
         });
 
+        // Load older history when scrolled to the top
+        document.getElementById('chat-messages').addEventListener('scroll', (e) => {
+            if (e.target.scrollTop === 0) {
+                this.loadOlderMessages();
+            }
+        });
+
         // Message input
         const messageInput = document.getElementById('message-input');
         messageInput.addEventListener('keypress', (e) => {
@@ -388,7 +399,7 @@ class WebChatApp {
 
             if (response.ok) {
                 const media = await response.json();
-                const avatarUrl = `/api/media/${media.id}/view`;
+                const avatarUrl = `/api/media/${media.id}/view?size=160`;
 
                 // Update user avatar
                 await this.updateUserAvatar(avatarUrl);
@@ -694,6 +705,15 @@ class WebChatApp {
             case 'reaction_update':
                 this.handleReactionUpdate(data);
                 break;
+            case 'receipt':
+                this.handleReceipt(data);
+                break;
+            case 'unread':
+                this.handleUnread(data);
+                break;
+            case 'media_ready':
+                this.handleMediaReady(data);
+                break;
             case 'error':
                 this.handleError(data);
                 break;
@@ -726,64 +746,45 @@ class WebChatApp {
 
     async loadConversations() {
         try {
-            // Load direct messages
-            const messagesResponse = await fetch(`/api/messages/?user_id=${this.currentUser.id}`);
-            const messages = await messagesResponse.json();
-            
-            // Load user's groups
-            const groupsResponse = await fetch(`/api/groups/user/${this.currentUser.id}`);
-            const groups = await groupsResponse.json();
-            
-            this.processConversations(messages, groups);
+            // The server builds the whole inbox: peers, groups, last messages and unread counts
+            const response = await fetch(`/api/conversations/${this.currentUser.id}`);
+            const conversations = await response.json();
+
+            this.processConversations(conversations);
             this.renderConversations();
         } catch (error) {
             console.error('Error loading conversations:', error);
         }
     }
 
-    processConversations(messages, groups) {
-        // Process direct messages
-        const directConversations = new Map();
-        
-        messages.forEach(message => {
-            if (message.receiver_id || message.sender_id) {
-                const otherUserId = message.sender_id === this.currentUser.id ? 
-                    message.receiver_id : message.sender_id;
-                
-                if (!directConversations.has(otherUserId)) {
-                    directConversations.set(otherUserId, {
-                        type: 'direct',
-                        userId: otherUserId,
-                        lastMessage: message,
-                        unreadCount: 0
-                    });
-                } else {
-                    const conv = directConversations.get(otherUserId);
-                    if (new Date(message.created_at) > new Date(conv.lastMessage.created_at)) {
-                        conv.lastMessage = message;
-                    }
-                }
-                
-                // Count unread messages
-                if (message.receiver_id === this.currentUser.id && !message.is_read) {
-                    directConversations.get(otherUserId).unreadCount++;
-                }
+    processConversations(conversations) {
+        const previous = this.conversations;
+        this.conversations = new Map();
+
+        conversations.forEach(conversation => {
+            if (conversation.type === 'direct') {
+                this.users.set(conversation.peer.id, conversation.peer);
+                this.conversations.set(`user_${conversation.peer.id}`, {
+                    type: 'direct',
+                    userId: conversation.peer.id,
+                    lastMessage: conversation.last_message,
+                    unreadCount: conversation.unread_count
+                });
+            } else {
+                this.conversations.set(`group_${conversation.group.id}`, {
+                    type: 'group',
+                    group: conversation.group,
+                    lastMessage: conversation.last_message,
+                    unreadCount: conversation.unread_count
+                });
             }
         });
-        
-        // Process group conversations
-        groups.forEach(group => {
-            this.conversations.set(`group_${group.id}`, {
-                type: 'group',
-                group: group,
-                lastMessage: null,
-                unreadCount: 0
-            });
-        });
-        
-        // Merge direct conversations
-        directConversations.forEach((conv, userId) => {
-            this.conversations.set(`user_${userId}`, conv);
+
+        // Keep chats started locally that have no messages yet
+        previous.forEach((conversation, key) => {
+            if (!this.conversations.has(key)) {
+                this.conversations.set(key, conversation);
+            }
         });
     }
 
@@ -805,14 +806,17 @@ class WebChatApp {
         let avatarUrl, name, lastMessageText, isOnline = false;
 
         if (conversation.type === 'direct') {
-            // Get user info
+            // Peers normally arrive with the inbox; fetch only ones we haven't seen
             try {
-                const userResponse = await fetch(`/api/users/${conversation.userId}`);
-                const user = await userResponse.json();
+                let user = this.users.get(conversation.userId);
+                if (!user) {
+                    const userResponse = await fetch(`/api/users/${conversation.userId}`);
+                    user = await userResponse.json();
+                    this.users.set(conversation.userId, user);
+                }
                 avatarUrl = user.avatar_url || '/static/images/default-avatar.png';
                 name = user.username;
                 isOnline = user.is_online;
-                this.users.set(conversation.userId, user);
             } catch (error) {
                 console.error('Error loading user:', error);
                 avatarUrl = '/static/images/default-avatar.png';
@@ -927,31 +931,37 @@ class WebChatApp {
         }
     }
 
+    getMessagesUrl() {
+        if (this.currentConversation.type === 'direct') {
+            return `/api/messages/conversation/${this.currentUser.id}/${this.currentConversation.userId}`;
+        }
+        return `/api/messages/group/${this.currentConversation.group.id}`;
+    }
+
     async loadMessages() {
         const chatMessages = document.getElementById('chat-messages');
         chatMessages.innerHTML = '';
+        this.olderMessagesCursor = null;
 
         try {
-            let messagesUrl;
-            if (this.currentConversation.type === 'direct') {
-                messagesUrl = `/api/messages/conversation/${this.currentUser.id}/${this.currentConversation.userId}`;
-            } else {
-                messagesUrl = `/api/messages/group/${this.currentConversation.group.id}`;
-            }
-
+            const messagesUrl = this.getMessagesUrl();
             console.log('Loading messages from:', messagesUrl);
             const response = await fetch(messagesUrl);
-            const messages = await response.json();
-
-            console.log('Loaded messages:', messages.length);
+            const page = await response.json();
 
-            // Sort messages by creation time
-            messages.sort((a, b) => new Date(a.created_at) - new Date(b.created_at));
+            console.log('Loaded messages:', page.items.length);
 
-            messages.forEach(message => {
+            // Pages come oldest first; keep the cursor to scroll further back
+            this.olderMessagesCursor = page.next_cursor;
+            page.items.forEach(message => {
                 this.displayMessage(message);
             });
 
+            // Opening the chat reads everything in it: one watermark, not a request per message
+            if (page.items.length > 0) {
+                this.queueReceipt('read', this.getReceiptTarget(), page.items[page.items.length - 1].id);
+            }
+
             // Force scroll to bottom after all messages are loaded
             setTimeout(() => {
                 this.scrollToBottom();
@@ -963,6 +973,39 @@ class WebChatApp {
         }
     }
 
+    async loadOlderMessages() {
+        if (!this.currentConversation || !this.olderMessagesCursor || this.loadingOlderMessages) return;
+
+        this.loadingOlderMessages = true;
+        const chatMessages = document.getElementById('chat-messages');
+        const conversationKey = this.currentConversation.key;
+
+        try {
+            const cursor = encodeURIComponent(this.olderMessagesCursor);
+            const response = await fetch(`${this.getMessagesUrl()}?before=${cursor}`);
+            const page = await response.json();
+
+            // The user may have switched conversations while this was loading
+            if (this.currentConversation?.key !== conversationKey) return;
+
+            this.olderMessagesCursor = page.next_cursor;
+
+            // Prepend while keeping the visible messages where they are
+            const previousHeight = chatMessages.scrollHeight;
+            const firstMessage = chatMessages.firstChild;
+            page.items.forEach(message => {
+                if (!chatMessages.querySelector(`[data-message-id="${message.id}"]`)) {
+                    chatMessages.insertBefore(this.createMessageElement(message), firstMessage);
+                }
+            });
+            chatMessages.scrollTop += chatMessages.scrollHeight - previousHeight;
+        } catch (error) {
+            console.error('Error loading older messages:', error);
+        } finally {
+            this.loadingOlderMessages = false;
+        }
+    }
+
     displayMessage(message) {
         const chatMessages = document.getElementById('chat-messages');
 
@@ -1015,12 +1058,19 @@ class WebChatApp {
             </div>
             <div class="chat-msg-content">
                 <div class="chat-msg-text">${this.formatMessageContent(message)}</div>
+                ${isOwner ? '<div class="chat-msg-status"></div>' : ''}
                 <div class="chat-msg-actions">
                     <button class="reaction-btn" onclick="window.chatApp.showReactionPicker(${message.id})">😊</button>
                 </div>
             </div>
         `;
 
+        if (isOwner && message.is_read) {
+            this.setMessageStatus(div, 'read');
+        } else if (isOwner && message.is_delivered) {
+            this.setMessageStatus(div, 'delivered');
+        }
+
         return div;
     }
 
@@ -1028,7 +1078,8 @@ class WebChatApp {
         if (message.message_type === 'text') {
             return this.escapeHtml(message.content);
         } else if (message.message_type === 'image') {
-            return `<img src="/api/media/${message.media_id}/view" alt="Image" style="max-width: 300px; border-radius: 10px;" />`;
+            // 480px WebP rendition (the original is served until it's rendered)
+            return `<img src="/api/media/${message.media_id}/view?size=480" data-media-id="${message.media_id}" alt="Image" style="max-width: 300px; border-radius: 10px;" />`;
         } else if (message.message_type === 'location') {
             try {
                 const locationData = JSON.parse(message.content);
@@ -1189,10 +1240,16 @@ class WebChatApp {
                 this.scrollToBottom();
             }
 
-            // Mark as delivered if not our own message
+            // The chat is open, so the message is read as it arrives
             if (message.sender_id !== this.currentUser.id) {
-                this.markMessageAsDelivered(message.id);
+                this.queueReceipt('read', this.getReceiptTarget(), message.id);
             }
+        } else if (message.sender_id !== this.currentUser.id) {
+            this.queueReceipt(
+                'delivered',
+                message.group_id ? { group_id: message.group_id } : { peer_id: message.sender_id },
+                message.id
+            );
         }
 
         // Update conversation list
@@ -1251,21 +1308,109 @@ class WebChatApp {
         }
     }
 
-    async markMessageAsDelivered(messageId) {
-        try {
-            await fetch(`/api/messages/${messageId}/delivered`, {
-                method: 'PUT'
-            });
-        } catch (error) {
-            console.error('Error marking message as delivered:', error);
+    getReceiptTarget() {
+        if (this.currentConversation.type === 'direct') {
+            return { peer_id: this.currentConversation.userId };
         }
+        return { group_id: this.currentConversation.group.id };
+    }
+
+    queueReceipt(kind, target, upTo) {
+        // Receipts are watermarks, so only the highest pending ID per conversation matters
+        const key = `${kind}:${target.peer_id ?? ''}:${target.group_id ?? ''}`;
+        const pending = this.pendingReceipts.get(key);
+        if (!pending || pending.up_to < upTo) {
+            this.pendingReceipts.set(key, { type: 'receipt', kind, up_to: upTo, ...target });
+        }
+        if (!this.receiptTimer) {
+            this.receiptTimer = setTimeout(() => this.flushReceipts(), 250);
+        }
+    }
+
+    flushReceipts() {
+        this.receiptTimer = null;
+        const receipts = [...this.pendingReceipts.values()];
+        this.pendingReceipts.clear();
+
+        receipts.forEach(receipt => {
+            if (this.websocket && this.websocket.readyState === WebSocket.OPEN) {
+                this.websocket.send(JSON.stringify(receipt));
+            } else {
+                const { type, ...body } = receipt;
+                fetch(`/api/receipts/?user_id=${this.currentUser.id}`, {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify(body)
+                }).catch(error => console.error('Error sending receipt:', error));
+            }
+        });
+    }
+
+    handleReceipt(data) {
+        // Someone read or received our messages up to data.up_to
+        const conversation = this.currentConversation;
+        const isCurrentConversation = conversation &&
+            ((conversation.type === 'direct' && data.peer_id === this.currentUser.id && conversation.userId === data.user_id) ||
+             (conversation.type === 'group' && conversation.group.id === data.group_id));
+        if (!isCurrentConversation) return;
+
+        document.querySelectorAll('.chat-msg.owner[data-message-id]').forEach(element => {
+            if (Number(element.dataset.messageId) <= data.up_to) {
+                this.setMessageStatus(element, data.kind);
+            }
+        });
+    }
+
+    setMessageStatus(element, kind) {
+        const status = element.querySelector('.chat-msg-status');
+        if (!status || status.classList.contains('read')) return;
+        status.classList.add(kind);
+        status.textContent = kind === 'read' ? '✓✓' : '✓';
+    }
+
+    handleUnread(data) {
+        // The server pushes a conversation's new unread count whenever it changes
+        const key = data.group_id != null ? `group_${data.group_id}` : `user_${data.peer_id}`;
+        const conversation = this.conversations.get(key);
+        if (!conversation) return;
+
+        conversation.unreadCount = data.unread_count;
+        const element = document.querySelector(`[data-conversation-id="${key}"]`);
+        if (element) {
+            element.classList.toggle('unread', data.unread_count > 0);
+        }
+    }
+
+    handleMediaReady(data) {
+        // Images shown before their renditions existed got the original; swap in the WebP
+        const rendition = data.renditions.find(r => r.size >= 480) || data.renditions[data.renditions.length - 1];
+        if (!rendition) return;
+        // Same URL as before, so bust the cached original
+        document.querySelectorAll(`img[data-media-id="${data.media_id}"]`).forEach(img => {
+            img.src = `${rendition.url}&ready=1`;
+        });
     }
 
     updateConversationList(message) {
-        // Update the conversation in the list with new message
-        // This would involve updating the last message and timestamp
-        // For now, we'll reload conversations
-        this.loadConversations();
+        const key = message.group_id ?
+            `group_${message.group_id}` :
+            `user_${message.sender_id === this.currentUser.id ? message.receiver_id : message.sender_id}`;
+        const conversation = this.conversations.get(key);
+        if (!conversation) {
+            // First message of a new conversation: fetch the inbox to pick it up
+            this.loadConversations();
+            return;
+        }
+
+        // Move the conversation to the top; its unread count arrives as an 'unread' event
+        conversation.lastMessage = message;
+        this.conversations.delete(key);
+        this.conversations = new Map([[key, conversation], ...this.conversations]);
+        this.renderConversations().then(() => {
+            if (this.currentConversation && this.currentConversation.key === key) {
+                document.querySelector(`[data-conversation-id="${key}"]`)?.classList.add('active');
+            }
+        });
     }
 
     showNotification(message, type = 'info') {
@@ -1342,42 +1487,53 @@ class WebChatApp {
 
     handleTypingIndicator(data) {
         // Show/hide typing indicator
-        const isCurrentConversation =
-            (this.currentConversation?.type === 'direct' &&
-             data.user_id === this.currentConversation.userId) ||
-            (this.currentConversation?.type === 'group' &&
-             data.group_id === this.currentConversation.group.id);
-
-        if (isCurrentConversation) {
-            this.showTypingIndicator(data.user_id, data.is_typing);
+        if (this.currentConversation?.type === 'direct' &&
+            data.user_id === this.currentConversation.userId) {
+            this.showTypingIndicator(data.is_typing ? [data.user_id] : []);
+        } else if (this.currentConversation?.type === 'group' &&
+                   data.group_id === this.currentConversation.group.id) {
+            // Group updates carry everyone currently typing, including us
+            const typists = (data.user_ids || []).filter(id => id !== this.currentUser?.id);
+            this.showTypingIndicator(typists);
         }
     }
 
-    showTypingIndicator(userId, isTyping) {
+    showTypingIndicator(userIds) {
         const chatMessages = document.getElementById('chat-messages');
-        const existingIndicator = chatMessages.querySelector('.typing-indicator');
+        let indicator = chatMessages.querySelector('.typing-indicator');
 
-        if (isTyping) {
-            if (!existingIndicator) {
-                const user = this.users.get(userId) || { username: 'Someone' };
-                const indicator = document.createElement('div');
-                indicator.className = 'typing-indicator';
-                indicator.innerHTML = `
-                    ${user.username} is typing
-                    <div class="typing-dots">
-                        <span></span>
-                        <span></span>
-                        <span></span>
-                    </div>
-                `;
-                chatMessages.appendChild(indicator);
-                chatMessages.scrollTop = chatMessages.scrollHeight;
+        if (!userIds.length) {
+            if (indicator) {
+                indicator.remove();
             }
+            return;
+        }
+
+        const names = userIds.map(id => (this.users.get(id) || { username: 'Someone' }).username);
+        let label;
+        if (names.length === 1) {
+            label = `${names[0]} is typing`;
+        } else if (names.length === 2) {
+            label = `${names[0]} and ${names[1]} are typing`;
         } else {
-            if (existingIndicator) {
-                existingIndicator.remove();
-            }
+            label = `${names.length} people are typing`;
+        }
+
+        if (!indicator) {
+            indicator = document.createElement('div');
+            indicator.className = 'typing-indicator';
+            indicator.innerHTML = `
+                <span class="typing-label"></span>
+                <div class="typing-dots">
+                    <span></span>
+                    <span></span>
+                    <span></span>
+                </div>
+            `;
+            chatMessages.appendChild(indicator);
+            chatMessages.scrollTop = chatMessages.scrollHeight;
         }
+        indicator.querySelector('.typing-label').textContent = label;
     }
 
     async handleFileUpload(files) {
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Test script for cross-worker WebSocket routing.
+
+Runs two ConnectionManagers, standing in for two workers, on
+RedisBackplanes connected to a LocalBroker on a free port, and checks that
+frames reach sessions on the other worker, that receiver counts are
+reported per user, and that a worker stops receiving a user's frames once
+the user's last session there disconnects. Needs no Redis.
+"""
+import sys
+import asyncio
+from pathlib import Path
+
+# Add the current directory to Python path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from api.backplane import LocalBroker, RedisBackplane
+from api.websocket_manager import ConnectionManager
+
+class FakeWebSocket:
+    """Records the frames a session is sent"""
+
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message: str):
+        self.sent.append(message)
+
+    async def close(self, code: int = 1000):
+        pass
+
+async def settle():
+    # Subscriptions and deliveries cross the broker asynchronously
+    await asyncio.sleep(0.1)
+
+def test_cross_worker_routing():
+    """Frames published on one worker reach sessions held by another"""
+    async def run():
+        broker = LocalBroker(port=0)
+        await broker.start()
+        workers = [ConnectionManager(), ConnectionManager()]
+        try:
+            for worker in workers:
+                await worker.start_backplane(RedisBackplane(f"redis://127.0.0.1:{broker.port}"))
+            first, second = workers
+            alice, bob = FakeWebSocket(), FakeWebSocket()
+            await first.connect(alice, 1)
+            bob_session = await second.connect(bob, 2)
+            await settle()
+
+            # User 2 has no session on the first worker
+            assert await first.send_personal_message("hello", 2) is True
+            await settle()
+            assert bob.sent == ["hello"] and alice.sent == []
+            print("✓ personal message reaches the other worker")
+
+            results = await second.send_to_many("group", [1, 2, 3])
+            assert results == {1: True, 2: True, 3: False}, results
+            await settle()
+            assert alice.sent == ["group"]
+            # Delivered locally, and not a second time through the broker
+            assert bob.sent == ["hello", "group"], bob.sent
+            print("✓ send_to_many reports receivers per user")
+
+            second.disconnect(2, bob_session)
+            await settle()
+            assert await first.send_personal_message("after", 2) is False
+            await settle()
+            assert bob.sent == ["hello", "group"], bob.sent
+            print("✓ delivery stops after the last session disconnects")
+        finally:
+            for worker in workers:
+                await worker.stop_backplane()
+            await broker.stop()
+
+    asyncio.run(run())
+
+if __name__ == "__main__":
+    try:
+        test_cross_worker_routing()
+        print("\n🎉 Backplane routing works")
+    except AssertionError as e:
+        print(f"\n❌ {e}")
+        sys.exit(1)
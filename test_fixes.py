@@ -3,14 +3,19 @@
 Test script to verify the fixes for WebChat issues
 """
 
+import os
 import asyncio
 import json
 import sys
+import tempfile
 from pathlib import Path
 
 # Add the current directory to Python path
 sys.path.insert(0, str(Path(__file__).parent))
 
+# Keep uploaded test files out of the served static/uploads directory
+os.environ["UPLOAD_DIR"] = tempfile.mkdtemp()
+
 async def test_websocket_performance():
     """Test WebSocket message handling performance"""
     try:
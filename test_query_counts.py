@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Test script that locks in the query counts of list endpoints.
+
+Each endpoint is called on a small and on a larger dataset; the number of
+SQL statements must not grow with the number of rows (no N+1 lookups).
+Runs against a scratch SQLite database unless DATABASE_URL is set.
+"""
+import os
+import sys
+import base64
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+# Add the current directory to Python path
+sys.path.insert(0, str(Path(__file__).parent))
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/query_counts.db")
+# Keep any uploads out of the served static/uploads directory
+os.environ["UPLOAD_DIR"] = tempfile.mkdtemp()
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from main import app
+from database import engine
+import models
+
+admin_credentials = base64.b64encode(
+    f"{os.getenv('ADMIN_USERNAME', 'admin')}:{os.getenv('ADMIN_PASSWORD', 'admin123')}".encode()
+).decode()
+admin_headers = {"Authorization": f"Basic {admin_credentials}"}
+
+class QueryCounter:
+    """Collects the SQL statements run on an engine"""
+
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+@contextmanager
+def count_queries(bind=engine):
+    """Count the statements executed inside the block"""
+    counter = QueryCounter()
+    event.listen(bind, "before_cursor_execute", counter)
+    try:
+        yield counter
+    finally:
+        event.remove(bind, "before_cursor_execute", counter)
+
+@contextmanager
+def assert_max_queries(limit, bind=engine):
+    """Fail if the block runs more than `limit` statements"""
+    with count_queries(bind) as counter:
+        yield counter
+    assert counter.count <= limit, (
+        f"expected at most {limit} queries, got {counter.count}:\n" + "\n".join(counter.statements)
+    )
+
+def seed(client, users, groups):
+    """Add users and groups that every other user belongs to"""
+    user_ids = [
+        client.post("/api/users/", json={"username": f"user{os.urandom(4).hex()}"}).json()["id"]
+        for _ in range(users)
+    ]
+    owner = user_ids[0]
+    for index in range(groups):
+        group = client.post("/api/groups/", params={"created_by": owner}, json={"name": f"group {index}"}).json()
+        for user_id in user_ids[1:]:
+            client.post(f"/api/groups/{group['id']}/members", params={"user_id": user_id})
+    return owner, user_ids
+
+def seed_rows(owner, user_ids):
+    """Messages and call logs aren't all reachable over REST, so write them directly"""
+    from database import SessionLocal
+    db = SessionLocal()
+    try:
+        group_ids = [group_id for (group_id,) in db.query(models.Group.id).all()]
+        for receiver_id in user_ids[1:]:
+            db.add(models.Message(sender_id=owner, receiver_id=receiver_id, content="direct"))
+            db.add(models.Message(sender_id=receiver_id, group_id=group_ids[0], content="group"))
+            db.add(models.CallLog(caller_id=owner, receiver_id=receiver_id, call_status=models.CallStatus.END))
+        db.commit()
+    finally:
+        db.close()
+
+ENDPOINTS = [
+    ("user groups", lambda owner: (f"/api/groups/user/{owner}", {})),
+    ("admin groups", lambda owner: ("/api/admin/groups", admin_headers)),
+    ("admin group members", lambda owner: ("/api/admin/groups/1/members", admin_headers)),
+    ("admin messages", lambda owner: ("/api/admin/messages", admin_headers)),
+    ("admin call logs", lambda owner: ("/api/admin/call-logs", admin_headers)),
+    ("admin dashboard", lambda owner: ("/api/admin/dashboard", admin_headers)),
+]
+
+def measure(client, owner):
+    counts = {}
+    for name, endpoint in ENDPOINTS:
+        url, headers = endpoint(owner)
+        with count_queries() as counter:
+            response = client.get(url, headers=headers)
+        assert response.status_code == 200, f"{name}: {response.status_code} {response.text}"
+        counts[name] = counter.count
+    return counts
+
+def test_list_endpoints_query_counts():
+    """Query counts stay flat as users, groups, messages and calls are added"""
+    with TestClient(app) as client:
+        owner, user_ids = seed(client, users=3, groups=2)
+        seed_rows(owner, user_ids)
+        small = measure(client, owner)
+
+        # Add more rows for the same owner and measure again
+        for index in range(8):
+            group = client.post("/api/groups/", params={"created_by": owner}, json={"name": f"more {index}"}).json()
+            for user_id in user_ids[1:]:
+                client.post(f"/api/groups/{group['id']}/members", params={"user_id": user_id})
+        more_users = [
+            client.post("/api/users/", json={"username": f"user{os.urandom(4).hex()}"}).json()["id"]
+            for _ in range(10)
+        ]
+        for user_id in more_users:
+            client.post("/api/groups/1/members", params={"user_id": user_id})
+        seed_rows(owner, more_users)
+        large = measure(client, owner)
+
+        failed = False
+        for name in small:
+            ok = small[name] == large[name]
+            failed = failed or not ok
+            print(f"{'✓' if ok else '✗'} {name}: {small[name]} queries, {large[name]} with more rows")
+        assert not failed, "query counts grew with the data"
+
+        # The user's group list is a single joined query
+        with assert_max_queries(1):
+            client.get(f"/api/groups/user/{owner}")
+
+if __name__ == "__main__":
+    try:
+        test_list_endpoints_query_counts()
+        print("\n🎉 Query counts are fixed")
+    except AssertionError as e:
+        print(f"\n❌ {e}")
+        sys.exit(1)
@@ -222,7 +222,7 @@ class WebChatTester:
                     )
                     
                     if conv_response.status_code == 200:
-                        messages = conv_response.json()
+                        messages = conv_response.json()["items"]
                         if any(msg['content'] == message_data['content'] for msg in messages):
                             print("✅ API conversation retrieval working!")
                             return True